@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from storage import db
+
+# ================= Configuration =================
+REDIS_URL = os.getenv("REDIS_URL")              # Set to run several replicas on one Redis; unset = single node as before
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "fsb:")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEADER_TTL = 15                                 # Seconds a leader lease survives without renewal
+UPDATE_CLAIM_TTL = 24 * 3600                    # A claimed update is never handled by another node within this window
+
+log = logging.getLogger("backends")
+
+
+# ================= Backend Interface =================
+class Backend(ABC):
+    # Everything a replica has to agree on with the others: FSM state, leases for
+    # singleton duties, update claims, the auto-delete queue and the link registry.
+    # Caches (dedup index, Terabox cache, vault verification, media metadata) stay
+    # in each node's SQLite; losing one only costs a cache miss. Abstract, so a
+    # backend missing a method fails when it is constructed, not mid-request.
+    networked = False
+
+    # --- State (namespaced key/value with TTL, JSON values) ---
+    @abstractmethod
+    async def get(self, namespace: str, key: Any) -> Any: ...
+    @abstractmethod
+    async def set(self, namespace: str, key: Any, value: Any, ttl: Optional[float]): ...
+    @abstractmethod
+    async def pop(self, namespace: str, key: Any) -> Any: ...
+    @abstractmethod
+    async def setdefault(self, namespace: str, key: Any, value: Any, ttl: Optional[float]) -> Any: ...  # Atomic; returns the stored value
+
+    # --- Leases and claims ---
+    @abstractmethod
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool: ...  # Take or renew
+    @abstractmethod
+    async def release(self, name: str, owner: str): ...
+    @abstractmethod
+    async def claim(self, key: str, owner: str, ttl: float) -> bool: ...  # First caller wins
+
+    # --- Auto-delete queue ---
+    @abstractmethod
+    async def schedule_deletions(self, bot: str, chat_id: int, message_ids: List[int], due_at: float): ...
+    @abstractmethod
+    async def due_deletions(self, bots: Sequence[str], until: float, limit: int) -> List[Tuple[float, str, int, int]]: ...
+    @abstractmethod
+    async def remove_deletions(self, rows: List[Tuple[str, int, int]]): ...
+    @abstractmethod
+    async def count_deletions(self) -> int: ...
+
+    # --- Links ---
+    @abstractmethod
+    async def add_link(self, link_id: str, message_ids: List[int]): ...
+    @abstractmethod
+    async def get_messages_for_link(self, link_id: str) -> List[int]: ...
+    @abstractmethod
+    async def delete_link(self, link_id: str) -> Tuple[List[int], List[int]]: ...
+    @abstractmethod
+    async def purge_links(self): ...
+    @abstractmethod
+    async def evict_messages(self, message_ids: List[int]) -> List[str]: ...
+
+    async def add_file(self, link_id: str, message_id: int):
+        await self.add_link(link_id, [message_id])
+
+    async def ping(self):
+        # Readiness probe for the shared store; raises when it can't be reached
+        pass
+
+    async def close(self):
+        pass
+
+
+# ================= Local (single node) =================
+class LocalBackend(Backend):
+    # Today's behaviour: links and the deletion queue in SQLite, this process is
+    # always the leader and wins every claim it hasn't made before.
+
+    def __init__(self):
+        self._kv: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+        self._claims: Dict[str, float] = {}
+
+    async def get(self, namespace, key):
+        value, expires_at = self._kv.get((namespace, json.dumps(key)), (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            self._kv.pop((namespace, json.dumps(key)), None)
+            return None
+        return value
+
+    async def set(self, namespace, key, value, ttl):
+        self._kv[(namespace, json.dumps(key))] = (value, time.time() + ttl if ttl is not None else None)
+
+    async def pop(self, namespace, key):
+        value = await self.get(namespace, key)
+        self._kv.pop((namespace, json.dumps(key)), None)
+        return value
+
+    async def setdefault(self, namespace, key, value, ttl):
+        existing = await self.get(namespace, key)   # No await in between: atomic on one loop
+        if existing is not None: return existing
+        await self.set(namespace, key, value, ttl)
+        return value
+
+    async def acquire(self, name, owner, ttl):
+        return True
+
+    async def release(self, name, owner):
+        pass
+
+    async def claim(self, key, owner, ttl):
+        now = time.time()
+        if self._claims.get(key, 0) > now: return False
+        if len(self._claims) > 10000:
+            self._claims = {k: exp for k, exp in self._claims.items() if exp > now}
+        self._claims[key] = now + ttl
+        return True
+
+    async def schedule_deletions(self, bot, chat_id, message_ids, due_at):
+        await db.schedule_deletions(bot, chat_id, message_ids, due_at)
+
+    async def due_deletions(self, bots, until, limit):
+        return await db.due_deletions(bots, until, limit)
+
+    async def remove_deletions(self, rows):
+        await db.remove_deletions(rows)
+
+    async def count_deletions(self):
+        return await db.count_deletions()
+
+    async def add_link(self, link_id, message_ids):
+        await db.add_link(link_id, message_ids)
+
+    async def get_messages_for_link(self, link_id):
+        return await db.get_messages_for_link(link_id)
+
+    async def delete_link(self, link_id):
+        return await db.delete_link(link_id)
+
+    async def purge_links(self):
+        await db.purge_links()
+
+    async def evict_messages(self, message_ids):
+        return await db.evict_messages(message_ids)
+
+
+# ================= Redis (several replicas) =================
+class RedisBackend(Backend):
+    # Any Redis-protocol server. Layout (all under REDIS_PREFIX):
+    #   state:<ns>:<json key>  -> JSON value, PX ttl
+    #   lease:<name>, claim:<key> -> owner, SET NX PX
+    #   deletions:<bot>        -> ZSET of JSON [chat_id, message_id] scored by due time
+    #   deletion_bots          -> SET of bots with a deletions ZSET
+    #   link:<id>              -> LIST of message ids, in file order
+    #   msg:<message_id>       -> SET of link ids using that vault message
+    #   links                  -> SET of every link id (for purge)
+    networked = True
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("REDIS_URL is set but the 'redis' package is not installed (pip install redis)")
+        self.r = aioredis.from_url(url, decode_responses=True)
+
+    def _k(self, *parts) -> str:
+        return REDIS_PREFIX + ":".join(str(p) for p in parts)
+
+    async def close(self):
+        await self.r.aclose()
+
+    async def ping(self):
+        await self.r.ping()
+
+    async def get(self, namespace, key):
+        raw = await self.r.get(self._k("state", namespace, json.dumps(key)))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, namespace, key, value, ttl):
+        await self.r.set(self._k("state", namespace, json.dumps(key)), json.dumps(value),
+                         px=int(ttl * 1000) if ttl is not None else None)
+
+    async def pop(self, namespace, key):
+        raw = await self.r.getdel(self._k("state", namespace, json.dumps(key)))
+        return json.loads(raw) if raw is not None else None
+
+    async def setdefault(self, namespace, key, value, ttl):
+        k = self._k("state", namespace, json.dumps(key))
+        px = int(ttl * 1000) if ttl is not None else None
+        while True:
+            if await self.r.set(k, json.dumps(value), nx=True, px=px):
+                return value
+            raw = await self.r.get(k)
+            if raw is not None: return json.loads(raw)
+            # Expired between SET NX and GET: try again
+
+    async def acquire(self, name, owner, ttl):
+        key = self._k("lease", name)
+        if await self.r.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        # Renew only our own lease; WATCH makes the check-and-extend atomic
+        async with self.r.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) != owner:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.pexpire(key, int(ttl * 1000))
+                await pipe.execute()
+                return True
+            except Exception as e:
+                log.debug(f"Lease renewal for {name} lost a race: {e}")
+                return False
+
+    async def release(self, name, owner):
+        key = self._k("lease", name)
+        async with self.r.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) == owner:
+                    pipe.multi()
+                    pipe.delete(key)
+                    await pipe.execute()
+                else:
+                    await pipe.unwatch()
+            except Exception:
+                pass
+
+    async def claim(self, key, owner, ttl):
+        return bool(await self.r.set(self._k("claim", key), owner, nx=True, px=int(ttl * 1000)))
+
+    async def schedule_deletions(self, bot, chat_id, message_ids, due_at):
+        # One ZSET per bot: LIMIT then only ever pages through rows the caller can delete
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.zadd(self._k("deletions", bot), {json.dumps([chat_id, m]): due_at for m in message_ids})
+            pipe.sadd(self._k("deletion_bots"), bot)
+            await pipe.execute()
+
+    async def due_deletions(self, bots, until, limit):
+        out = []
+        for bot in bots:
+            rows = await self.r.zrangebyscore(self._k("deletions", bot), "-inf", until, start=0, num=limit, withscores=True)
+            for member, due_at in rows:
+                chat_id, message_id = json.loads(member)
+                out.append((due_at, bot, chat_id, message_id))
+        out.sort()
+        return out[:limit]
+
+    async def remove_deletions(self, rows):
+        by_bot: Dict[str, List[str]] = {}
+        for bot, chat_id, message_id in rows:
+            by_bot.setdefault(bot, []).append(json.dumps([chat_id, message_id]))
+        for bot, members in by_bot.items():
+            await self.r.zrem(self._k("deletions", bot), *members)
+
+    async def count_deletions(self):
+        bots = await self.r.smembers(self._k("deletion_bots"))
+        return sum([await self.r.zcard(self._k("deletions", bot)) for bot in bots])
+
+    async def add_link(self, link_id, message_ids):
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.rpush(self._k("link", link_id), *message_ids)
+            pipe.sadd(self._k("links"), link_id)
+            for m in message_ids: pipe.sadd(self._k("msg", m), link_id)
+            await pipe.execute()
+        await db.track_messages(message_ids)   # The local verifier still sweeps them
+
+    async def get_messages_for_link(self, link_id):
+        return [int(m) for m in await self.r.lrange(self._k("link", link_id), 0, -1)]
+
+    async def delete_link(self, link_id):
+        ids = await self.get_messages_for_link(link_id)
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.delete(self._k("link", link_id))
+            pipe.srem(self._k("links"), link_id)
+            for m in ids: pipe.srem(self._k("msg", m), link_id)
+            await pipe.execute()
+        orphaned = [m for m in dict.fromkeys(ids) if not await self.r.scard(self._k("msg", m))]
+        await db.forget_messages(orphaned)
+        return ids, orphaned
+
+    async def purge_links(self):
+        link_ids = await self.r.smembers(self._k("links"))
+        keys = [self._k("link", l) for l in link_ids] + [k async for k in self.r.scan_iter(self._k("msg", "*"))]
+        for i in range(0, len(keys), 500):
+            await self.r.delete(*keys[i:i + 500])
+        await self.r.delete(self._k("links"))
+
+    async def evict_messages(self, message_ids):
+        dead_links = []
+        for m in message_ids:
+            for link_id in await self.r.smembers(self._k("msg", m)):
+                await self.r.lrem(self._k("link", link_id), 0, m)
+                if not await self.r.llen(self._k("link", link_id)):
+                    await self.r.srem(self._k("links"), link_id)
+                    dead_links.append(link_id)
+            await self.r.delete(self._k("msg", m))
+        await db.forget_messages(message_ids)
+        return dead_links
+
+
+# ================= Leader Election =================
+class Leadership:
+    # Lease-based: the holder renews every ttl/3, anyone else retries at the same
+    # pace and takes over at most `ttl` seconds after the holder dies. The only
+    # singleton duty, the auto-delete sweep, checks is_leader each round. Vault
+    # verification runs on every node: it guards that node's own SQLite caches.
+
+    def __init__(self, name: str, ttl: float = LEADER_TTL, owner: str = WORKER_ID):
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            await self._tick()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        if self.is_leader:
+            await backend.release(self.name, self.owner)   # Hand over now instead of after the lease expires
+            self.is_leader = False
+
+    async def _tick(self):
+        try:
+            leader = await backend.acquire(self.name, self.owner, self.ttl)
+        except Exception as e:
+            log.warning(f"Lease '{self.name}' check failed: {e}")
+            leader = False   # Can't prove we still hold it: step down
+        if leader != self.is_leader:
+            log.info(f"{self.owner} {'is now' if leader else 'is no longer'} leader for '{self.name}'")
+        self.is_leader = leader
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._tick()
+
+
+def make_backend() -> Backend:
+    if REDIS_URL:
+        log.info(f"Shared Redis backend as worker {WORKER_ID}")
+        return RedisBackend(REDIS_URL)
+    return LocalBackend()
+
+
+backend = make_backend()
+leader = Leadership("singleton-duties")
+
+
+async def claim_update(key: str) -> bool:
+    # Every replica receives each Telegram update. The bots claim it in a group -1
+    # handler, before any reply, upload or job: the first node to claim it handles
+    # it and the others stop propagation. A single node handles everything.
+    if not backend.networked: return True
+    return await backend.claim(f"update:{key}", WORKER_ID, UPDATE_CLAIM_TTL)
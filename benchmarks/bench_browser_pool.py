@@ -0,0 +1,80 @@
+# /stream sniff latency: cold Chromium per URL (old process_stream_link) vs browser_pool.
+#
+#   python benchmarks/bench_browser_pool.py [runs]
+#
+# Needs `playwright install chromium`. Serves benchmarks/fixtures/player.html on
+# localhost and measures launch -> stealth -> goto -> first .mp4/.m3u8 request.
+import os
+import sys
+import time
+import asyncio
+from aiohttp import web
+from playwright.async_api import async_playwright
+from playwright_stealth import stealth_async
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from browser_pool import BrowserPool, LAUNCH_ARGS, _child_rss_mb
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+PORT = 8798
+URL = f"http://127.0.0.1:{PORT}/player.html"
+
+
+async def media(request):
+    if request.match_info["name"].endswith(".m3u8"):
+        return web.Response(text="#EXTM3U\n", content_type="application/vnd.apple.mpegurl")
+    return web.Response(body=b"\0" * 1024, content_type="video/mp4")
+
+
+async def sniff(page):
+    found = asyncio.get_running_loop().create_future()
+    def on_request(req):
+        if (".mp4" in req.url or ".m3u8" in req.url) and not found.done(): found.set_result(req.url)
+    page.on("request", on_request)
+    await page.goto(URL, wait_until="domcontentloaded")
+    return await asyncio.wait_for(found, 10)
+
+
+async def cold_once():
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        page = await browser.new_page()
+        await stealth_async(page)
+        await sniff(page)
+        await browser.close()
+
+
+async def main(runs):
+    app = web.Application()
+    app.router.add_get("/media/{name}", media)
+    app.router.add_static("/", FIXTURES)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    cold = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        await cold_once()
+        cold.append(time.perf_counter() - t0)
+
+    pool = BrowserPool(size=2)
+    await pool.start()
+    warm = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        async with pool.page() as page:
+            await sniff(page)
+        warm.append(time.perf_counter() - t0)
+    rss = _child_rss_mb()
+    await pool.close()
+    await runner.cleanup()
+
+    med = lambda xs: sorted(xs)[len(xs) // 2] * 1000
+    print(f"cold launch per URL : median {med(cold):8.1f} ms")
+    print(f"warm pool           : median {med(warm):8.1f} ms  (Chromium tree RSS {rss:.0f} MB)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -0,0 +1,98 @@
+# HLS fetch: ffmpeg reading the playlist itself (old terabox.py path) vs hls.download_hls.
+#
+#   python benchmarks/bench_hls.py [segments] [latency_ms] [--aes]
+#
+# Generates a real MPEG-TS HLS stream with ffmpeg (testsrc, 2s segments), optionally
+# AES-128 encrypts it, and serves it from a local aiohttp server that adds a fixed
+# per-request latency, which is what makes sequential segment fetching slow on real CDNs.
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+from aiohttp import web
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from http_client import http
+from hls import download_hls
+
+PORT = 8797
+KEY = bytes(range(16))
+
+
+def make_fixture(folder: str, segments: int, aes: bool):
+    # Real segments so ffmpeg on both sides has something valid to remux
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc=size=1280x720:rate=30:duration={segments * 2}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-f", "hls", "-hls_time", "2", "-hls_list_size", "0",
+        "-hls_segment_filename", os.path.join(folder, "seg%04d.ts"), os.path.join(folder, "index.m3u8"),
+    ], check=True)
+    if not aes: return
+    lines = open(os.path.join(folder, "index.m3u8")).read().splitlines()
+    out, seq = [], 0
+    for line in lines:
+        if line.startswith("#EXTINF") and not any(l.startswith("#EXT-X-KEY") for l in out):
+            out.append('#EXT-X-KEY:METHOD=AES-128,URI="key.bin"')
+        if line.endswith(".ts"):
+            path = os.path.join(folder, line)
+            padder = padding.PKCS7(128).padder()
+            data = padder.update(open(path, "rb").read()) + padder.finalize()
+            enc = Cipher(algorithms.AES(KEY), modes.CBC(seq.to_bytes(16, "big"))).encryptor()
+            open(path, "wb").write(enc.update(data) + enc.finalize())
+            seq += 1
+        out.append(line)
+    open(os.path.join(folder, "index.m3u8"), "w").write("\n".join(out) + "\n")
+    open(os.path.join(folder, "key.bin"), "wb").write(KEY)
+
+
+async def serve(folder: str, latency: float) -> web.AppRunner:
+    async def handler(request):
+        await asyncio.sleep(latency)
+        path = os.path.join(folder, request.match_info["name"])
+        if not os.path.exists(path): return web.Response(status=404)
+        return web.FileResponse(path)
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+async def main(segments: int, latency: float, aes: bool):
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is required")
+    folder = tempfile.mkdtemp(prefix="hls_fixture_")
+    make_fixture(folder, segments, aes)
+    runner = await serve(folder, latency)
+    await http.start()
+    url = f"http://127.0.0.1:{PORT}/index.m3u8"
+
+    t0 = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-allowed_extensions", "ALL", "-i", url,
+        "-c", "copy", "-y", os.path.join(folder, "ffmpeg.mp4"),
+    )
+    await proc.wait()
+    sequential = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    await download_hls(url, os.path.join(folder, "hls.mp4"))
+    concurrent = time.perf_counter() - t0
+
+    await http.close()
+    await runner.cleanup()
+    print(f"{segments} segments, {latency * 1000:.0f} ms latency, aes={aes}")
+    print(f"ffmpeg -i m3u8 : {sequential:6.2f} s  ({os.path.getsize(os.path.join(folder, 'ffmpeg.mp4')) / 1e6:.1f} MB)")
+    print(f"download_hls   : {concurrent:6.2f} s  ({os.path.getsize(os.path.join(folder, 'hls.mp4')) / 1e6:.1f} MB)")
+    shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    asyncio.run(main(int(args[0]) if args else 60, (int(args[1]) if len(args) > 1 else 150) / 1000, "--aes" in sys.argv))
@@ -0,0 +1,81 @@
+# Per-request latency: fresh aiohttp.ClientSession per call vs the pooled http_client.
+#
+#   python benchmarks/bench_http_pool.py [requests] [--tls]
+#
+# Serves a small JSON stub on localhost (optionally over TLS with a throwaway
+# self-signed cert, which makes the handshake cost visible) and times sequential
+# POSTs the way terabox.py used to make them and the way it makes them now.
+import os
+import ssl
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_client import HttpClient
+
+PORT = 8799
+
+
+async def stub(request):
+    await request.read()
+    return web.json_response({"status": "success", "list": [{"name": "video.mp4"}]})
+
+
+def make_tls():
+    tmp = tempfile.mkdtemp()
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-keyout", key, "-out", cert], check=True, capture_output=True)
+    server = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server.load_cert_chain(cert, key)
+    client = ssl.create_default_context(cafile=cert)
+    return server, client
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+async def main(n, tls):
+    server_ctx, client_ctx = make_tls() if tls else (None, None)
+    app = web.Application()
+    app.router.add_post("/api", stub)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT, ssl_context=server_ctx).start()
+    url = f"{'https' if tls else 'http'}://localhost:{PORT}/api"
+
+    before = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json={"url": "x"}, ssl=client_ctx or True) as resp:
+                await resp.json()
+        before.append(time.perf_counter() - t0)
+
+    pool = HttpClient()
+    await pool.start()
+    after = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        async with pool.session.post(url, json={"url": "x"}, ssl=client_ctx or True) as resp:
+            await resp.json()
+        after.append(time.perf_counter() - t0)
+    await pool.close()
+    await runner.cleanup()
+
+    b, a = percentiles(before), percentiles(after)
+    print(f"{'TLS' if tls else 'plain HTTP'}, {n} sequential requests")
+    print(f"session per request : p50 {b[0]:7.3f} ms  p95 {b[1]:7.3f} ms")
+    print(f"pooled session      : p50 {a[0]:7.3f} ms  p95 {a[1]:7.3f} ms")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    asyncio.run(main(int(args[0]) if args else 200, "--tls" in sys.argv))
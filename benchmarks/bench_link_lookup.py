@@ -0,0 +1,75 @@
+# Link lookup latency: legacy shared_files (no index) vs migrated links/link_items.
+#
+#   python benchmarks/bench_link_lookup.py                  # 10k, 1M, 10M rows
+#   python benchmarks/bench_link_lookup.py 10000 1000000    # custom sizes
+#
+# Builds a legacy DB per size, times random `/start <link_id>` lookups, runs the
+# real migrations from storage.py on the same file and times the new query.
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage
+
+ITEMS_PER_LINK = 3
+LOOKUPS = 200
+
+
+def build_legacy(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE shared_files (link_id TEXT, message_id INTEGER)")
+    conn.execute("CREATE TABLE terabox_cache (terabox_url TEXT PRIMARY KEY, message_id INTEGER)")
+    batch = []
+    for i in range(rows):
+        batch.append((f"link{i // ITEMS_PER_LINK:09d}", i))
+        if len(batch) == 100_000:
+            conn.executemany("INSERT INTO shared_files VALUES (?, ?)", batch)
+            batch.clear()
+    if batch: conn.executemany("INSERT INTO shared_files VALUES (?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def time_lookups(path, sql, link_ids):
+    conn = sqlite3.connect(path)
+    samples = []
+    for link_id in link_ids:
+        t0 = time.perf_counter()
+        conn.execute(sql, (link_id,)).fetchall()
+        samples.append(time.perf_counter() - t0)
+    conn.close()
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+def run(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        build_legacy(path, rows)
+        links = rows // ITEMS_PER_LINK
+        link_ids = [f"link{random.randrange(links):09d}" for _ in range(LOOKUPS)]
+
+        before = time_lookups(path, "SELECT message_id FROM shared_files WHERE link_id = ?", link_ids)
+
+        t0 = time.perf_counter()
+        store = storage.Storage(path)
+        conn = store._connect()
+        store._migrate(conn)
+        conn.close()
+        migrate_secs = time.perf_counter() - t0
+
+        after = time_lookups(path, "SELECT message_id FROM link_items WHERE link_id = ? ORDER BY position", link_ids)
+
+    print(f"{rows:>11,} rows | before p50 {before[0]:9.3f} ms  p99 {before[1]:9.3f} ms"
+          f" | after p50 {after[0]:7.3f} ms  p99 {after[1]:7.3f} ms | migration {migrate_secs:6.1f} s")
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 1_000_000, 10_000_000]
+    for n in sizes:
+        run(n)
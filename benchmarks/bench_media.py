@@ -0,0 +1,68 @@
+# Media probing: old get_video_info + get_thumbnail (ffprobe, then ffmpeg) vs media.inspect.
+#
+#   python benchmarks/bench_media.py [runs]
+#
+# Generates 720p/1080p/portrait test clips with ffmpeg's testsrc and times both paths
+# on each, plus a warm media.inspect call (content-hash cache hit, no process spawned).
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import media
+
+CLIPS = {"720p_30s": ("1280x720", 30), "1080p_120s": ("1920x1080", 120), "portrait_15s": ("720x1280", 15)}
+
+
+def make_clip(folder: str, name: str, size: str, seconds: int) -> str:
+    path = os.path.join(folder, f"{name}.mp4")
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc=size={size}:rate=30:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=duration={seconds}", "-c:v", "libx264", "-preset", "ultrafast", "-c:a", "aac", "-shortest", "-y", path,
+    ], check=True)
+    return path
+
+
+async def legacy(path: str):
+    # The two calls the stream path used to make back to back
+    proc = await asyncio.create_subprocess_exec("ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", path,
+                                                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    out, _ = await proc.communicate()
+    data = json.loads(out)
+    video = next(s for s in data["streams"] if s["codec_type"] == "video")
+    thumb = f"{path}_legacy.jpg"
+    proc = await asyncio.create_subprocess_exec("ffmpeg", "-i", path, "-ss", "00:00:02.000", "-vframes", "1", thumb, "-y",
+                                                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    await proc.communicate()
+    os.remove(thumb)
+    return int(video["width"]), int(video["height"]), int(float(data["format"]["duration"]))
+
+
+async def main(runs: int):
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is required")
+    folder = tempfile.mkdtemp(prefix="media_bench_")
+    for name, (size, seconds) in CLIPS.items():
+        path = make_clip(folder, name, size, seconds)
+        t_old, t_new, t_warm = [], [], []
+        for _ in range(runs):
+            t0 = time.perf_counter(); old = await legacy(path); t_old.append(time.perf_counter() - t0)
+            media.media_cache._data.clear()
+            t0 = time.perf_counter(); new = await media.inspect(path); t_new.append(time.perf_counter() - t0)
+            os.remove(new.thumb)
+            t0 = time.perf_counter(); warm = await media.inspect(path); t_warm.append(time.perf_counter() - t0)
+            os.remove(warm.thumb)
+        med = lambda xs: sorted(xs)[len(xs) // 2] * 1000
+        print(f"{name:13} legacy {med(t_old):7.1f} ms {old} | inspect {med(t_new):7.1f} ms "
+              f"{(new.width, new.height, new.duration)} | cached {med(t_warm):6.2f} ms")
+    shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -0,0 +1,55 @@
+# Per-upload overhead of building the share link: get_me() per upload vs the cached prefix.
+#
+#   python benchmarks/bench_share_link.py [rtt_ms] [uploads]
+#
+# get_me() is simulated with a fixed round trip (default 60 ms, a typical MTProto
+# RPC from a Render region); the cached path is the real links.ShareLinkBuilder.
+import os
+import sys
+import time
+import asyncio
+import secrets
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+from links import ShareLinkBuilder
+
+
+class FakeClient:
+    name = "bench"
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    async def get_me(self):
+        await asyncio.sleep(self.rtt)
+        return type("Me", (), {"username": "FileShareBenchBot"})
+
+
+async def main(rtt_ms, uploads):
+    client = FakeClient(rtt_ms / 1000)
+
+    t0 = time.perf_counter()
+    for _ in range(uploads):
+        bot_info = await client.get_me()
+        f"https://t.me/{bot_info.username}?start={secrets.token_urlsafe(8)}"
+    before = (time.perf_counter() - t0) / uploads
+
+    builder = ShareLinkBuilder()
+    await builder.start(client)
+    t0 = time.perf_counter()
+    for _ in range(uploads):
+        builder.make_share_link(secrets.token_urlsafe(8))
+    after = (time.perf_counter() - t0) / uploads
+    await builder.stop()
+
+    print(f"get_me per upload : {before * 1e3:9.3f} ms/upload")
+    print(f"cached prefix     : {after * 1e6:9.3f} us/upload")
+    print(f"10-item album     : {before * 10 * 1e3:9.1f} ms -> {after * 10 * 1e3:.4f} ms")
+
+
+if __name__ == "__main__":
+    rtt = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(main(rtt, n))
@@ -0,0 +1,97 @@
+# xapiverse credit spend: the old "CREDIT SAVER API LOOP" vs xapi.XapiResolver.
+#
+#   python benchmarks/bench_xapi.py [requests]
+#
+# Serves a local stub of the terabox-pro API and replays the same request mix through
+# both: popular shares resent many times, dead shares users keep resending, a flaky
+# share (HTTP 500 on every other call) and a full API outage at the end.
+# Every stub call counts as one credit.
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="xapi_bench_"), "bench.db"))
+PORT = 8796
+os.environ["XAPI_URL"] = f"http://127.0.0.1:{PORT}/api/terabox-pro"
+import xapi
+from http_client import http
+
+xapi.XAPI_BACKOFF = 0.05   # Keep the run short; the ratio of calls is what matters
+calls = {"n": 0}
+outage = {"on": False}
+
+
+async def stub(request):
+    calls["n"] += 1
+    await asyncio.sleep(0.02)
+    url = (await request.json())["url"]
+    if outage["on"] or ("flaky" in url and calls["n"] % 2):
+        return web.Response(status=500, text="upstream error")
+    if "dead" in url:
+        return web.json_response({"status": "failed", "message": "share not found"})
+    issued = int(time.time())
+    return web.json_response({"status": "success", "list": [{
+        "name": "video.mp4", "size_formatted": "10 MB", "duration": "01:00",
+        "stream_url": f"https://d.example/file?time={issued}&expires=8h&sign=x",
+    }]})
+
+
+async def legacy(url: str) -> bool:
+    # The loop terabox.py used to run inline: 3 tries, fixed 2s sleep (shortened here), no memory
+    for _ in range(3):
+        try:
+            async with http.session.post(os.environ["XAPI_URL"], json={"url": url}) as resp:
+                data = await resp.json(content_type=None)
+                if data.get("status") == "success" and data.get("list"): return True
+                if data.get("status") == "failed": return False
+        except Exception:
+            pass
+        await asyncio.sleep(0.05)
+    return False
+
+
+def workload(n: int):
+    shares = [f"good{i}" for i in range(20)] + [f"dead{i}" for i in range(10)] + ["flaky"]
+    weights = [5] * 20 + [3] * 10 + [4]
+    rng = random.Random(7)
+    return [rng.choices(shares, weights)[0] for _ in range(n)] + [f"good{i}" for i in range(20, 40)]
+
+
+async def replay(name, keys, fn):
+    calls["n"] = 0
+    outage["on"] = False
+    t0 = time.perf_counter()
+    for i, key in enumerate(keys):
+        if i == len(keys) - 20: outage["on"] = True   # last 20 requests: API down
+        await fn(key)
+    print(f"{name:9} {len(keys)} requests -> {calls['n']:4d} API calls (credits) in {time.perf_counter() - t0:.2f}s")
+
+
+async def main(n: int):
+    app = web.Application()
+    app.router.add_post("/api/terabox-pro", stub)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    await http.start()
+
+    async def resolver(key):
+        try: await xapi.xapi.resolve(key, f"https://terabox.example/s/1{key}")
+        except xapi.XapiError: pass
+
+    keys = workload(n)
+    await replay("legacy", keys, lambda key: legacy(f"https://terabox.example/s/1{key}"))
+    await replay("resolver", keys, resolver)
+    print("resolver stats:", xapi.xapi.stats())
+    await http.close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 300))
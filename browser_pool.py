@@ -0,0 +1,144 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from playwright_stealth import stealth_async
+
+# ================= Configuration =================
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))      # Contexts in use at once
+BROWSER_CONTEXT_MAX_USES = int(os.getenv("BROWSER_CONTEXT_MAX_USES", "20"))
+BROWSER_MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", "800"))  # Chromium tree RSS before contexts are recycled
+BROWSER_PREWARM = os.getenv("BROWSER_PREWARM", "0") == "1"
+LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--disable-gpu'
+]
+
+log = logging.getLogger("browser_pool")
+
+
+def _child_rss_mb() -> float:
+    # RSS of every process descended from us (Chromium's browser, GPU and renderer processes)
+    parents, rss = {}, {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit(): continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(pid)] = int(fields[1])
+            rss[int(pid)] = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+    me, total = os.getpid(), 0
+    for pid in rss:
+        p = parents.get(pid)
+        while p and p != me: p = parents.get(p)
+        if p == me: total += rss[pid]
+    return total / (1024 * 1024)
+
+
+# ================= Warm Browser Pool =================
+class BrowserPool:
+    # One long-lived Chromium. Pages are handed out from a bounded set of
+    # pre-stealthed BrowserContexts which are reused (cookies cleared) until they
+    # hit BROWSER_CONTEXT_MAX_USES or the Chromium tree passes BROWSER_MAX_RSS_MB.
+    # A crashed/disconnected browser is relaunched on the next checkout.
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_CONTEXT_MAX_USES, max_rss_mb: int = BROWSER_MAX_RSS_MB):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self._playwright = None
+        self._browser: Optional[Browser] = None
+        self._generation = 0
+        self._idle: List[Tuple[BrowserContext, int, int]] = []   # (context, uses, generation)
+        self._slots = asyncio.Semaphore(size)
+        self._launch_lock = asyncio.Lock()
+        self.launches = 0
+
+    async def start(self):
+        await self._ensure_browser()
+
+    async def close(self):
+        for ctx, _, _ in self._idle:
+            try: await ctx.close()
+            except Exception: pass
+        self._idle.clear()
+        if self._browser:
+            try: await self._browser.close()
+            except Exception: pass
+            self._browser = None
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _ensure_browser(self) -> Browser:
+        async with self._launch_lock:
+            if self._browser and self._browser.is_connected():
+                return self._browser
+            if self._browser:
+                log.warning("Chromium disconnected, relaunching")
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+            self._generation += 1
+            self._idle.clear()   # contexts of a dead browser are gone with it
+            self.launches += 1
+            return self._browser
+
+    async def _new_context(self, browser: Browser) -> BrowserContext:
+        ctx = await browser.new_context()
+        await stealth_async(ctx)   # init script + headers apply to every page in the context
+        return ctx
+
+    @asynccontextmanager
+    async def page(self):
+        async with self._slots:
+            browser = await self._ensure_browser()
+            if self._idle:
+                ctx, uses, generation = self._idle.pop()
+            else:
+                ctx, uses, generation = await self._new_context(browser), 0, self._generation
+            page: Optional[Page] = None
+            healthy = False
+            try:
+                page = await ctx.new_page()
+                yield page
+                healthy = True
+            finally:
+                if page:
+                    try: await page.close()
+                    except Exception: healthy = False
+                await self._release(ctx, uses + 1, generation, healthy)
+
+    async def _release(self, ctx: BrowserContext, uses: int, generation: int, healthy: bool):
+        reusable = (
+            healthy
+            and uses < self.max_uses
+            and generation == self._generation
+            and self._browser is not None and self._browser.is_connected()
+        )
+        if reusable and await asyncio.to_thread(_child_rss_mb) > self.max_rss_mb:
+            log.info("Chromium over memory budget, recycling contexts")
+            reusable = False
+            for idle_ctx, _, _ in self._idle:
+                try: await idle_ctx.close()
+                except Exception: pass
+            self._idle.clear()
+        if reusable:
+            try:
+                await ctx.clear_cookies()
+                self._idle.append((ctx, uses, generation))
+                return
+            except Exception:
+                pass
+        try: await ctx.close()
+        except Exception: pass
+
+
+browser_pool = BrowserPool()
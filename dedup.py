@@ -0,0 +1,87 @@
+import hashlib
+import asyncio
+import logging
+from typing import Optional
+from storage import db
+from verifier import verifier, trusted
+from metrics import cache_lookups
+
+# ================= Configuration =================
+HASH_CHUNK = 4 * 1024 * 1024     # Read size when a finished file has to be hashed from disk
+
+log = logging.getLogger("dedup")
+
+
+# ================= Content Keys =================
+def new_hasher():
+    return hashlib.sha256()
+
+def content_key(hasher, size: int) -> str:
+    # Size is part of the key: a cheap second check on top of the digest
+    return f"sha256:{hasher.hexdigest()}:{size}"
+
+def _hash_file(path: str) -> str:
+    hasher, size = new_hasher(), 0
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            hasher.update(chunk)
+            size += len(chunk)
+    return content_key(hasher, size)
+
+async def hash_file(path: str) -> str:
+    # For files another tool wrote (ffmpeg remux, yt-dlp); downloads hash as they stream
+    return await asyncio.to_thread(_hash_file, path)
+
+def _media(message):
+    return getattr(message, message.media.value, None) if getattr(message, "media", None) else None
+
+def tg_key(message) -> Optional[str]:
+    # Telegram already deduplicates by content: file_unique_id is stable across resends and forwards
+    unique_id = getattr(_media(message), "file_unique_id", None)
+    return f"tg:{unique_id}" if unique_id else None
+
+
+# ================= Dedup Index =================
+class DedupIndex:
+    # Maps content (SHA-256 + size of downloaded bytes, or Telegram's file_unique_id)
+    # to the vault message that already holds it. Every ingest path looks its file up
+    # before uploading; on a hit the new link just points at the existing message.
+    # Every upload records both keys, so a /download can dedup against an admin upload
+    # of the same file and vice versa.
+
+    def __init__(self):
+        self.hits = self.misses = 0
+
+    async def lookup(self, key: Optional[str]) -> Optional[int]:
+        if not key: return None
+        row = await db.find_content(key)
+        message_id = row[0] if row else None
+        if message_id and not trusted(row[1]) and verifier.client:
+            # Not vouched for lately: one get_messages beats linking to a hand-deleted post
+            try:
+                if await verifier.check([message_id]): message_id = None
+            except Exception as e:
+                log.debug(f"Dedup hit check failed, trusting the index: {e}")
+        if message_id:
+            self.hits += 1
+            log.info(f"Dedup hit {key[:24]}... -> vault message {message_id}")
+        else:
+            self.misses += 1
+        cache_lookups.inc(cache="dedup", result="hit" if message_id else "miss")
+        return message_id
+
+    async def remember(self, saved_msg, key: Optional[str] = None, size: Optional[int] = None):
+        # size: bytes ingested; re-sent Telegram media falls back to what Telegram reports
+        size = size or getattr(_media(saved_msg), "file_size", None)
+        rows = [(k, saved_msg.id, size) for k in (key, tg_key(saved_msg)) if k]
+        if not rows: return
+        try:
+            await db.index_content(rows)
+        except Exception as e:
+            log.warning(f"Dedup index write failed: {e}")   # Only costs a future duplicate upload
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+dedup = DedupIndex()
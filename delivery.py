@@ -0,0 +1,81 @@
+import time
+import asyncio
+import logging
+from typing import List, Tuple
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+# ================= Configuration =================
+SEND_RATE = 20               # Sustained sends/sec across the whole bot (Telegram allows ~30)
+SEND_BURST = 20              # Bucket size: short bursts above SEND_RATE
+FLOOD_RETRIES = 3
+HIDDEN_CAPTION = "\u200B"  # Strips the channel caption (it carries the access link)
+
+log = logging.getLogger("delivery")
+
+
+# ================= Shared Rate Limiter =================
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, cost: int = 1):
+        # Waiters queue on the lock, so tokens are handed out first come, first served
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float):
+        # FloodWait is bot-wide: stall every sender, not just the one that tripped it
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.blocked_until   # Refill restarts when the block lifts, no burst banked during it
+
+
+bucket = TokenBucket(SEND_RATE, SEND_BURST)
+
+async def call_with_flood_wait(fn, *args, cost: int = 1, **kwargs):
+    for attempt in range(FLOOD_RETRIES + 1):
+        await bucket.acquire(cost)
+        try:
+            return await fn(*args, **kwargs)
+        except FloodWait as e:
+            if attempt == FLOOD_RETRIES: raise
+            log.warning(f"FloodWait {e.value}s on {getattr(fn, '__name__', fn)}, pausing all sends")
+            bucket.penalize(e.value)
+
+
+# ================= Batch Delivery =================
+# Vault messages are uploaded one by one (send_video/photo/document), so they never
+# form albums: each is copied on its own, with no lookup before the copies. Copies
+# go out one after another so they land in the chat in the original file order;
+# the shared bucket still paces them against every other sender.
+async def deliver_messages(client: Client, chat_id: int, from_chat_id: int, message_ids: List[int]) -> Tuple[List[int], List[int]]:
+    # Returns (sent message ids in the original file order, source ids that failed)
+    sent_ids: List[int] = []
+    failed: List[int] = []
+    for message_id in message_ids:
+        try:
+            m = await call_with_flood_wait(
+                client.copy_message, chat_id=chat_id, from_chat_id=from_chat_id,
+                message_id=message_id, caption=HIDDEN_CAPTION
+            )
+            sent_ids.append(m.id)
+        except Exception as e:
+            log.error(f"Delivery of {message_id} to {chat_id} failed: {e}")
+            failed.append(message_id)
+    return sent_ids, failed
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+import aiofiles
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from metrics import record_download
+
+# ================= Configuration =================
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "8"))
+SEGMENT_SIZE = 16 * 1024 * 1024       # Unit of work and of resume bookkeeping
+WRITE_BUFFER = 4 * 1024 * 1024        # Bytes gathered before one positional write
+SEGMENT_RETRIES = 5
+PARTIAL_MAX_AGE = 6 * 3600            # Unfinished downloads kept this long for resume
+
+log = logging.getLogger("downloader")
+
+Progress = Optional[Callable[[int, Optional[int]], Awaitable[None]]]
+
+
+@dataclass
+class RemoteFile:
+    url: str                      # After redirects
+    status: int
+    size: Optional[int]
+    accept_ranges: bool
+    content_type: str
+    content_disposition: Optional[str]
+    etag: Optional[str] = None    # Validators: a partial is resumed only while these are unchanged
+    last_modified: Optional[str] = None
+
+
+# ================= Probe =================
+async def probe(session: aiohttp.ClientSession, url: str, headers: Optional[dict] = None) -> RemoteFile:
+    # A one-byte ranged GET answers both questions at once; HEAD is often blocked or lies
+    async with session.get(url, headers={**(headers or {}), "Range": "bytes=0-0"}, allow_redirects=True) as resp:
+        size = None
+        ranged = resp.status == 206
+        if ranged:
+            m = re.search(r"/(\d+)$", resp.headers.get("Content-Range", ""))
+            if m: size = int(m.group(1))
+        elif resp.content_length is not None:
+            size = resp.content_length
+        info = RemoteFile(
+            url=str(resp.url),
+            status=resp.status,
+            size=size,
+            accept_ranges=ranged and size is not None,
+            content_type=resp.headers.get("Content-Type", ""),
+            content_disposition=resp.headers.get("Content-Disposition"),
+            etag=resp.headers.get("ETag"),
+            last_modified=resp.headers.get("Last-Modified"),
+        )
+        if not ranged: resp.close()  # don't drain a full body we asked not to get
+    return info
+
+
+# ================= Download Engine =================
+def _state_path(dest: str) -> str:
+    return f"{dest}.state.json"
+
+def _load_state(dest: str, info: RemoteFile) -> set:
+    try:
+        with open(_state_path(dest)) as f:
+            state = json.load(f)
+        # Same size isn't enough: a file replaced by another of equal length would be
+        # stitched together, so the server's ETag / Last-Modified must be present and unchanged
+        validators = (state.get("etag"), state.get("last_modified"))
+        unchanged = any(validators) and validators == (info.etag, info.last_modified)
+        if unchanged and state["size"] == info.size and state["segment_size"] == SEGMENT_SIZE and os.path.getsize(dest) == info.size:
+            return set(state["done"])
+    except Exception:
+        pass
+    return set()
+
+def _save_state(dest: str, info: RemoteFile, done: set):
+    tmp = _state_path(dest) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"url": info.url, "size": info.size, "segment_size": SEGMENT_SIZE, "etag": info.etag,
+                   "last_modified": info.last_modified, "done": sorted(done)}, f)
+    os.replace(tmp, _state_path(dest))
+
+def prune_partials(folder: str = "downloads", max_age: float = PARTIAL_MAX_AGE):
+    # Resume keeps partial files around; drop the ones nobody came back for
+    now = time.time()
+    try:
+        for name in os.listdir(folder):
+            if not name.endswith(".state.json"): continue
+            state = os.path.join(folder, name)
+            if now - os.path.getmtime(state) > max_age:
+                for path in (state, state[:-len(".state.json")]):
+                    try: os.remove(path)
+                    except FileNotFoundError: pass
+    except FileNotFoundError:
+        pass
+
+def _pwrite(path: str, data: bytes, offset: int):
+    # Own fd per write: a cancelled worker's thread can never write into a closed/reused fd
+    fd = os.open(path, os.O_WRONLY)
+    try: os.pwrite(fd, data, offset)
+    finally: os.close(fd)
+
+def has_partial(dest: str) -> bool:
+    return os.path.exists(_state_path(dest))
+
+def _pread(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+async def download(session: aiohttp.ClientSession, url: str, dest: str, info: Optional[RemoteFile] = None,
+                   connections: int = DOWNLOAD_CONNECTIONS, progress: Progress = None, hasher=None) -> int:
+    # hasher (hashlib object, optional) is fed the file's bytes in order while it downloads
+    started = time.monotonic()
+    info = info or await probe(session, url)
+    if not info.accept_ranges or connections <= 1 or info.size < 2 * SEGMENT_SIZE:
+        size = await _download_single(session, info.url, dest, progress, hasher)
+    else:
+        size = await _download_ranged(session, info, dest, connections, progress, hasher)
+    record_download("http", size, started)
+    return size
+
+async def _download_single(session, url, dest, progress: Progress, hasher=None) -> int:
+    # Rewrites dest from scratch: a sidecar left by an earlier ranged attempt no longer describes it
+    if has_partial(dest): os.remove(_state_path(dest))
+    done = 0
+    async with session.get(url, allow_redirects=True) as resp:
+        if resp.status != 200:
+            raise Exception(f"HTTP {resp.status} - Access Denied.")
+        total = resp.content_length
+        async with aiofiles.open(dest, mode='wb') as f:
+            async for chunk in resp.content.iter_chunked(WRITE_BUFFER):
+                await f.write(chunk)
+                if hasher: hasher.update(chunk)
+                done += len(chunk)
+                if progress: await progress(done, total)
+    return done
+
+async def _download_ranged(session, info: RemoteFile, dest: str, connections: int, progress: Progress, hasher=None) -> int:
+    segments = [(i, i * SEGMENT_SIZE, min((i + 1) * SEGMENT_SIZE, info.size) - 1)
+                for i in range((info.size + SEGMENT_SIZE - 1) // SEGMENT_SIZE)]
+    done = _load_state(dest, info)
+    if done:
+        log.info(f"Resuming {dest}: {len(done)}/{len(segments)} segments already on disk")
+    else:
+        # Preallocate so every worker can pwrite() into its own region
+        with open(dest, "wb") as f:
+            f.truncate(info.size)
+        _save_state(dest, info, done)
+
+    pending = asyncio.Queue()
+    for seg in segments:
+        if seg[0] not in done: pending.put_nowait(seg)
+    received = sum(min(SEGMENT_SIZE, info.size - i * SEGMENT_SIZE) for i in done)
+    state_lock = asyncio.Lock()
+    hash_lock = asyncio.Lock()
+    hashed = 0   # Segments before this index are in the hasher
+
+    async def hash_ready():
+        # Segments finish out of order; hash the contiguous prefix as soon as it grows.
+        # They were just written, so this reads from the page cache, not the disk.
+        nonlocal hashed
+        async with hash_lock:
+            while hashed in done:
+                _, start, end = segments[hashed]
+                hasher.update(await asyncio.to_thread(_pread, dest, start, end - start + 1))
+                hashed += 1
+
+    async def fetch_segment(index, start, end):
+        nonlocal received
+        pos = start
+        for attempt in range(SEGMENT_RETRIES + 1):
+            try:
+                async with session.get(info.url, headers={"Range": f"bytes={pos}-{end}"}) as resp:
+                    if resp.status != 206:
+                        raise Exception(f"HTTP {resp.status} for range {pos}-{end}")
+                    buf = bytearray()
+                    async for chunk in resp.content.iter_chunked(1024 * 1024):
+                        buf += chunk
+                        if len(buf) >= WRITE_BUFFER:
+                            await asyncio.to_thread(_pwrite, dest, bytes(buf), pos)
+                            pos += len(buf)
+                            received += len(buf)
+                            buf.clear()
+                            if progress: await progress(received, info.size)
+                    if buf:
+                        await asyncio.to_thread(_pwrite, dest, bytes(buf), pos)
+                        pos += len(buf)
+                        received += len(buf)
+                    if pos != end + 1:
+                        raise Exception(f"Segment {index} short read ({pos - start}/{end - start + 1} bytes)")
+                return
+            except Exception as e:
+                if attempt == SEGMENT_RETRIES: raise
+                delay = min(0.5 * 2 ** attempt, 15) * (0.5 + random.random())
+                log.warning(f"Segment {index} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def worker():
+        while True:
+            try: index, start, end = pending.get_nowait()
+            except asyncio.QueueEmpty: return
+            await fetch_segment(index, start, end)
+            done.add(index)
+            async with state_lock:
+                await asyncio.to_thread(_save_state, dest, info, set(done))
+            if hasher: await hash_ready()
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(connections, len(segments)))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers: w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+    if hasher: await hash_ready()   # Segments that were already on disk from a resumed run
+    if progress: await progress(info.size, info.size)
+    os.remove(_state_path(dest))
+    return info.size
@@ -0,0 +1,72 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from typing import Dict, Tuple
+from storage import db
+from backends import backend
+from jobs import jobs
+from scheduler import scheduler
+from metrics import registry, LOOP_LAG_INTERVAL
+from singleflight import SingleFlight
+
+# ================= Configuration =================
+HEALTH_MAX_LAG = float(os.getenv("HEALTH_MAX_LAG", "2"))            # Seconds of loop lag before /healthz fails
+READY_MIN_FREE_MB = int(os.getenv("READY_MIN_FREE_MB", "1024"))     # Free space needed in DOWNLOAD_DIR
+READY_QUEUE_SATURATION = 0.9     # Job queue fill ratio at which /readyz turns away new work
+READY_PROBE_TIMEOUT = 1.0        # Seconds a DB / shared-backend probe may take
+DOWNLOAD_DIR = "downloads"
+
+log = logging.getLogger("health")
+
+Check = Dict[str, object]
+
+
+# ================= Liveness =================
+def liveness() -> Tuple[bool, Check]:
+    # Served on the bot's own loop, so answering at all proves it turns. The lag
+    # probe (metrics.py) says how late it runs; a probe that stopped reporting
+    # counts as lag too.
+    lag = registry.lag
+    if registry.lag_probed_at:
+        lag = max(lag, time.monotonic() - registry.lag_probed_at - LOOP_LAG_INTERVAL)
+    return lag <= HEALTH_MAX_LAG, {"loop_lag": round(lag, 4), "max_lag": HEALTH_MAX_LAG}
+
+
+# ================= Readiness =================
+def _mtproto() -> Check:
+    # is_started is cleared while a session reconnects after a network error
+    state = {name: bool(c.is_connected and c.session and c.session.is_started.is_set())
+             for name, c in scheduler.clients.items()}
+    return {"ok": bool(state) and all(state.values()), "clients": state}
+
+async def _database() -> Check:
+    try:
+        backlog = await asyncio.wait_for(db.ping(), READY_PROBE_TIMEOUT)
+        await asyncio.wait_for(backend.ping(), READY_PROBE_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": repr(e)}
+    return {"ok": True, "write_backlog": backlog}
+
+def _disk() -> Check:
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    free_mb = shutil.disk_usage(DOWNLOAD_DIR).free // (1024 * 1024)
+    return {"ok": free_mb >= READY_MIN_FREE_MB, "free_mb": free_mb, "min_free_mb": READY_MIN_FREE_MB}
+
+def _queue() -> Check:
+    s = jobs.stats()
+    return {"ok": s["queued"] < s["max_queue"] * READY_QUEUE_SATURATION, "queued": s["queued"], "max_queue": s["max_queue"]}
+
+async def _run_checks() -> Tuple[bool, Dict[str, Check]]:
+    checks = {"mtproto": _mtproto(), "database": await _database(), "disk": _disk(), "queue": _queue()}
+    return all(c["ok"] for c in checks.values()), checks
+
+# Pollers arriving together share one round of probes
+_inflight = SingleFlight("readyz")
+
+async def readiness() -> Tuple[bool, Dict[str, Check]]:
+    ready, checks = await _inflight.do("readyz", _run_checks)
+    if not ready:
+        log.debug(f"Not ready: {[name for name, c in checks.items() if not c['ok']]}")
+    return ready, checks
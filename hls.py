@@ -0,0 +1,143 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from http_client import http, timeout
+from playlist import Key, Segment, is_master, parse_master, parse_media
+from metrics import record_download
+from jobs import jobs
+
+# ================= Configuration =================
+HLS_CONCURRENCY = int(os.getenv("HLS_CONCURRENCY", "8"))   # Segments in flight
+HLS_WINDOW = 32                 # Max segments fetched ahead of the ffmpeg writer (bounds memory)
+HLS_SEGMENT_RETRIES = 4
+PLAYLIST_TIMEOUT = timeout(total=20)
+SEGMENT_TIMEOUT = timeout(total=120, sock_read=30)
+
+log = logging.getLogger("hls")
+
+Progress = Optional[Callable[[int, Optional[int]], Awaitable[None]]]
+
+
+class HLSError(Exception):
+    pass
+
+
+# ================= Helpers =================
+async def _get(url: str, headers: dict, byterange: Optional[tuple] = None, to=SEGMENT_TIMEOUT) -> bytes:
+    if byterange:
+        length, offset = byterange
+        headers = {**headers, "Range": f"bytes={offset}-{offset + length - 1}"}
+    async with http.session.get(url, headers=headers, timeout=to) as resp:
+        if resp.status not in (200, 206):
+            raise HLSError(f"HTTP {resp.status} for {url[:80]}")
+        return await resp.read()
+
+
+def _decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    plain = decryptor.update(data) + decryptor.finalize()
+    pad = plain[-1] if plain else 0
+    return plain[:-pad] if 0 < pad <= 16 else plain   # PKCS#7
+
+
+def pick_variant(master_text: str, base_url: str, max_height: Optional[int] = None) -> str:
+    variants = parse_master(master_text, base_url)
+    if not variants:
+        raise HLSError("Master playlist has no variants")
+    allowed = [v for v in variants if max_height is None or v.height is None or v.height <= max_height] or variants
+    return max(allowed, key=lambda v: (v.bandwidth, v.height or 0)).url
+
+
+# ================= Concurrent HLS Download =================
+async def download_hls(url: str, dest: str, headers: Optional[dict] = None, progress: Progress = None,
+                       max_height: Optional[int] = None, concurrency: int = HLS_CONCURRENCY) -> int:
+    # Fetches segments concurrently over the pooled session (bounded look-ahead
+    # window, per-segment retry, AES-128), feeds them in order into ffmpeg's
+    # stdin and remuxes once to MP4. No intermediate .ts files touch the disk.
+    started = time.monotonic()
+    headers = headers or {}
+    text = (await _get(url, headers, to=PLAYLIST_TIMEOUT)).decode("utf-8", "replace")
+    if is_master(text):
+        url = pick_variant(text, url, max_height)
+        text = (await _get(url, headers, to=PLAYLIST_TIMEOUT)).decode("utf-8", "replace")
+    pl = parse_media(text, url)
+    if not pl.segments:
+        raise HLSError("Playlist has no segments")
+    if not pl.ended:
+        raise HLSError("Live playlists are not supported")
+    if any(s.key and s.key.method != "AES-128" for s in pl.segments):
+        raise HLSError("Only AES-128 encryption is supported")
+
+    keys: Dict[str, asyncio.Task] = {}
+
+    def key_bytes(key: Key) -> asyncio.Task:
+        if key.uri not in keys:
+            keys[key.uri] = asyncio.create_task(_get(key.uri, headers, to=PLAYLIST_TIMEOUT))
+        return keys[key.uri]
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(seg: Segment) -> bytes:
+        async with sem:
+            for attempt in range(HLS_SEGMENT_RETRIES + 1):
+                try:
+                    data = await _get(seg.url, headers, seg.byterange)
+                    break
+                except Exception as e:
+                    if attempt == HLS_SEGMENT_RETRIES: raise
+                    delay = min(0.5 * 2 ** attempt, 10) * (0.5 + random.random())
+                    log.warning(f"Segment {seg.sequence} failed ({e}), retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        if seg.key:
+            iv = seg.key.iv or seg.sequence.to_bytes(16, "big")
+            data = await asyncio.to_thread(_decrypt, data, await key_bytes(seg.key), iv)
+        return data
+
+    # The remux is fed while segments download, so the ffmpeg slot is held for the
+    # whole transfer: LIMIT_FFMPEG bounds these processes too, not only probes
+    async with jobs.resource("ffmpeg"):
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+            "-c", "copy", "-movflags", "+faststart", "-f", "mp4", "-y", dest,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        segments = pl.segments
+        inflight: Dict[int, asyncio.Task] = {}
+        written = 0
+        try:
+            if pl.map_url:   # fMP4 init section goes first
+                init = await _get(pl.map_url, headers)
+                proc.stdin.write(init)
+                written += len(init)
+            for i in range(len(segments)):
+                # Keep up to HLS_WINDOW segments scheduled ahead of the one being written
+                for j in range(i, min(i + HLS_WINDOW, len(segments))):
+                    if j not in inflight:
+                        inflight[j] = asyncio.create_task(fetch(segments[j]))
+                data = await inflight.pop(i)
+                proc.stdin.write(data)
+                await proc.stdin.drain()
+                written += len(data)
+                if progress: await progress(written, written * len(segments) // (i + 1))
+            proc.stdin.close()
+            await proc.wait()
+            err = (await stderr_task).decode(errors="replace").strip()
+            if proc.returncode != 0:
+                raise HLSError(f"ffmpeg exited {proc.returncode}: {err[-200:]}")
+        except BaseException:
+            for t in list(inflight.values()) + list(keys.values()): t.cancel()
+            await asyncio.gather(*inflight.values(), *keys.values(), return_exceptions=True)
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            stderr_task.cancel()
+            if os.path.exists(dest): os.remove(dest)
+            raise
+    log.info(f"HLS {len(segments)} segments, {written / (1024 * 1024):.1f} MB remuxed into {dest}")
+    record_download("hls", written, started)
+    return written
@@ -0,0 +1,55 @@
+import logging
+import aiohttp
+from typing import Optional
+
+# ================= Configuration =================
+HTTP_LIMIT = 100               # Total pooled connections
+HTTP_LIMIT_PER_HOST = 16       # Enough for one ranged download plus API calls to the same CDN
+HTTP_DNS_TTL = 300             # Seconds a resolved host is cached
+HTTP_KEEPALIVE = 30            # Seconds an idle connection stays open for reuse
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+log = logging.getLogger("http_client")
+
+
+def timeout(total: Optional[float] = None, connect: Optional[float] = 15, sock_read: Optional[float] = None) -> aiohttp.ClientTimeout:
+    # Per-request override, e.g. session.get(url, timeout=timeout(total=15))
+    return aiohttp.ClientTimeout(total=total, connect=connect, sock_read=sock_read)
+
+# No total cap by default (multi-GB downloads); a stalled socket still fails after 60s
+DEFAULT_TIMEOUT = timeout(sock_read=60)
+
+
+# ================= Pooled HTTP Client =================
+class HttpClient:
+    # One ClientSession per process: TCP/TLS connections, DNS answers and
+    # keep-alive are reused across resolve, API and download requests.
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_LIMIT,
+                limit_per_host=HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=DEFAULT_TIMEOUT, headers={"User-Agent": USER_AGENT}
+            )
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP client not started; call `await http.start()` at startup")
+        return self._session
+
+
+http = HttpClient()
@@ -0,0 +1,224 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from metrics import registry
+
+# ================= Configuration =================
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))          # Heavy jobs running at once
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))    # Queued jobs before new ones are refused
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "3"))
+RESOURCE_LIMITS = {
+    # Per-class limits inside running jobs; a job holds a class only for the stage that needs it
+    "browser": int(os.getenv("LIMIT_BROWSER", os.getenv("BROWSER_POOL_SIZE", "2"))),
+    "ffmpeg": int(os.getenv("LIMIT_FFMPEG", "2")),
+    "download": int(os.getenv("LIMIT_DOWNLOAD", "3")),
+    "upload": int(os.getenv("LIMIT_UPLOAD", "2")),
+}
+PRIORITY_ADMIN, PRIORITY_USER = 0, 10   # Lower runs first
+
+log = logging.getLogger("jobs")
+# Hold time per resource slot; the Telegram send itself is telegram_upload_seconds (metrics.py)
+resource_wait = registry.histogram("job_resource_wait_seconds", "Time spent queued for a global resource slot", ("resource",))
+resource_hold = registry.histogram("job_resource_hold_seconds", "Time a global resource slot was held", ("resource",))
+
+
+# ================= Background Tasks =================
+_background: Set[asyncio.Task] = set()
+
+def spawn(coro: Awaitable[None]) -> asyncio.Task:
+    # Fire-and-forget with a strong reference (the loop only keeps a weak one) and
+    # the exception logged when it finishes instead of lost
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_reap)
+    return task
+
+def _reap(task: asyncio.Task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception():
+        log.error(f"Background task {task.get_coro().__qualname__} failed", exc_info=task.exception())
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    vtime: int                      # Fair-queueing virtual time (per-user round)
+    seq: int
+    user_id: int = field(compare=False)
+    kind: str = field(compare=False)
+    run: Callable[[], Awaitable[None]] = field(compare=False, repr=False)
+    on_position: Optional[Callable[[int], Awaitable[None]]] = field(compare=False, default=None, repr=False)
+    on_cancel: Optional[Callable[[], Awaitable[None]]] = field(compare=False, default=None, repr=False)
+    enqueued_at: float = field(compare=False, default_factory=time.monotonic)
+
+
+# ================= Job Scheduler =================
+class JobScheduler:
+    # Handlers validate input, then submit() the heavy part and return. Jobs wait
+    # in a heap ordered by (priority, virtual time): each user's n-th pending job
+    # gets round n, so one user's burst interleaves with everyone else's instead of
+    # starving them. JOB_WORKERS jobs run at once, and inside a job the scarce
+    # resources (Chromium, ffmpeg, downloads, uploads) are taken per stage through
+    # resource(), each with its own limit.
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_MAX,
+                 max_per_user: int = JOB_MAX_PER_USER, limits: Dict[str, int] = RESOURCE_LIMITS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.limits = dict(limits)
+        self._sems = {name: asyncio.Semaphore(n) for name, n in self.limits.items()}
+        self._in_use = {name: 0 for name in self.limits}
+        self._heap: List[Job] = []
+        self._seq = itertools.count()
+        self._vtime = 0                               # vtime of the last dispatched job
+        self._last_vtime: Dict[int, int] = {}         # user -> vtime of their newest job
+        self._per_user: Dict[int, int] = {}           # user -> queued + running
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.completed = self.failed = self.rejected = 0
+        self._wait_total = 0.0
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks: t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # --- Submission ---
+    async def submit(self, user_id: int, kind: str, run: Callable[[], Awaitable[None]],
+                     priority: int = PRIORITY_USER, on_position: Optional[Callable[[int], Awaitable[None]]] = None,
+                     on_cancel: Optional[Callable[[], Awaitable[None]]] = None) -> int:
+        # Returns the 1-based queue position; raises QueueFull when refused
+        if len(self._heap) >= self.max_queue or self._per_user.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            raise QueueFull(kind)
+        vtime = max(self._vtime, self._last_vtime.get(user_id, 0)) + 1
+        self._last_vtime[user_id] = vtime
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        job = Job(priority, vtime, next(self._seq), user_id, kind, run, on_position, on_cancel)
+        heapq.heappush(self._heap, job)
+        self._wakeup.set()
+        return self.position(job)
+
+    def position(self, job: Job) -> int:
+        return 1 + sum(1 for other in self._heap if other < job)
+
+    def cancel_user(self, user_id: int) -> int:
+        # Drops the user's queued (not yet running) jobs
+        dropped = [j for j in self._heap if j.user_id == user_id]
+        if dropped:
+            self._heap = [j for j in self._heap if j.user_id != user_id]
+            heapq.heapify(self._heap)
+            for job in dropped:
+                self._release_user(user_id)
+                if job.on_cancel: spawn(self._safe_call(job.on_cancel()))
+            self._notify_positions()
+        return len(dropped)
+
+    # --- Resources ---
+    @asynccontextmanager
+    async def resource(self, name: str):
+        with resource_wait.time(resource=name):
+            await self._sems[name].acquire()
+        self._in_use[name] += 1
+        try:
+            with resource_hold.time(resource=name):
+                yield
+        finally:
+            self._in_use[name] -= 1
+            self._sems[name].release()
+
+    # --- Workers ---
+    async def _next(self) -> Job:
+        while True:
+            if self._heap:
+                job = heapq.heappop(self._heap)
+                self._vtime = max(self._vtime, job.vtime)
+                self._notify_positions()
+                return job
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def _notify_positions(self):
+        waiting = sorted(self._heap)
+        for pos, job in enumerate(waiting, 1):
+            if job.on_position:
+                spawn(self._safe_call(job.on_position(pos)))
+
+    async def _safe_call(self, coro: Awaitable[None]):
+        try: await coro
+        except Exception as e: log.debug(f"Job status callback failed: {e}")
+
+    def _release_user(self, user_id: int):
+        left = self._per_user.get(user_id, 1) - 1
+        if left > 0:
+            self._per_user[user_id] = left
+        else:
+            self._per_user.pop(user_id, None)
+            self._last_vtime.pop(user_id, None)
+
+    async def _worker(self):
+        while True:
+            job = await self._next()
+            self.running += 1
+            self._wait_total += time.monotonic() - job.enqueued_at
+            try:
+                await job.run()
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                log.exception(f"{job.kind} job for {job.user_id} failed: {e}")
+            finally:
+                self.running -= 1
+                self._release_user(job.user_id)
+
+    # --- Metrics ---
+    def stats(self) -> dict:
+        queued = list(self._heap)
+        by_kind: Dict[str, int] = {}
+        for j in queued: by_kind[j.kind] = by_kind.get(j.kind, 0) + 1
+        started = self.completed + self.failed + self.running
+        return {
+            "queued": len(queued),
+            "queued_by_kind": by_kind,
+            "running": self.running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": round(self._wait_total / started, 2) if started else 0.0,
+            "resources": {name: {"in_use": self._in_use[name], "limit": self.limits[name]} for name in self.limits},
+        }
+
+
+jobs = JobScheduler()
+
+
+@registry.collector
+def _collect_jobs():
+    s = jobs.stats()
+    yield "jobs_queue_depth", "gauge", "Jobs waiting for a worker", [({}, s["queued"])]
+    yield "jobs_queued", "gauge", "Jobs waiting for a worker by kind", [({"kind": k}, n) for k, n in s["queued_by_kind"].items()]
+    yield "jobs_running", "gauge", "Jobs being run by a worker", [({}, s["running"])]
+    yield "jobs_max_queue", "gauge", "Queue size beyond which new jobs are rejected", [({}, s["max_queue"])]
+    yield "jobs_finished_total", "counter", "Jobs by final outcome", [({"result": r}, s[r]) for r in ("completed", "failed", "rejected")]
+    yield "job_resource_in_use", "gauge", "Global resource slots taken", [({"resource": n}, r["in_use"]) for n, r in s["resources"].items()]
+    yield "job_resource_limit", "gauge", "Global resource slots available", [({"resource": n}, r["limit"]) for n, r in s["resources"].items()]
@@ -0,0 +1,42 @@
+from pyrogram import idle
+import main as file_share_bot
+import terabox as terabox_bot
+from http_client import http
+from scheduler import scheduler
+from jobs import jobs
+from links import share_links
+from backends import backend, leader
+from metrics import registry
+
+# ================= Single-Process Launcher =================
+# Both bots on one interpreter and one event loop: one SQLite writer thread instead
+# of two processes contending for bot_database.db, one HTTP pool, one deletion
+# scheduler serving both clients, one job queue with global resource limits, and
+# share links built in process from FileShareBot's own get_me(). Each bot can
+# still be started on its own (python main.py / python terabox.py).
+
+async def run():
+    await file_share_bot.start_web_server()  # Serves /healthz and /readyz for both bots
+    await registry.start()  # Event-loop lag probe (/healthz) and /metrics samplers
+    # FileShareBot first: it resolves the username terabox links are built from
+    await file_share_bot.startup()
+    await terabox_bot.startup()
+    await leader.start()  # Always this node unless REDIS_URL is set (see backends.py)
+    await scheduler.start()  # Picks up deletions that came due while we were down
+    await jobs.start()
+    await idle()
+    await jobs.stop()
+    await scheduler.stop()
+    await leader.stop()
+    await terabox_bot.shutdown()
+    await file_share_bot.shutdown()
+    await registry.stop()
+    await file_share_bot.stop_web_server()
+    await share_links.stop()
+    await http.close()
+    await backend.close()
+
+if __name__ == "__main__":
+    print("Starting FileShareBot + TeraboxBot + Web Server...")
+    # Both Clients were created on this thread and share its loop
+    file_share_bot.app.run(run())
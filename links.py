@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from typing import Optional
+from pyrogram import Client
+from storage import db
+
+# ================= Configuration =================
+IDENTITY_REFRESH = 6 * 3600     # Re-resolve the username (it can be changed in BotFather)
+IDENTITY_RETRY = 5              # Seconds between attempts while nothing is known yet
+USERNAME_META_KEY = "fileshare_bot_username"
+
+log = logging.getLogger("links")
+
+
+# ================= Share Link Builder =================
+class ShareLinkBuilder:
+    # FileShareBot resolves its own username with get_me() and publishes it in the
+    # shared DB; terabox.py started on its own reads it from there, and in the same
+    # process (launcher.py) simply shares this builder. Either way the
+    # https://t.me/<bot>?start= prefix is computed once, not per upload.
+
+    def __init__(self):
+        self.username: Optional[str] = None
+        self._prefix: Optional[str] = None
+        self._client: Optional[Client] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, client: Optional[Client] = None):
+        # client=None means "follow the username FileShareBot published"; when
+        # FileShareBot runs in this process it already drives the builder directly
+        if client is None and self._client is not None: return
+        self._client = client
+        try: await self._refresh()
+        except Exception as e: log.warning(f"Bot identity not resolved yet: {e}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def ensure(self) -> bool:
+        # For jobs that will need a link: one immediate lookup instead of waiting for
+        # the retry loop, so a missing username fails before any work is done
+        if self._prefix is None:
+            try: await self._refresh()
+            except Exception as e: log.warning(f"Bot identity not resolved yet: {e}")
+        return self._prefix is not None
+
+    def make_share_link(self, link_id: str) -> str:
+        if self._prefix is None:
+            raise RuntimeError("FileShareBot username is not known yet")
+        return self._prefix + link_id
+
+    async def _refresh(self):
+        if self._client:
+            username = (await self._client.get_me()).username
+            await db.set_meta(USERNAME_META_KEY, username)
+        else:
+            username = await db.get_meta(USERNAME_META_KEY)
+        if username and username != self.username:
+            self.username = username
+            self._prefix = f"https://t.me/{username}?start="
+            log.info(f"Share links now point at @{username}")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(IDENTITY_REFRESH if self._prefix else IDENTITY_RETRY)
+            try: await self._refresh()
+            except Exception as e: log.warning(f"Bot identity refresh failed: {e}")
+
+
+share_links = ShareLinkBuilder()
+
+def make_share_link(link_id: str) -> str:
+    return share_links.make_share_link(link_id)
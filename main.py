@@ -1,20 +1,34 @@
 import os
 import asyncio
 import logging
-import sqlite3
 import secrets
-import aiohttp
-import aiofiles
+import hashlib
 import re
 import urllib.parse
-import json
-import threading
 import yt_dlp
 from aiohttp import web
-from pyrogram import Client, filters, enums
+from pyrogram import Client, filters, enums, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from playwright.async_api import async_playwright
-from playwright_stealth import stealth_async
+from storage import db
+from delivery import deliver_messages
+from progress import ProgressReporter
+from scheduler import scheduler
+from links import share_links, make_share_link
+from state import StateStore
+from downloader import probe, download, has_partial, prune_partials
+from http_client import http
+from browser_pool import browser_pool, BROWSER_PREWARM
+from sniffer import sniff
+from ranking import rank_candidates
+from hls import download_hls
+from pipeline import can_pipeline, send_streamed
+from media import inspect
+from jobs import jobs, QueueFull, PRIORITY_ADMIN
+from dedup import dedup, new_hasher, content_key, hash_file, tg_key
+from verifier import verifier
+from backends import backend, leader, claim_update
+from metrics import registry, timed, upload_seconds
+from health import liveness, readiness
 
 # ================= Configuration =================
 API_ID = int(os.getenv("API_ID", "1234567")) 
@@ -25,6 +39,9 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", "YOUR_ADMIN_ID_HERE"))
 
 AUTO_DELETE_TIME = 300 
 TEMP_MSG_DELETE_TIME = 120 
+STATE_TTL = 3600          # Abandoned /upload, /download... modes expire after an hour
+MEDIA_GROUP_TTL = 300     # Albums arrive within seconds; keep their link id for 5 minutes
+STREAM_ATTEMPTS = 3        # Ranked streams tried in order before /stream gives up
 PORT = int(os.getenv("PORT", 8080))
 
 logging.basicConfig(level=logging.INFO)
@@ -39,112 +56,85 @@ app = Client(
 )
 
 # ================= Database Setup =================
-conn = sqlite3.connect('bot_database.db', check_same_thread=False)
-cursor = conn.cursor()
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS shared_files (
-        link_id TEXT,
-        message_id INTEGER
-    )
-''')
-conn.commit()
+db.start()  # WAL + dedicated writer thread, shared with terabox.py
 
 # ================= State Management =================
-user_states = {}       
-tracked_messages = {}  
-media_group_cache = {} 
+# TTL + LRU bounded; FSM state and tracked prompts survive restarts via SQLite
+# shared=True: with REDIS_URL set every replica sees the same state (see backends.py)
+user_states = StateStore("user_states", ttl=STATE_TTL, max_entries=10000, persist=True, shared=True)
+tracked_messages = StateStore("tracked_messages", ttl=STATE_TTL, max_entries=10000, persist=True, shared=True)
+media_group_cache = StateStore("media_group_cache", ttl=MEDIA_GROUP_TTL, max_entries=1000, shared=True)
 
-async def set_state(user_id: int, state: str): user_states[user_id] = state
-async def get_state(user_id: int): return user_states.get(user_id)
-async def clear_state(user_id: int): user_states.pop(user_id, None)
+async def set_state(user_id: int, state: str): await user_states.aset(user_id, state)
+async def get_state(user_id: int): return await user_states.aget(user_id)
+async def clear_state(user_id: int): await user_states.apop(user_id)
 
 async def track_msg(user_id: int, msg_id: int):
-    if user_id not in tracked_messages: tracked_messages[user_id] = []
-    tracked_messages[user_id].append(msg_id)
+    await tracked_messages.aset(user_id, await tracked_messages.aget(user_id, []) + [msg_id])
 
 async def wipe_tracked_msgs(client: Client, chat_id: int, user_id: int):
-    msgs = tracked_messages.get(user_id, [])
+    msgs = await tracked_messages.apop(user_id, [])
     if msgs:
         try: await client.delete_messages(chat_id, msgs)
         except Exception: pass
-    tracked_messages.pop(user_id, None)
 
 # ================= Utility Functions =================
 async def safe_delete(message):
     try: await message.delete()
     except Exception: pass
 
+# Deletions are persisted and survive restarts (see scheduler.py)
 async def delete_after(client: Client, chat_id: int, message_id: int, delay: int):
-    await asyncio.sleep(delay)
-    try: await client.delete_messages(chat_id, message_id)
-    except Exception: pass
+    await scheduler.schedule(client, chat_id, message_id, delay)
 
 async def auto_delete_batch_task(client: Client, chat_id: int, message_ids: list):
-    await asyncio.sleep(AUTO_DELETE_TIME)
-    try: await client.delete_messages(chat_id, message_ids)
-    except Exception as e: logging.error(f"Could not auto-delete: {e}")
+    await scheduler.schedule(client, chat_id, message_ids, AUTO_DELETE_TIME)
 
-# --- FFMPEG MAGIC UTILS ---
-async def get_video_info(file_path):
-    try:
-        cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", file_path]
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        stdout, _ = await process.communicate()
-        data = json.loads(stdout)
-        video_stream = next((s for s in data["streams"] if s["codec_type"] == "video"), None)
-        width = int(video_stream["width"]) if video_stream else 1280
-        height = int(video_stream["height"]) if video_stream else 720
-        duration = int(float(data["format"]["duration"]))
-        return width, height, duration
-    except Exception:
-        return 1280, 720, 0
-
-async def get_thumbnail(file_path):
-    try:
-        thumb_path = f"{file_path}_thumb.jpg"
-        cmd = ["ffmpeg", "-i", file_path, "-ss", "00:00:02.000", "-vframes", "1", thumb_path, "-y"]
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        await process.communicate()
-        if os.path.exists(thumb_path):
-            return thumb_path
-    except Exception: pass
-    return None
+# Heavy work runs on the bounded job queue (see jobs.py); handlers return right away
+async def enqueue_job(client: Client, message, kind: str, status: ProgressReporter, run):
+    async def on_position(pos: int):
+        await status.phase(f"<blockquote><code>[⏳] Queued — position {pos}. Waiting for a free worker...</code></blockquote>")
+
+    async def on_cancel():
+        await status.finish("<blockquote>🚫 <b>Removed from queue.</b></blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
 
-# --- THE SPEED HACK: Remote Metadata Extraction ---
-async def get_remote_meta(url):
-    thumb_path = f"downloads/thumb_{secrets.token_hex(4)}.jpg"
-    width, height = 1280, 720
     try:
-        cmd = [
-            "ffmpeg", 
-            "-user_agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-            "-ss", "00:00:02.000", 
-            "-i", url, 
-            "-vframes", "1", 
-            thumb_path, "-y"
-        ]
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        await process.communicate()
-        if os.path.exists(thumb_path):
-            cmd2 = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height", "-of", "csv=s=x:p=0", thumb_path]
-            process2 = await asyncio.create_subprocess_exec(*cmd2, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-            out, _ = await process2.communicate()
-            dims = out.decode().strip().split('x')
-            if len(dims) == 2: width, height = int(dims[0]), int(dims[1])
-    except Exception: pass
-    return thumb_path if os.path.exists(thumb_path) else None, width, height
+        pos = await jobs.submit(message.from_user.id, kind, run, priority=PRIORITY_ADMIN, on_position=on_position,
+                                on_cancel=on_cancel)
+    except QueueFull:
+        await status.finish("<blockquote>⚠️ <b>Server Busy.</b> Too many jobs queued, try again shortly.</blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
+        return
+    if jobs.running + pos > jobs.workers:
+        await on_position(pos)
+
+# --- FFMPEG MAGIC UTILS: duration, dimensions and thumbnail in one pass (see media.py) ---
 
 # ================= Custom Filters =================
-async def is_upload_state(_, __, message): return user_states.get(message.from_user.id) == "upload"
-async def is_delete_state(_, __, message): return user_states.get(message.from_user.id) == "delete"
-async def is_download_state(_, __, message): return user_states.get(message.from_user.id) == "download_link"
-async def is_stream_state(_, __, message): return user_states.get(message.from_user.id) == "stream_link"
+async def is_upload_state(_, __, message): return await get_state(message.from_user.id) == "upload"
+async def is_delete_state(_, __, message): return await get_state(message.from_user.id) == "delete"
+async def is_download_state(_, __, message): return await get_state(message.from_user.id) == "download_link"
+async def is_stream_state(_, __, message): return await get_state(message.from_user.id) == "stream_link"
 
 upload_filter = filters.create(is_upload_state)
 delete_filter = filters.create(is_delete_state)
 download_filter = filters.create(is_download_state)
 stream_filter = filters.create(is_stream_state)
 
+# ================= Replica Dispatch =================
+# With REDIS_URL set every replica receives each update; only the node that claims
+# it runs the handlers below (see backends.claim_update)
+@app.on_message(group=-1)
+async def claim_message(client, message):
+    if not await claim_update(f"{client.name}:{message.chat.id}:{message.id}"):
+        message.stop_propagation()
+
+@app.on_callback_query(group=-1)
+async def claim_callback(client, callback_query):
+    if not await claim_update(f"{client.name}:cb:{callback_query.id}"):
+        callback_query.stop_propagation()
+
 # ================= Commands =================
 @app.on_message(filters.command("cancel") & filters.private)
 async def cmd_cancel(client, message):
@@ -152,8 +142,9 @@ async def cmd_cancel(client, message):
     user_id = message.from_user.id
     await wipe_tracked_msgs(client, message.chat.id, user_id)
     await clear_state(user_id)
+    jobs.cancel_user(user_id)
     msg = await message.reply_text("<blockquote>🚫 <b>Action Cancelled</b>\nExited current mode safely.</blockquote>")
-    asyncio.create_task(delete_after(client, msg.chat.id, msg.id, TEMP_MSG_DELETE_TIME))
+    await delete_after(client, msg.chat.id, msg.id, TEMP_MSG_DELETE_TIME)
 
 @app.on_message(filters.command("start") & filters.private)
 async def cmd_start(client, message):
@@ -162,41 +153,35 @@ async def cmd_start(client, message):
     
     if len(args) > 1:
         link_id = args[1]
-        cursor.execute('SELECT message_id FROM shared_files WHERE link_id = ?', (link_id,))
-        results = cursor.fetchall()
+        results = await backend.get_messages_for_link(link_id)
         
         if results:
             await client.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
-            anim_msg = await message.reply_text("<blockquote><code>[🔍] Querying secure vault...</code></blockquote>")
-            await asyncio.sleep(0.5)
-            await anim_msg.edit_text("<blockquote><code>[🔐] Validating access token...</code></blockquote>")
-            await asyncio.sleep(0.5)
-            await anim_msg.edit_text("<blockquote><code>[📦] Decrypting file structure...</code></blockquote>")
-            await asyncio.sleep(0.5)
+            status = await ProgressReporter.reply(message, "<blockquote><code>[🔍] Querying secure vault...</code></blockquote>")
+            await status.phase("<blockquote><code>[🔐] Validating access token...</code></blockquote>", cosmetic=True)
+            await status.phase("<blockquote><code>[📦] Decrypting file structure...</code></blockquote>", cosmetic=True)
             
             warning_text = f"<blockquote>⏳ <b>Delivering {len(results)} file(s)...</b>\n⚠️ <i>Destruction sequence initiates in {AUTO_DELETE_TIME // 60} minutes.</i></blockquote>"
-            await anim_msg.edit_text(warning_text)
-            sent_message_ids = [anim_msg.id] 
+            await status.finish(warning_text)
+            sent_message_ids = [status.id] 
             
             await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_DOCUMENT)
-            for row in results:
-                msg_id = row[0]
-                try:
-                    sent_msg = await client.copy_message(chat_id=message.chat.id, from_chat_id=CHANNEL_ID, message_id=msg_id, caption="\u200B")
-                    sent_message_ids.append(sent_msg.id)
-                except Exception: pass
+            with timed("delivery_seconds"):
+                sent_ids, failed = await deliver_messages(client, message.chat.id, CHANNEL_ID, results)
+            sent_message_ids += sent_ids
+            verifier.recheck(failed)   # Hand-deleted vault posts get evicted instead of failing on every hit
             
             if len(sent_message_ids) > 1:
-                asyncio.create_task(auto_delete_batch_task(client, message.chat.id, sent_message_ids))
+                await auto_delete_batch_task(client, message.chat.id, sent_message_ids)
         else:
             err_msg = await message.reply_text("<blockquote>❌ <b>Access Denied</b>\nToken invalid, purged, or expired.</blockquote>")
-            asyncio.create_task(delete_after(client, err_msg.chat.id, err_msg.id, TEMP_MSG_DELETE_TIME))
+            await delete_after(client, err_msg.chat.id, err_msg.id, TEMP_MSG_DELETE_TIME)
     else:
         welcome_msg = await message.reply_text(
             "<blockquote>✨ <b>Welcome to FileShareBot</b> ✨\n"
             "🛡 <i>The ultimate tool for secure file distribution.</i></blockquote>"
         )
-        asyncio.create_task(delete_after(client, welcome_msg.chat.id, welcome_msg.id, TEMP_MSG_DELETE_TIME))
+        await delete_after(client, welcome_msg.chat.id, welcome_msg.id, TEMP_MSG_DELETE_TIME)
 
 @app.on_message(filters.command("upload") & filters.private)
 async def cmd_upload(client, message):
@@ -251,95 +236,111 @@ async def process_stream_link(client, message):
 
     if not re.match(r'^https?://', url):
         err = await message.reply_text("<blockquote>❌ <b>Invalid URL:</b>\nPlease provide a valid HTTP/HTTPS website link.</blockquote>")
-        asyncio.create_task(delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME))
+        await delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME)
         return
 
-    anim_msg = await message.reply_text("<blockquote><code>[🕵️] Deploying Headless Browser...</code></blockquote>")
-    await client.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
-
-    media_links = set()
+    status = await ProgressReporter.reply(message, "<blockquote><code>[🕵️] Deploying Headless Browser...</code></blockquote>")
+    await enqueue_job(client, message, "stream", status, lambda: stream_job(client, message, url, status))
 
-    def handle_request(request):
-        if ".mp4" in request.url or ".m3u8" in request.url:
-            media_links.add(request.url)
+async def stream_job(client, message, url, status):
+    await client.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
 
     try:
-        await anim_msg.edit_text("<blockquote><code>[🔎] Sniffing network for streams...</code></blockquote>")
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True, 
-                args=[
-                    '--no-sandbox', 
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-accelerated-2d-canvas',
-                    '--disable-gpu'
-                ]
-            )
-            page = await browser.new_page()
-            await stealth_async(page)
-            page.on("request", handle_request)
-            
-            await page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            await asyncio.sleep(5) 
-            await browser.close()
+        await status.phase("<blockquote><code>[🔎] Sniffing network for streams...</code></blockquote>")
+        # Warm, pre-stealthed context from the shared Chromium (see browser_pool.py)
+        async with jobs.resource("browser"), browser_pool.page() as page:
+            # Returns as soon as a stream shows up (+ a short grace window), see sniffer.py
+            media_links = await sniff(page, url)
             
     except Exception as e:
-        await anim_msg.edit_text(f"<blockquote>❌ <b>Sniffing Failed:</b>\n<code>{str(e)[:100]}</code></blockquote>")
-        asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
+        await status.finish(f"<blockquote>❌ <b>Sniffing Failed:</b>\n<code>{str(e)[:100]}</code></blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
         return
 
     if not media_links:
-        await anim_msg.edit_text("<blockquote>⚠️ <b>No Streams Found.</b> No .mp4 or .m3u8 elements located.</blockquote>")
-        asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
+        await status.finish("<blockquote>⚠️ <b>No Streams Found.</b> No .mp4 or .m3u8 elements located.</blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
         return
 
-    target_link = list(media_links)[0] 
-    await anim_msg.edit_text(f"<blockquote><code>[📥] Found {len(media_links)} stream(s). Downloading via yt-dlp...</code></blockquote>")
+    await status.phase(f"<blockquote><code>[⚖️] Ranking {len(media_links)} stream(s)...</code></blockquote>")
+    ranking = await rank_candidates(media_links, referer=url)
+    # Ranking drops ads/teasers/pre-rolls and probes sizes. Only when nothing could be
+    # ranked do the candidates whose probe errored get tried blind, in sniff order;
+    # the rejected ones never are.
+    targets = [(s.url, s.kind, s.label) for s in ranking.streams if s.fits]
+    if not ranking.streams:
+        targets = [(c.url, c.kind, c.kind.upper()) for c in ranking.unprobed]
+    if not targets:
+        await status.finish("<blockquote>⚠️ <b>No Suitable Stream.</b> Only ads/teasers or streams beyond the size/quality limits.</blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
+        return
 
     local_filename = None
     thumb_path = None
-    try:
-        local_filename = await asyncio.to_thread(sync_yt_dlp_download, target_link)
-        if not local_filename or not os.path.exists(local_filename):
-            raise Exception("yt-dlp failed to create file.")
-    except Exception as e:
-        await anim_msg.edit_text(f"<blockquote>❌ <b>Download Failed:</b>\n<code>{str(e)[:100]}</code></blockquote>")
-        asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
+    last_error = None
+    async with jobs.resource("download"):
+        for target_link, kind, label in targets[:STREAM_ATTEMPTS]:
+            try:
+                if kind == "hls":
+                    # Segments fetched concurrently and remuxed once (see hls.py)
+                    await status.phase(f"<blockquote><code>[📥] Downloading best stream ({label})...</code></blockquote>")
+                    local_filename = f"downloads/video_{secrets.token_hex(4)}.mp4"
+                    os.makedirs("downloads", exist_ok=True)
+                    await download_hls(target_link, local_filename, headers={"Referer": url}, progress=status.transfer(f"[📥] Downloading {label}..."))
+                else:
+                    await status.phase(f"<blockquote><code>[📥] Downloading best stream ({label}) via yt-dlp...</code></blockquote>")
+                    local_filename = await asyncio.to_thread(sync_yt_dlp_download, target_link)
+                if not local_filename or not os.path.exists(local_filename):
+                    raise Exception("Downloader failed to create file.")
+                break
+            except Exception as e:
+                last_error, local_filename = e, None
+    if not local_filename:
+        await status.finish(f"<blockquote>❌ <b>Download Failed:</b>\n<code>{str(last_error)[:100]}</code></blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
         return
 
-    await anim_msg.edit_text("<blockquote><code>[⚙️] Processing Media Engine...</code></blockquote>")
+    await status.phase("<blockquote><code>[⚙️] Processing Media Engine...</code></blockquote>")
 
     filename = os.path.basename(local_filename)
     file_ext = filename.split('.')[-1].lower() if '.' in filename else 'mp4'
 
     link_id = secrets.token_urlsafe(8)
-    bot_info = await client.get_me()
-    share_link = f"https://t.me/{bot_info.username}?start={link_id}"
+    share_link = make_share_link(link_id)
     channel_caption = f"<blockquote>🔗 <b>Secure Stream Access:</b>\n<code>{share_link}</code></blockquote>"
 
     try:
-        await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO)
-        await anim_msg.edit_text("<blockquote><code>[📤] Uploading Stream to Vault...</code></blockquote>")
-        
-        width, height, duration = await get_video_info(local_filename)
-        thumb_path = await get_thumbnail(local_filename)
-
-        saved_msg = await client.send_video(
-            chat_id=CHANNEL_ID, 
-            video=local_filename, 
-            caption=channel_caption, 
-            has_spoiler=True,
-            file_name=filename,
-            width=width,   
-            height=height,
-            duration=duration,
-            thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
-            supports_streaming=True
-        )
+        # ffmpeg / yt-dlp wrote this file, so it's hashed from disk; a hit skips probe and upload
+        content = await hash_file(local_filename)
+        existing = await dedup.lookup(content)
+        if existing:
+            await status.phase("<blockquote><code>[♻️] Already in vault, linking...</code></blockquote>")
+            await backend.add_file(link_id, existing)
+        else:
+            await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO)
+            await status.phase("<blockquote><code>[📤] Uploading Stream to Vault...</code></blockquote>")
             
-        cursor.execute('INSERT INTO shared_files (link_id, message_id) VALUES (?, ?)', (link_id, saved_msg.id))
-        conn.commit()
+            meta = await inspect(local_filename)
+            width, height, duration, thumb_path = meta.width, meta.height, meta.duration, meta.thumb
+
+            async with jobs.resource("upload"):
+                with timed(upload_seconds, source="stream", mode="file"):
+                    saved_msg = await client.send_video(
+                        chat_id=CHANNEL_ID, 
+                        video=local_filename, 
+                        caption=channel_caption, 
+                        has_spoiler=True,
+                        file_name=filename,
+                        width=width,   
+                        height=height,
+                        duration=duration,
+                        thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
+                        supports_streaming=True,
+                        progress=status.transfer("[📤] Uploading Stream to Vault...")
+                    )
+                
+            await asyncio.gather(backend.add_file(link_id, saved_msg.id),
+                                 dedup.remember(saved_msg, content, os.path.getsize(local_filename)))
 
         success_text = (
             "<blockquote>✅ <b>Stream Extraction Complete!</b>\n"
@@ -347,10 +348,10 @@ async def process_stream_link(client, message):
             "🔗 <b>Shareable Link:</b>\n"
             f"<code>{share_link}</code>"
         )
-        await anim_msg.edit_text(success_text)
+        await status.finish(success_text)
         
     except Exception as e:
-        await anim_msg.edit_text(f"<blockquote>❌ <b>Upload Error:</b>\n<code>{str(e)[:100]}</code></blockquote>")
+        await status.finish(f"<blockquote>❌ <b>Upload Error:</b>\n<code>{str(e)[:100]}</code></blockquote>")
     finally:
         if local_filename and os.path.exists(local_filename): os.remove(local_filename)
         if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
@@ -377,110 +378,165 @@ async def process_download_link(client, message):
 
     if not re.match(r'^https?://', url):
         err = await message.reply_text("<blockquote>❌ <b>Invalid URL:</b>\nPlease provide a valid HTTP/HTTPS direct link.</blockquote>")
-        asyncio.create_task(delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME))
+        await delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME)
         return
 
-    anim_msg = await message.reply_text("<blockquote><code>[⚙️] Analyzing Remote Server...</code></blockquote>")
+    status = await ProgressReporter.reply(message, "<blockquote><code>[⚙️] Analyzing Remote Server...</code></blockquote>")
+    await enqueue_job(client, message, "download", status, lambda: download_job(client, message, url, status))
+
+# Jobs for one URL share its stable local file (for resume), so they run one at a
+# time: url -> [lock, jobs holding or waiting]. The later job usually just links the
+# first one's upload through dedup.
+url_locks = {}
+
+async def download_job(client, message, url, status):
+    entry = url_locks.setdefault(url, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        if entry[0].locked():
+            await status.phase("<blockquote><code>[⏳] Same link is already downloading, waiting...</code></blockquote>")
+        async with entry[0]:
+            await fetch_url_job(client, message, url, status)
+    finally:
+        entry[1] -= 1
+        if not entry[1]: url_locks.pop(url, None)
+
+async def fetch_url_job(client, message, url, status):
     await client.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
 
     os.makedirs("downloads", exist_ok=True)
-    timeout = aiohttp.ClientTimeout(total=3600)
+    prune_partials("downloads")
     local_filename = None
     thumb_path = None
-    width, height = 1280, 720
+    width, height, duration = 1280, 720, 0
+    pipelined = False
+    hasher = new_hasher()
+    content = None
 
     try:
-        dl_headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-        }
-        async with aiohttp.ClientSession(timeout=timeout, headers=dl_headers) as session:
-            async with session.get(url, allow_redirects=True) as resp:
-                if resp.status != 200:
-                    raise Exception(f"HTTP {resp.status} - Access Denied.")
-                
-                content_type = resp.headers.get('Content-Type', '')
-                cd = resp.headers.get('Content-Disposition')
-                filename = ""
-                if cd and 'filename=' in cd:
-                    match = re.search(r'filename="?([^";]+)"?', cd)
-                    if match: filename = match.group(1)
-
-                if not filename:
-                    parsed_url = urllib.parse.urlparse(url)
-                    filename = os.path.basename(parsed_url.path)
-                
-                filename = urllib.parse.unquote(filename).split('?')[0]
-                
-                if '.' in filename:
-                    base_name, file_ext = filename.rsplit('.', 1)
-                    file_ext = file_ext.lower()
-                else:
-                    base_name, file_ext = filename, ''
+        session = http.session
+        info = await probe(session, url)
+        pipelined = can_pipeline(info)
+        if info.status not in (200, 206):
+            raise Exception(f"HTTP {info.status} - Access Denied.")
+
+        content_type = info.content_type
+        cd = info.content_disposition
+        filename = ""
+        if cd and 'filename=' in cd:
+            match = re.search(r'filename="?([^";]+)"?', cd)
+            if match: filename = match.group(1)
+
+        if not filename:
+            parsed_url = urllib.parse.urlparse(url)
+            filename = os.path.basename(parsed_url.path)
+
+        filename = urllib.parse.unquote(filename).split('?')[0]
+
+        if '.' in filename:
+            base_name, file_ext = filename.rsplit('.', 1)
+            file_ext = file_ext.lower()
+        else:
+            base_name, file_ext = filename, ''
 
-                is_video_content = 'video/' in content_type.lower()
-                video_extensions = ['mp4', 'mkv', 'webm', 'avi', 'mov', 'flv', 'mpg', 'mpeg', 'ts', 'm4v']
-                
-                if is_video_content or file_ext in video_extensions:
-                    filename = f"{base_name}.mp4"
-                    file_ext = "mp4"
-                    thumb_path, width, height = await get_remote_meta(url)
-                elif not file_ext:
-                    filename = f"{base_name}.bin"
-                    file_ext = "bin"
+        is_video_content = 'video/' in content_type.lower()
+        video_extensions = ['mp4', 'mkv', 'webm', 'avi', 'mov', 'flv', 'mpg', 'mpeg', 'ts', 'm4v']
 
-                local_filename = f"downloads/{secrets.token_hex(4)}_{filename}"
+        if is_video_content or file_ext in video_extensions:
+            filename = f"{base_name}.mp4"
+            file_ext = "mp4"
+            meta = await inspect(url)
+            thumb_path, width, height, duration = meta.thumb, meta.width, meta.height, meta.duration
+        elif not file_ext:
+            filename = f"{base_name}.bin"
+            file_ext = "bin"
+
+        # Stable name per URL: resending the same link resumes an interrupted download
+        local_filename = f"downloads/{hashlib.sha1(url.encode()).hexdigest()[:8]}_{filename}"
+
+        if pipelined:
+            local_filename = None   # Streamed straight into the upload below, never touches disk
+        else:
+            await status.phase("<blockquote><code>[📥] Downloading Data Stream...</code></blockquote>")
+            async with jobs.resource("download"):
+                # Hashed while it streams in (dedup.py), so the lookup below costs no extra pass
+                size = await download(session, url, local_filename, info=info, progress=status.transfer("[📥] Downloading Data Stream..."), hasher=hasher)
+
+            if os.path.getsize(local_filename) == 0:
+                raise Exception("Remote server returned 0 Bytes. Link expired!")
+            content = content_key(hasher, size)
 
-                await anim_msg.edit_text("<blockquote><code>[📥] Downloading Data Stream...</code></blockquote>")
-                
-                async with aiofiles.open(local_filename, mode='wb') as f:
-                    async for chunk in resp.content.iter_chunked(4 * 1024 * 1024): 
-                        await f.write(chunk)
-                        del chunk 
-                        
-                if os.path.getsize(local_filename) == 0:
-                    raise Exception("Remote server returned 0 Bytes. Link expired!")
-                        
     except Exception as e:
-        await anim_msg.edit_text(f"<blockquote>❌ <b>Download Failed:</b>\n<code>{str(e)[:100]}</code></blockquote>")
-        asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
-        if local_filename and os.path.exists(local_filename): os.remove(local_filename)
+        await status.finish(f"<blockquote>❌ <b>Download Failed:</b>\n<code>{str(e)[:100]}</code></blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
+        if local_filename and os.path.exists(local_filename) and not has_partial(local_filename): os.remove(local_filename)
         if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
         return
 
     # Upload Phase
     link_id = secrets.token_urlsafe(8)
-    bot_info = await client.get_me()
-    share_link = f"https://t.me/{bot_info.username}?start={link_id}"
+    share_link = make_share_link(link_id)
     channel_caption = f"<blockquote>🔗 <b>Secure Access Link:</b>\n<code>{share_link}</code></blockquote>"
 
     try:
-        if file_ext == "mp4":
-            await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO)
-            await anim_msg.edit_text("<blockquote><code>[📤] Uploading Video...</code></blockquote>")
-
-            saved_msg = await client.send_video(
-                chat_id=CHANNEL_ID, 
-                video=local_filename, 
-                caption=channel_caption, 
-                has_spoiler=True,
-                file_name=filename,
-                width=width,   
-                height=height,
-                thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
-                supports_streaming=True
-            )
+        # Byte-identical file already in the vault: the new link points at that message
+        existing = await dedup.lookup(content)
+        if existing:
+            await status.phase("<blockquote><code>[♻️] Already in vault, linking...</code></blockquote>")
+            await backend.add_file(link_id, existing)
         else:
-            await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_DOCUMENT)
-            await anim_msg.edit_text("<blockquote><code>[📤] Uploading Document...</code></blockquote>")
-            saved_msg = await client.send_document(
-                chat_id=CHANNEL_ID, 
-                document=local_filename, 
-                caption=channel_caption, 
-                file_name=filename
-            )
-            
-        cursor.execute('INSERT INTO shared_files (link_id, message_id) VALUES (?, ?)', (link_id, saved_msg.id))
-        conn.commit()
+            async with jobs.resource("upload"):
+                if pipelined:
+                    await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO if file_ext == "mp4" else enums.ChatAction.UPLOAD_DOCUMENT)
+                    await status.phase("<blockquote><code>[📡] Streaming to Vault...</code></blockquote>")
+                    async with jobs.resource("download"):
+                        with timed(upload_seconds, source="direct", mode="pipelined"):
+                            saved_msg = await send_streamed(
+                                client, CHANNEL_ID, session, info, filename,
+                                caption=channel_caption,
+                                video=file_ext == "mp4",
+                                has_spoiler=file_ext == "mp4",
+                                thumb=thumb_path,
+                                width=width,
+                                height=height,
+                                duration=duration,
+                                progress=status.transfer("[📡] Streaming to Vault..."),
+                                hasher=hasher
+                            )
+                    # Known only once the bytes went through; indexed for the next ingest
+                    size = info.size
+                    content = content_key(hasher, size)
+                elif file_ext == "mp4":
+                    await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO)
+                    await status.phase("<blockquote><code>[📤] Uploading Video...</code></blockquote>")
+
+                    with timed(upload_seconds, source="direct", mode="file"):
+                        saved_msg = await client.send_video(
+                            chat_id=CHANNEL_ID, 
+                            video=local_filename, 
+                            caption=channel_caption, 
+                            has_spoiler=True,
+                            file_name=filename,
+                            width=width,   
+                            height=height,
+                            duration=duration,
+                            thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
+                            supports_streaming=True,
+                            progress=status.transfer("[📤] Uploading Video...")
+                        )
+                else:
+                    await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_DOCUMENT)
+                    await status.phase("<blockquote><code>[📤] Uploading Document...</code></blockquote>")
+                    with timed(upload_seconds, source="direct", mode="file"):
+                        saved_msg = await client.send_document(
+                            chat_id=CHANNEL_ID, 
+                            document=local_filename, 
+                            caption=channel_caption, 
+                            file_name=filename,
+                            progress=status.transfer("[📤] Uploading Document...")
+                        )
+                
+            await asyncio.gather(backend.add_file(link_id, saved_msg.id), dedup.remember(saved_msg, content, size))
 
         success_text = (
             "<blockquote>✅ <b>Download & Upload Complete!</b>\n"
@@ -488,10 +544,10 @@ async def process_download_link(client, message):
             "🔗 <b>Shareable Link:</b>\n"
             f"<code>{share_link}</code>"
         )
-        await anim_msg.edit_text(success_text)
+        await status.finish(success_text)
         
     except Exception as e:
-        await anim_msg.edit_text(f"<blockquote>❌ <b>Upload Error:</b>\n<code>{str(e)[:100]}</code></blockquote>")
+        await status.finish(f"<blockquote>❌ <b>Upload Error:</b>\n<code>{str(e)[:100]}</code></blockquote>")
     finally:
         if local_filename and os.path.exists(local_filename): os.remove(local_filename)
         if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
@@ -503,7 +559,7 @@ async def process_upload_text(client, message):
     await safe_delete(message)
     err_msg = await message.reply_text("<blockquote>⚠️ <b>Invalid Payload Type!</b>\nStrictly media and documents accepted.\n💡 <i>Type /cancel to abort.</i></blockquote>")
     await track_msg(message.from_user.id, err_msg.id)
-    asyncio.create_task(delete_after(client, err_msg.chat.id, err_msg.id, TEMP_MSG_DELETE_TIME))
+    await delete_after(client, err_msg.chat.id, err_msg.id, TEMP_MSG_DELETE_TIME)
 
 @app.on_message(upload_filter & filters.media & filters.private)
 async def process_upload_media(client, message):
@@ -511,42 +567,42 @@ async def process_upload_media(client, message):
 
     is_media_group = message.media_group_id is not None
     if is_media_group:
-        if message.media_group_id in media_group_cache:
-            link_id = media_group_cache[message.media_group_id]
-            is_first = False
-            anim_msg = None
-        else:
-            link_id = secrets.token_urlsafe(8)
-            media_group_cache[message.media_group_id] = link_id
-            is_first = True
+        # One atomic get-or-set: album items handled concurrently (or on other replicas) agree on one link
+        candidate = secrets.token_urlsafe(8)
+        link_id = await media_group_cache.asetdefault(message.media_group_id, candidate)
+        is_first = link_id == candidate
+        if not is_first:
+            status = None
     else:
         link_id = secrets.token_urlsafe(8)
         is_first = True
 
-    bot_info = await client.get_me()
-    share_link = f"https://t.me/{bot_info.username}?start={link_id}"
+    share_link = make_share_link(link_id)
     original_caption = message.caption and message.caption.html or ""
     new_caption = f"{original_caption}\n\n<blockquote>🔗 <b>Secure Access Link:</b>\n<code>{share_link}</code></blockquote>".strip()
 
     if is_first:
         await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_DOCUMENT)
-        anim_msg = await message.reply_text("<blockquote><code>[⚡] Initializing secure uplink...</code>\n<code>[██░░░░░░░░] 20%</code></blockquote>")
-        await track_msg(message.from_user.id, anim_msg.id)
-        await asyncio.sleep(0.4)
-        await anim_msg.edit_text("<blockquote><code>[🔐] Encrypting payload...</code>\n<code>[██████░░░░] 60%</code></blockquote>")
-        await asyncio.sleep(0.4)
-        await anim_msg.edit_text("<blockquote><code>[📦] Finalizing database entry...</code>\n<code>[██████████] 100%</code></blockquote>")
+        status = await ProgressReporter.reply(message, "<blockquote><code>[⚡] Initializing secure uplink...</code>\n<code>[██░░░░░░░░] 20%</code></blockquote>")
+        await track_msg(message.from_user.id, status.id)
+        await status.phase("<blockquote><code>[🔐] Encrypting payload...</code>\n<code>[██████░░░░] 60%</code></blockquote>", cosmetic=True)
+        await status.phase("<blockquote><code>[📦] Finalizing database entry...</code>\n<code>[██████████] 100%</code></blockquote>", cosmetic=True)
 
     try:
-        if message.video: saved_msg = await client.send_video(chat_id=CHANNEL_ID, video=message.video.file_id, caption=new_caption, has_spoiler=True)
-        elif message.photo: saved_msg = await client.send_photo(chat_id=CHANNEL_ID, photo=message.photo.file_id, caption=new_caption)
-        elif message.document: saved_msg = await client.send_document(chat_id=CHANNEL_ID, document=message.document.file_id, caption=new_caption)
-        else: saved_msg = await client.copy_message(chat_id=CHANNEL_ID, from_chat_id=message.chat.id, message_id=message.id, caption=new_caption)
-            
-        cursor.execute('INSERT INTO shared_files (link_id, message_id) VALUES (?, ?)', (link_id, saved_msg.id))
-        conn.commit()
+        # Same Telegram file (file_unique_id) already in the vault: link it instead of resending
+        existing = await dedup.lookup(tg_key(message))
+        if existing:
+            await backend.add_file(link_id, existing)
+        else:
+            with timed(upload_seconds, source="admin", mode="file_id"):
+                if message.video: saved_msg = await client.send_video(chat_id=CHANNEL_ID, video=message.video.file_id, caption=new_caption, has_spoiler=True)
+                elif message.photo: saved_msg = await client.send_photo(chat_id=CHANNEL_ID, photo=message.photo.file_id, caption=new_caption)
+                elif message.document: saved_msg = await client.send_document(chat_id=CHANNEL_ID, document=message.document.file_id, caption=new_caption)
+                else: saved_msg = await client.copy_message(chat_id=CHANNEL_ID, from_chat_id=message.chat.id, message_id=message.id, caption=new_caption)
+                
+            await asyncio.gather(backend.add_file(link_id, saved_msg.id), dedup.remember(saved_msg))
         
-        if is_first and anim_msg:
+        if is_first and status:
             success_text = (
                 "<blockquote>✅ <b>Payload Uploaded Successfully!</b>\n"
                 "📦 <i>Secured under a single encrypted link.</i></blockquote>\n"
@@ -554,20 +610,19 @@ async def process_upload_media(client, message):
                 f"<code>{share_link}</code>\n\n"
                 "💡 <i>Transmit more files or /cancel to abort.</i>"
             )
-            await anim_msg.edit_text(success_text)
-            asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
+            await status.finish(success_text)
+            await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
             
     except Exception as e:
-        if is_first and anim_msg:
-            await anim_msg.edit_text(f"<blockquote>❌ <b>Upload Error:</b>\n<code>{e}</code></blockquote>")
-            asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
+        if is_first and status:
+            await status.finish(f"<blockquote>❌ <b>Upload Error:</b>\n<code>{e}</code></blockquote>")
+            await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
 
 # ================= Admin Panel Logic =================
 @app.on_callback_query(filters.regex("admin_clear_all"))
 async def process_clear_all(client, callback_query):
     if callback_query.from_user.id != ADMIN_ID: return
-    cursor.execute('DELETE FROM shared_files')
-    conn.commit()
+    await backend.purge_links()
     await callback_query.message.edit_text("<blockquote>✅ <b>Database Purged.</b>\nAll existing access links are now dead.</blockquote>")
 
 @app.on_callback_query(filters.regex("admin_clear_specific"))
@@ -585,21 +640,19 @@ async def process_delete_link(client, message):
 
     try:
         link_id = message.text.split("?start=")[-1]
-        cursor.execute('SELECT message_id FROM shared_files WHERE link_id = ?', (link_id,))
-        results = cursor.fetchall()
+        results, orphaned = await backend.delete_link(link_id)
         
         if results:
-            for row in results:
-                try: await client.delete_messages(CHANNEL_ID, row[0])
+            # Deduplicated vault messages stay while another link still uses them
+            if orphaned:
+                try: await client.delete_messages(CHANNEL_ID, orphaned)
                 except Exception: pass 
             
-            cursor.execute('DELETE FROM shared_files WHERE link_id = ?', (link_id,))
-            conn.commit()
             msg = await message.reply_text(f"<blockquote>✅ <b>Deletion Executed</b>\n{len(results)} file(s) permanently erased.</blockquote>")
-            asyncio.create_task(delete_after(client, msg.chat.id, msg.id, TEMP_MSG_DELETE_TIME))
+            await delete_after(client, msg.chat.id, msg.id, TEMP_MSG_DELETE_TIME)
         else:
             err = await message.reply_text("<blockquote>❌ <b>Target Not Found</b>\nLink does not exist in the registry.</blockquote>")
-            asyncio.create_task(delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME))
+            await delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME)
             
     except Exception as e:
         await message.reply_text(f"<blockquote>❌ <b>Error:</b> <code>{e}</code></blockquote>")
@@ -610,22 +663,85 @@ async def process_delete_link(client, message):
 async def handle_ping(request): 
     return web.Response(text="Bot is running smoothly on Pyrogram!")
 
-def start_web_server():
+async def handle_queue(request):
+    # Queue depth, running jobs and per-resource usage for dashboards/alerts
+    return web.json_response(jobs.stats())
+
+async def handle_metrics(request):
+    # Prometheus text format: phase histograms, cache hit/miss counters, queue and loop gauges
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def handle_healthz(request):
+    # Liveness: served by the bot's own loop, fails when that loop lags (see health.py)
+    ok, detail = liveness()
+    return web.json_response(detail, status=200 if ok else 503)
+
+async def handle_readyz(request):
+    # Readiness: MTProto sessions, DB, disk headroom and queue saturation
+    ok, checks = await readiness()
+    return web.json_response({"ready": ok, "checks": checks}, status=200 if ok else 503)
+
+web_runner = None
+
+async def start_web_server():
+    # Same loop as the bots: a stuck loop stops answering instead of reporting "running"
+    global web_runner
+    if web_runner: return
     server = web.Application()
     server.router.add_get('/', handle_ping)
-    runner = web.AppRunner(server)
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(runner.setup())
-    site = web.TCPSite(runner, '0.0.0.0', PORT)
-    loop.run_until_complete(site.start())
-    loop.run_forever()
+    server.router.add_get('/queue', handle_queue)
+    server.router.add_get('/metrics', handle_metrics)
+    server.router.add_get('/healthz', handle_healthz)
+    server.router.add_get('/readyz', handle_readyz)
+    web_runner = web.AppRunner(server, access_log=None)  # Probes poll every second
+    await web_runner.setup()
+    await web.TCPSite(web_runner, '0.0.0.0', PORT).start()
+
+async def stop_web_server():
+    global web_runner
+    if web_runner:
+        await web_runner.cleanup()
+        web_runner = None
+
+# ================= Lifecycle =================
+# startup()/shutdown() cover this bot only; shared services (HTTP pool, deletion
+# scheduler, job queue) are started and stopped by whoever runs the loop: main()
+# below when started on its own, launcher.py when both bots share one process.
+async def startup():
+    await user_states.load()
+    await tracked_messages.load()
+    await http.start()
+    await app.start()
+    await share_links.start(app)  # One get_me() here instead of one per upload
+    scheduler.register(app)
+    if BROWSER_PREWARM: await browser_pool.start()
+    verifier.attach(app, CHANNEL_ID)
+    await verifier.start()  # Sweeps the vault for hand-deleted messages (see verifier.py)
+
+async def shutdown():
+    await verifier.stop()
+    await browser_pool.close()
+    await app.stop()
+
+async def main():
+    await start_web_server()  # Bound first so the platform sees the port; /readyz says when we can work
+    await registry.start()  # Event-loop lag probe (/healthz) and /metrics samplers
+    await startup()
+    await leader.start()  # Always this node unless REDIS_URL is set (see backends.py)
+    await scheduler.start()  # Picks up deletions that came due while we were down
+    await jobs.start()
+    await idle()
+    await jobs.stop()
+    await scheduler.stop()
+    await leader.stop()
+    await share_links.stop()
+    await shutdown()
+    await registry.stop()
+    await stop_web_server()
+    await http.close()
+    await backend.close()
 
 if __name__ == "__main__":
-    print("Starting Web Server in background...")
-    # Run the web server in a completely separate daemon thread so it doesn't block the bot
-    threading.Thread(target=start_web_server, daemon=True).start()
-    
-    print("Starting Pyrogram Bot...")
+    print("Starting Pyrogram Bot + Web Server...")
     # Let Pyrogram completely control the main thread natively
-    app.run()
+    app.run(main())
@@ -0,0 +1,141 @@
+import os
+import re
+import json
+import hashlib
+import secrets
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from http_client import USER_AGENT
+from state import StateStore
+from jobs import jobs
+from metrics import timed
+
+# ================= Configuration =================
+MEDIA_TIMEOUT = float(os.getenv("MEDIA_TIMEOUT", "60"))   # A hung ffmpeg is killed after this
+THUMB_AT = 2.0                  # Seconds into the video for the thumbnail frame
+THUMB_WIDTH = 320               # Telegram's thumbnail limit
+HASH_SAMPLE = 1024 * 1024       # Head, middle and tail bytes hashed for the cache key
+DEFAULT_SIZE = (1280, 720)
+
+log = logging.getLogger("media")
+
+# Keyed by content hash (files) or URL; holds dimensions, duration and the JPEG bytes
+media_cache = StateStore("media_meta", ttl=24 * 3600, max_entries=512)
+
+
+@dataclass
+class MediaInfo:
+    width: int = DEFAULT_SIZE[0]
+    height: int = DEFAULT_SIZE[1]
+    duration: int = 0
+    thumb: Optional[str] = None     # Path of a fresh JPEG the caller owns (and deletes)
+
+
+# ================= Helpers =================
+def _content_key(path: str) -> str:
+    # Sampled hash: cheap on multi-GB files, still changes whenever the content does
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(size // 2 - HASH_SAMPLE // 2, 0), max(size - HASH_SAMPLE, 0)):
+            f.seek(offset)
+            h.update(f.read(HASH_SAMPLE))
+    return "sha1:" + h.hexdigest()
+
+
+async def _run(cmd: List[str]) -> Tuple[int, bytes, bytes]:
+    async with jobs.resource("ffmpeg"), timed("media_tool_seconds", tool=os.path.basename(cmd[0])):
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), MEDIA_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+    return proc.returncode, out, err
+
+
+def parse_ffmpeg_banner(stderr: str) -> Tuple[Optional[int], Optional[int], Optional[float]]:
+    # ffmpeg prints the input's format before it decodes anything:
+    #   Duration: 00:01:23.45, start: ...
+    #   Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p, 1920x1080 [SAR 1:1 DAR 16:9], ...
+    #   displaymatrix: rotation of -90.00 degrees
+    stderr = stderr.split("Output #", 1)[0]
+    duration = None
+    m = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if m: duration = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+    width = height = None
+    m = re.search(r"Stream #\d+:\d+.*?: Video: .*?(?<![0-9a-fx])(\d{2,5})x(\d{2,5})(?![0-9a-fx])", stderr)
+    if m: width, height = int(m.group(1)), int(m.group(2))
+    r = re.search(r"rotation of (-?\d+(?:\.\d+)?) degrees|rotate\s*:\s*(-?\d+)", stderr)
+    if r and width and abs(round(float(r.group(1) or r.group(2)))) % 180 == 90:
+        width, height = height, width
+    return width, height, duration
+
+
+def _thumb_cmd(source: str, thumb_path: str, at: float) -> List[str]:
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin"]
+    if re.match(r"^https?://", source):
+        cmd += ["-user_agent", USER_AGENT]
+    return cmd + ["-ss", f"{at:.3f}", "-i", source, "-frames:v", "1",
+                  "-vf", f"scale='min({THUMB_WIDTH},iw)':-2", "-q:v", "4", "-y", thumb_path]
+
+
+async def _ffprobe(source: str) -> Tuple[Optional[int], Optional[int], Optional[float]]:
+    _, out, _ = await _run(["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", source])
+    data = json.loads(out)
+    video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), None)
+    duration = data.get("format", {}).get("duration")
+    return (int(video["width"]) if video else None, int(video["height"]) if video else None,
+            float(duration) if duration else None)
+
+
+# ================= Single-Pass Inspection =================
+async def inspect(source: str, thumb: bool = True) -> MediaInfo:
+    # One ffmpeg run seeks to THUMB_AT, writes the thumbnail and, on stderr, reports
+    # duration and dimensions of the input. That replaces ffprobe + ffmpeg (local)
+    # and ffmpeg + ffprobe-on-the-JPEG (remote). ffprobe only runs if the banner
+    # couldn't be parsed. Results are cached by content hash, or by URL.
+    remote = bool(re.match(r"^https?://", source))
+    key = "url:" + source if remote else await asyncio.to_thread(_content_key, source)
+    thumb_path = f"downloads/thumb_{secrets.token_hex(4)}.jpg" if remote else f"{source}_thumb.jpg"
+
+    cached = media_cache.get(key)
+    if cached and (cached[3] or not thumb):
+        width, height, duration, jpeg = cached
+        if thumb and jpeg:
+            os.makedirs(os.path.dirname(thumb_path) or ".", exist_ok=True)
+            with open(thumb_path, "wb") as f: f.write(jpeg)
+        return MediaInfo(width, height, duration, thumb_path if thumb and jpeg else None)
+
+    info = MediaInfo()
+    width = height = duration = None
+    try:
+        os.makedirs(os.path.dirname(thumb_path) or ".", exist_ok=True)
+        _, _, err = await _run(_thumb_cmd(source, thumb_path, THUMB_AT))
+        width, height, duration = parse_ffmpeg_banner(err.decode(errors="replace"))
+        if not os.path.exists(thumb_path) and duration is not None and duration < THUMB_AT:
+            await _run(_thumb_cmd(source, thumb_path, 0))   # Clip shorter than the seek point
+    except Exception as e:
+        log.warning(f"ffmpeg inspection failed for {source[:80]}: {e!r}")
+
+    if width is None or duration is None:
+        try:
+            p_width, p_height, p_duration = await _ffprobe(source)
+            width, height = width or p_width, height or p_height
+            duration = duration if duration is not None else p_duration
+        except Exception as e:
+            log.warning(f"ffprobe fallback failed for {source[:80]}: {e!r}")
+
+    if width and height: info.width, info.height = width, height
+    if duration: info.duration = int(duration)
+    jpeg = None
+    if os.path.exists(thumb_path):
+        with open(thumb_path, "rb") as f: jpeg = f.read()
+        info.thumb = thumb_path if thumb else None
+        if not thumb: os.remove(thumb_path)
+    if width is not None or jpeg:
+        media_cache.set(key, (info.width, info.height, info.duration, jpeg))
+    return info
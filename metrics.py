@@ -0,0 +1,254 @@
+import time
+import asyncio
+import logging
+import functools
+import threading
+from typing import Awaitable, Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+# ================= Configuration =================
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+RATE_BUCKETS = tuple(2 ** i * 1024 * 1024 / 8 for i in range(12))   # 128 KiB/s .. 256 MiB/s
+LOOP_LAG_INTERVAL = 0.5       # Seconds between event-loop lag probes
+SAMPLE_INTERVAL = 15          # Seconds between async samplers (DB counts etc.)
+
+log = logging.getLogger("metrics")
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    if not labels: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+# ================= Metric Types =================
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()   # Safe to observe() from executor threads too
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self._labels(key))} {_fmt_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = TIME_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, upper in enumerate(self.buckets):
+                if value <= upper: counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, (list(c), t)) for k, (c, t) in self._values.items()]
+        for key, (counts, total) in items:
+            labels = self._labels(key)
+            for upper, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_fmt_labels({**labels, 'le': _fmt_value(upper)})} {count}")
+            lines.append(f"{self.name}_sum{_fmt_labels(labels)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class Timer:
+    # Context manager (with / async with) and decorator (sync or async) in one,
+    # so timing a new hot path is a single line:
+    #     with timed("thumbnail_seconds"): ...
+    #     @timed("resolve_seconds", source="api")
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+        self._started: List[float] = []
+
+    def __enter__(self):
+        self._started.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._started.pop(), **self.labels)
+        return False
+
+    async def __aenter__(self): return self.__enter__()
+    async def __aexit__(self, *exc): return self.__exit__(*exc)
+
+    def __call__(self, fn: Callable):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try: return await fn(*args, **kwargs)
+                finally: self.histogram.observe(time.perf_counter() - t0, **self.labels)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try: return fn(*args, **kwargs)
+                finally: self.histogram.observe(time.perf_counter() - t0, **self.labels)
+        return wrapper
+
+
+# ================= Registry =================
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]   # -> (name, kind, help, samples)
+
+class Registry:
+    # Metrics are created once by name (later calls return the same object). Numbers
+    # a module already keeps for its stats() are not double-counted: the module
+    # registers a collector that turns stats() into samples at scrape time, or a
+    # sampler when getting the number needs I/O.
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Collector] = []
+        self.samplers: List[Callable[[], Awaitable[None]]] = []
+        self._tasks: List[asyncio.Task] = []
+        self._lock = threading.Lock()
+        self.lag = 0.0                 # Latest loop-lag probe and when (monotonic) it ran, for /healthz
+        self.lag_probed_at = 0.0
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help or name.replace("_", " "), labelnames, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str = "", labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str = "", labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str = "", labelnames: Sequence[str] = (), buckets: Sequence[float] = TIME_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def collector(self, fn: Collector) -> Collector:
+        self.collectors.append(fn)
+        return fn
+
+    def sampler(self, fn: Callable[[], Awaitable[None]]):
+        # Async probes (DB counts...) run on the bot loop every SAMPLE_INTERVAL and set gauges
+        self.samplers.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self.metrics.values()):
+            lines += metric.render()
+        for collect in self.collectors:
+            try:
+                for name, kind, help, samples in collect():
+                    lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                    lines += [f"{name}{_fmt_labels(labels)} {_fmt_value(value)}" for labels, value in samples]
+            except Exception as e:
+                log.warning(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+        return "\n".join(lines) + "\n"
+
+    # --- Background probes ---
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._loop_lag()), asyncio.create_task(self._sample())]
+
+    async def stop(self):
+        for t in self._tasks: t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop_lag(self):
+        # A sleep that wakes late means something blocked the loop for the difference
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(time.perf_counter() - t0 - LOOP_LAG_INTERVAL, 0.0)
+            self.lag, self.lag_probed_at = lag, time.monotonic()
+            loop_lag.set(lag)
+            loop_lag_hist.observe(lag)
+
+    async def _sample(self):
+        while True:
+            for probe in self.samplers:
+                try: await probe()
+                except Exception as e: log.debug(f"Metrics sampler failed: {e}")
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+registry = Registry()
+
+def timed(metric: Union[str, Histogram], **labels) -> Timer:
+    # timed("x_seconds", phase="a") creates the histogram on first use
+    if isinstance(metric, str):
+        metric = registry.histogram(metric, labelnames=tuple(labels))
+    return metric.time(**labels)
+
+
+# ================= Shared Metrics =================
+loop_lag = registry.gauge("event_loop_lag_seconds", "Latest event-loop lag probe")
+loop_lag_hist = registry.histogram("event_loop_lag_probe_seconds", "Event-loop lag per probe",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+cache_lookups = registry.counter("cache_lookups_total", "Cache lookups by cache and result (hit/miss)", ("cache", "result"))
+download_rate = registry.histogram("download_throughput_bytes_per_second", "Average speed of each finished download", ("source",), buckets=RATE_BUCKETS)
+download_bytes = registry.counter("download_bytes_total", "Bytes fetched by finished downloads", ("source",))
+upload_seconds = registry.histogram("telegram_upload_seconds", "Vault sends to Telegram by ingest path and mode "
+                                    "(file; pipelined, which includes the source download it streams; file_id resend)", ("source", "mode"))
+
+def record_download(source: str, nbytes: int, started: float):
+    # started: time.monotonic() when the download began
+    download_bytes.inc(nbytes, source=source)
+    download_rate.observe(nbytes / max(time.monotonic() - started, 1e-3), source=source)
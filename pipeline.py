@@ -0,0 +1,160 @@
+import os
+import random
+import asyncio
+import logging
+import mimetypes
+from typing import Awaitable, Callable, Optional
+import aiohttp
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+from downloader import RemoteFile
+
+# ================= Configuration =================
+PIPELINE_UPLOAD = os.getenv("PIPELINE_UPLOAD", "0") == "1"            # Opt-in: stream remote files straight into Telegram
+PIPELINE_BUFFER = int(os.getenv("PIPELINE_BUFFER_MB", "32")) * 1024 * 1024   # RAM between downloader and uploaders
+PART_SIZE = 512 * 1024                # Telegram's maximum upload part
+PIPELINE_MIN_BYTES = 10 * 1024 * 1024 + 1   # SaveBigFilePart only; smaller files go through disk anyway
+MAX_UPLOAD_BYTES = 2000 * 1024 * 1024
+UPLOAD_WORKERS = 4                    # Same parallelism Pyrogram's save_file uses for big files
+PART_RETRIES = 3
+SOURCE_RETRIES = 3
+
+log = logging.getLogger("pipeline")
+
+Progress = Optional[Callable[[int, Optional[int]], Awaitable[None]]]
+
+
+def can_pipeline(info: RemoteFile) -> bool:
+    # Parts must be numbered up front, so the size has to be known before the first byte
+    return PIPELINE_UPLOAD and info.size is not None and PIPELINE_MIN_BYTES <= info.size <= MAX_UPLOAD_BYTES
+
+
+# ================= Streamed Upload =================
+async def stream_to_telegram(client: Client, session: aiohttp.ClientSession, info: RemoteFile, file_name: str,
+                             headers: Optional[dict] = None, progress: Progress = None, hasher=None) -> raw.types.InputFileBig:
+    # Overlaps download and upload: the HTTP body is cut into 512 KiB parts that
+    # go through a bounded queue to SaveBigFilePart workers on a media session.
+    # Peak memory is PIPELINE_BUFFER and nothing is written to disk. Pyrogram's
+    # save_file can't do this: it needs a seekable file and reads it synchronously.
+    total_parts = (info.size + PART_SIZE - 1) // PART_SIZE
+    file_id = client.rnd_id()
+    parts: asyncio.Queue = asyncio.Queue(maxsize=max(PIPELINE_BUFFER // PART_SIZE, UPLOAD_WORKERS))
+    uploaded = 0
+
+    async def produce():
+        index, attempt = 0, 0
+        while index < total_parts:
+            offset = index * PART_SIZE
+            req_headers = dict(headers or {})
+            if offset:
+                if not info.accept_ranges:
+                    raise Exception("Source dropped mid-transfer and does not support resume")
+                req_headers["Range"] = f"bytes={offset}-"
+            try:
+                async with session.get(info.url, headers=req_headers) as resp:
+                    if resp.status not in (200, 206):
+                        raise Exception(f"HTTP {resp.status} - Access Denied.")
+                    skip = 0
+                    if offset:
+                        if resp.status != 206:
+                            # Range ignored: the body starts over at byte 0, drop what was already sent
+                            skip = offset
+                        elif not resp.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                            raise Exception(f"Unexpected Content-Range {resp.headers.get('Content-Range')!r} resuming at {offset}")
+                    left = info.size - offset     # Parts are numbered from info.size: never read past it
+                    buf = bytearray()
+                    async for chunk in resp.content.iter_chunked(PART_SIZE):
+                        if skip:
+                            dropped = min(skip, len(chunk))
+                            chunk, skip = chunk[dropped:], skip - dropped
+                        chunk = chunk[:left]
+                        left -= len(chunk)
+                        buf += chunk
+                        while len(buf) >= PART_SIZE:
+                            part = bytes(buf[:PART_SIZE])
+                            if hasher: hasher.update(part)   # Parts are produced in order, each once
+                            await parts.put((index, part))
+                            del buf[:PART_SIZE]
+                            index += 1
+                        if not left: break
+                    if buf and index == total_parts - 1:
+                        if hasher: hasher.update(buf)
+                        await parts.put((index, bytes(buf)))
+                        index += 1
+                    if index < total_parts:
+                        raise Exception(f"Short read at part {index}/{total_parts}")
+            except Exception as e:
+                attempt += 1
+                if attempt > SOURCE_RETRIES or not info.accept_ranges: raise
+                delay = min(0.5 * 2 ** attempt, 10) * (0.5 + random.random())
+                log.warning(f"Source failed at part {index} ({e}), resuming in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        for _ in range(UPLOAD_WORKERS):
+            await parts.put(None)
+
+    async def upload(media: Session):
+        nonlocal uploaded
+        while True:
+            item = await parts.get()
+            if item is None: return
+            index, data = item
+            for attempt in range(PART_RETRIES + 1):
+                try:
+                    await media.invoke(raw.functions.upload.SaveBigFilePart(
+                        file_id=file_id, file_part=index, file_total_parts=total_parts, bytes=data
+                    ))
+                    break
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                except Exception:
+                    if attempt == PART_RETRIES: raise
+                    await asyncio.sleep(1 + attempt)
+            uploaded += len(data)
+            if progress: await progress(uploaded, info.size)
+
+    async with client.save_file_semaphore:
+        media = Session(client, await client.storage.dc_id(), await client.storage.auth_key(),
+                        await client.storage.test_mode(), is_media=True)
+        await media.start()
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(upload(media)) for _ in range(UPLOAD_WORKERS)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            await media.stop()
+
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+
+async def send_streamed(client: Client, chat_id: int, session: aiohttp.ClientSession, info: RemoteFile, file_name: str,
+                        caption: str = "", video: bool = False, has_spoiler: bool = False, thumb: Optional[str] = None,
+                        width: int = 0, height: int = 0, duration: int = 0, headers: Optional[dict] = None,
+                        progress: Progress = None, hasher=None) -> "types.Message":
+    # Pipelined counterpart of send_video/send_document for a remote source
+    file = await stream_to_telegram(client, session, info, file_name, headers, progress, hasher)
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if video:
+        attributes.insert(0, raw.types.DocumentAttributeVideo(supports_streaming=True, duration=duration, w=width, h=height))
+    media = raw.types.InputMediaUploadedDocument(
+        mime_type=mimetypes.guess_type(file_name)[0] or ("video/mp4" if video else "application/octet-stream"),
+        file=file,
+        spoiler=has_spoiler or None,
+        thumb=await client.save_file(thumb) if thumb and os.path.exists(thumb) else None,
+        attributes=attributes,
+    )
+    r = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        random_id=client.rnd_id(),
+        **await utils.parse_text_entities(client, caption, None, None)
+    ))
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message, {u.id: u for u in r.users}, {c.id: c for c in r.chats}
+            )
+    raise Exception("Telegram did not return the sent message")
@@ -0,0 +1,103 @@
+import re
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# ================= HLS Playlist Parsing =================
+_ATTR = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attrs(line: str) -> Dict[str, str]:
+    # '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=1280x720,CODECS="a,b"' -> {...}
+    _, _, body = line.partition(":")
+    return {k: v.strip('"') for k, v in _ATTR.findall(body)}
+
+
+@dataclass
+class Variant:
+    url: str
+    bandwidth: int = 0
+    width: Optional[int] = None
+    height: Optional[int] = None
+    codecs: str = ""
+
+
+@dataclass
+class Key:
+    method: str                # "NONE", "AES-128", "SAMPLE-AES"
+    uri: Optional[str] = None
+    iv: Optional[bytes] = None
+
+
+@dataclass
+class Segment:
+    url: str
+    duration: float
+    sequence: int
+    key: Optional[Key] = None
+    byterange: Optional[tuple] = None   # (length, offset)
+
+
+@dataclass
+class MediaPlaylist:
+    segments: List[Segment] = field(default_factory=list)
+    target_duration: float = 0.0
+    map_url: Optional[str] = None       # fMP4 init section (EXT-X-MAP)
+    ended: bool = False
+
+    @property
+    def duration(self) -> float:
+        return sum(s.duration for s in self.segments)
+
+
+def is_master(text: str) -> bool:
+    return "#EXT-X-STREAM-INF" in text
+
+
+def parse_master(text: str, base_url: str) -> List[Variant]:
+    variants, pending = [], None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            pending = parse_attrs(line)
+        elif line and not line.startswith("#") and pending is not None:
+            v = Variant(urllib.parse.urljoin(base_url, line), int(pending.get("BANDWIDTH", 0) or 0), codecs=pending.get("CODECS", ""))
+            m = re.match(r"(\d+)x(\d+)", pending.get("RESOLUTION", ""))
+            if m: v.width, v.height = int(m.group(1)), int(m.group(2))
+            variants.append(v)
+            pending = None
+    return variants
+
+
+def parse_media(text: str, base_url: str) -> MediaPlaylist:
+    pl = MediaPlaylist()
+    seq, key, duration, byterange, next_offset = 0, None, None, None, 0
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            seq = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            pl.target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = parse_attrs(line)
+            method = attrs.get("METHOD", "NONE")
+            iv = attrs.get("IV")
+            key = None if method == "NONE" else Key(
+                method,
+                urllib.parse.urljoin(base_url, attrs["URI"]) if "URI" in attrs else None,
+                bytes.fromhex(iv[2:] if iv.lower().startswith("0x") else iv) if iv else None,
+            )
+        elif line.startswith("#EXT-X-MAP:"):
+            pl.map_url = urllib.parse.urljoin(base_url, parse_attrs(line)["URI"])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0] or 0)
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            length, _, offset = line.split(":", 1)[1].partition("@")
+            byterange = (int(length), int(offset) if offset else next_offset)
+        elif line.startswith("#EXT-X-ENDLIST"):
+            pl.ended = True
+        elif line and not line.startswith("#") and duration is not None:
+            pl.segments.append(Segment(urllib.parse.urljoin(base_url, line), duration, seq, key, byterange))
+            if byterange: next_offset = byterange[0] + byterange[1]
+            seq, duration, byterange = seq + 1, None, None
+    return pl
@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+
+# ================= Configuration =================
+PROGRESS_MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", "3"))  # Seconds between edits of one status message
+FAST_MODE = os.getenv("FAST_MODE", "0") == "1"                          # Skip cosmetic animation frames entirely
+
+log = logging.getLogger("progress")
+
+
+def _fmt_mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+def render_bar(label: str, done: int, total: Optional[int]) -> str:
+    if total:
+        pct = min(done * 100 // total, 100)
+        bar = "█" * (pct // 10) + "░" * (10 - pct // 10)
+        return f"<blockquote><code>{label} {pct}%</code>\n<code>[{bar}] {_fmt_mb(done)} / {_fmt_mb(total)}</code></blockquote>"
+    return f"<blockquote><code>{label} {_fmt_mb(done)}</code></blockquote>"
+
+
+# ================= Progress Reporter =================
+class ProgressReporter:
+    # Owns one status message. Callers report real events (phase changes, byte counts)
+    # and the reporter edits at most once per min_interval, always showing the latest
+    # state; duplicate texts never reach Telegram.
+
+    def __init__(self, message, min_interval: float = PROGRESS_MIN_INTERVAL, fast_mode: bool = FAST_MODE):
+        self.message = message
+        self.min_interval = min_interval
+        self.fast_mode = fast_mode
+        self._shown = getattr(message, "text", None) and message.text.html
+        self._pending: Optional[str] = None
+        self._last_edit = time.monotonic()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @classmethod
+    async def reply(cls, message, text: str, **kwargs) -> "ProgressReporter":
+        return cls(await message.reply_text(text), **kwargs)
+
+    @property
+    def chat_id(self): return self.message.chat.id
+
+    @property
+    def id(self): return self.message.id
+
+    # --- Events ---
+    async def phase(self, text: str, cosmetic: bool = False):
+        # Animation frames are skipped in FAST_MODE; otherwise they are coalesced like
+        # any other update, so a finish() right after them replaces them unsent
+        if cosmetic and self.fast_mode: return
+        self._request(text)
+
+    def transfer(self, label: str):
+        # Returns an async (current, total) callback for byte loops and Pyrogram's progress=
+        async def callback(current: int, total: Optional[int] = None, *args):
+            self._request(render_bar(label, current, total))
+        return callback
+
+    async def finish(self, text: str, **kwargs):
+        # Terminal state: cancel anything pending and edit immediately
+        self._closed = True
+        if self._flush_task: self._flush_task.cancel()
+        await self._edit(text, **kwargs)
+
+    async def delete(self):
+        self._closed = True
+        if self._flush_task: self._flush_task.cancel()
+        try: await self.message.delete()
+        except Exception: pass
+
+    # --- Coalescing ---
+    def _request(self, text: str):
+        if self._closed or text == self._shown: return
+        self._pending = text
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        # Loops until nothing newer than the last edit is pending: a request that
+        # arrives while an edit is in flight is sent next instead of being stranded
+        while self._pending is not None and not self._closed:
+            delay = self._last_edit + self.min_interval - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            text, self._pending = self._pending, None
+            if text and text != self._shown and not self._closed:
+                await self._edit(text)
+
+    async def _edit(self, text: str, **kwargs):
+        if text == self._shown and not kwargs: return
+        try:
+            await self.message.edit_text(text, **kwargs)
+            self._shown = text
+        except Exception as e:
+            log.debug(f"Progress edit skipped: {e}")
+        self._last_edit = time.monotonic()
@@ -0,0 +1,121 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+from http_client import http, timeout
+from downloader import probe
+from playlist import is_master, parse_master, parse_media
+from sniffer import Candidate, is_ad, SNIFF_MIN_BYTES
+
+# ================= Configuration =================
+STREAM_MAX_HEIGHT = int(os.getenv("STREAM_MAX_HEIGHT", "1080"))                   # Best variant at or below this
+STREAM_MAX_BYTES = int(os.getenv("STREAM_MAX_BYTES", str(2000 * 1024 * 1024)))    # Telegram bot upload ceiling
+STREAM_MIN_DURATION = 30.0     # Shorter HLS streams are pre-rolls/teasers
+RANK_TIMEOUT = timeout(total=15)
+RANK_CONCURRENCY = 8
+
+log = logging.getLogger("ranking")
+
+
+@dataclass
+class RankedStream:
+    url: str                          # What to download (a variant playlist for HLS masters)
+    kind: str
+    height: Optional[int] = None
+    bandwidth: Optional[int] = None
+    size: Optional[int] = None        # Known or estimated bytes
+    duration: Optional[float] = None
+    source: str = ""                  # Sniffed URL this came from
+
+    @property
+    def fits(self) -> bool:
+        return (self.size is None or self.size <= STREAM_MAX_BYTES) and (self.height is None or self.height <= STREAM_MAX_HEIGHT)
+
+    @property
+    def label(self) -> str:
+        parts = [f"{self.height}p" if self.height else self.kind.upper()]
+        if self.size: parts.append(f"~{self.size / (1024 * 1024):.0f} MB")
+        return " · ".join(parts)
+
+
+@dataclass
+class Ranking:
+    streams: List[RankedStream]       # Best first; ads, teasers and pre-rolls already dropped
+    unprobed: List[Candidate]         # Probe errored: unknown rather than rejected
+
+
+# ================= Candidate Evaluation =================
+async def _fetch_text(url: str, headers: dict) -> str:
+    async with http.session.get(url, headers=headers, timeout=RANK_TIMEOUT) as resp:
+        if resp.status != 200:
+            raise Exception(f"HTTP {resp.status}")
+        return await resp.text(errors="replace")
+
+
+async def _evaluate_hls(cand: Candidate, headers: dict) -> List[RankedStream]:
+    text = await _fetch_text(cand.url, headers)
+    if not is_master(text):
+        pl = parse_media(text, cand.url)
+        if pl.ended and pl.duration < STREAM_MIN_DURATION: return []
+        return [RankedStream(cand.url, "hls", duration=pl.duration or None, source=cand.url)]
+
+    variants = [v for v in parse_master(text, cand.url) if not is_ad(v.url)]
+    if not variants: return []
+    # Every variant has the same timeline: one media playlist gives the duration for all of them
+    duration = None
+    try:
+        pl = parse_media(await _fetch_text(variants[0].url, headers), variants[0].url)
+        duration = pl.duration or None
+        if pl.ended and duration and duration < STREAM_MIN_DURATION: return []
+    except Exception as e:
+        log.debug(f"Variant playlist unavailable for {cand.url}: {e}")
+    return [
+        RankedStream(
+            v.url, "hls", height=v.height, bandwidth=v.bandwidth or None,
+            size=int(v.bandwidth / 8 * duration) if v.bandwidth and duration else None,
+            duration=duration, source=cand.url,
+        )
+        for v in variants
+    ]
+
+
+async def _evaluate_progressive(cand: Candidate, headers: dict) -> List[RankedStream]:
+    size = cand.size
+    if size is None:
+        info = await asyncio.wait_for(probe(http.session, cand.url, headers=headers), RANK_TIMEOUT.total)
+        if info.status not in (200, 206): return []
+        size = info.size
+    if size is not None and size < SNIFF_MIN_BYTES: return []
+    return [RankedStream(cand.url, "progressive", size=size, source=cand.url)]
+
+
+async def _evaluate(cand: Candidate, headers: dict, sem: asyncio.Semaphore) -> Optional[List[RankedStream]]:
+    # [] = looked at and rejected, None = couldn't be probed
+    async with sem:
+        try:
+            if cand.kind == "hls": return await _evaluate_hls(cand, headers)
+            if cand.kind == "progressive": return await _evaluate_progressive(cand, headers)
+            return [RankedStream(cand.url, cand.kind, source=cand.url)]   # DASH: left to yt-dlp
+        except Exception as e:
+            log.info(f"Could not probe candidate {cand.url[:80]}: {e}")
+            return None
+
+
+def _score(s: RankedStream):
+    # Policy fit first. All candidates carry the same content, so more bytes means more bitrate;
+    # this compares an mp4 of unknown resolution against HLS variants fairly. Resolution and
+    # bandwidth break ties (live playlists have no size), and DASH, which needs muxing, goes last.
+    return (s.fits, s.size or 0, s.height or 0, s.bandwidth or 0, s.kind != "dash")
+
+
+async def rank_candidates(candidates: List[Candidate], referer: Optional[str] = None) -> Ranking:
+    headers = {"Referer": referer} if referer else {}
+    sem = asyncio.Semaphore(RANK_CONCURRENCY)
+    candidates = [c for c in candidates if not is_ad(c.url)]
+    results = await asyncio.gather(*(_evaluate(c, headers, sem) for c in candidates))
+    ranked = sorted((s for group in results if group for s in group), key=_score, reverse=True)
+    unprobed = [c for c, group in zip(candidates, results) if group is None]
+    if ranked:
+        log.info(f"Ranked {len(ranked)} stream(s) from {len(candidates)} candidate(s); best {ranked[0].label} {ranked[0].url[:80]}")
+    return Ranking(ranked, unprobed)
@@ -0,0 +1,124 @@
+import time
+import heapq
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional
+from pyrogram import Client
+from backends import backend, leader
+from delivery import call_with_flood_wait
+from metrics import registry
+
+# ================= Configuration =================
+SCHEDULER_LOOKAHEAD = 60      # Seconds of upcoming deletions held in memory
+SCHEDULER_HEAP_CAP = 2000     # Max heap entries; anything beyond stays in the DB until its turn
+SCHEDULER_COALESCE = 1.0      # When a timer fires, also take those due within this many seconds (per-chat batching)
+SCHEDULER_SHARED_LOOKAHEAD = 5   # With replicas, others schedule too: the leader re-reads the shared queue this often
+
+log = logging.getLogger("scheduler")
+
+
+# ================= Durable Deletion Scheduler =================
+class DeletionScheduler:
+    # Due times live in pending_deletions; memory only ever holds the next
+    # SCHEDULER_LOOKAHEAD seconds (capped at SCHEDULER_HEAP_CAP) in a min-heap.
+    # One timer loop serves every registered bot and deletes per chat in bulk.
+    # With several replicas only the leader (backends.leader) runs the loop.
+
+    def __init__(self):
+        self.clients: Dict[str, Client] = {}
+        self._heap: List[tuple] = []
+        self._horizon = 0.0       # every DB row due <= horizon is in the heap
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, client: Client):
+        self.clients[client.name] = client
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def schedule(self, client: Client, chat_id: int, message_ids, delay: float):
+        if isinstance(message_ids, int): message_ids = [message_ids]
+        due = time.time() + delay
+        await backend.schedule_deletions(client.name, chat_id, message_ids, due)
+        if due <= self._horizon:
+            for m in message_ids: heapq.heappush(self._heap, (due, client.name, chat_id, m))
+            if len(self._heap) > SCHEDULER_HEAP_CAP * 2:
+                # Burst of short timers: drop the window and rebuild it from the DB
+                self._heap.clear()
+                self._horizon = 0.0
+            self._wake.set()
+
+    # --- Timer loop ---
+    async def _refill(self):
+        now = time.time()
+        lookahead = SCHEDULER_SHARED_LOOKAHEAD if backend.networked else SCHEDULER_LOOKAHEAD
+        rows = await backend.due_deletions(list(self.clients), now + lookahead, SCHEDULER_HEAP_CAP)
+        self._heap = list(rows)
+        heapq.heapify(self._heap)
+        self._horizon = now + lookahead if len(rows) < SCHEDULER_HEAP_CAP else rows[-1][0]
+
+    async def _run(self):
+        while True:
+            try:
+                if not leader.is_leader:
+                    # Another replica runs the deletions; re-read the whole queue if we take over
+                    self._heap.clear()
+                    self._horizon = 0.0
+                    await asyncio.sleep(leader.ttl / 3)
+                    continue
+                if time.time() >= self._horizon:
+                    await self._refill()
+
+                now = time.time()
+                due = []
+                if self._heap and self._heap[0][0] <= now:
+                    while self._heap and self._heap[0][0] <= now + SCHEDULER_COALESCE:
+                        due.append(heapq.heappop(self._heap))
+                if due:
+                    await self._execute(due)
+                    continue
+
+                next_at = min(self._heap[0][0] if self._heap else self._horizon, self._horizon)
+                self._wake.clear()
+                try: await asyncio.wait_for(self._wake.wait(), timeout=max(next_at - time.time(), 0))
+                except asyncio.TimeoutError: pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Deletion loop error: {e}")
+                await asyncio.sleep(5)
+
+    async def _execute(self, rows):
+        by_chat = defaultdict(list)
+        for _, bot, chat_id, message_id in rows:
+            by_chat[(bot, chat_id)].append(message_id)
+
+        async def purge(bot, chat_id, ids):
+            client = self.clients.get(bot)
+            for i in range(0, len(ids), 100):
+                try: await call_with_flood_wait(client.delete_messages, chat_id, ids[i:i + 100])
+                except Exception as e: log.error(f"Could not auto-delete: {e}")
+
+        await asyncio.gather(*(purge(bot, chat_id, ids) for (bot, chat_id), ids in by_chat.items()))
+        # Rows are dropped even when Telegram refuses (message already gone, chat blocked)
+        await backend.remove_deletions([(bot, chat_id, m) for _, bot, chat_id, m in rows])
+
+
+scheduler = DeletionScheduler()
+
+
+pending_deletions = registry.gauge("pending_deletions", "Messages waiting in the auto-delete queue (all bots)")
+
+@registry.sampler
+async def _sample_pending():
+    pending_deletions.set(await backend.count_deletions())
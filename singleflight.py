@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from metrics import registry
+
+log = logging.getLogger("singleflight")
+_flights: List["SingleFlight"] = []   # Every instance, for the metrics collector
+
+
+# ================= Single-Flight =================
+class SingleFlight:
+    # Concurrent requests for the same key share one execution. The first caller
+    # (the leader) runs the work; anyone arriving while it is in flight awaits the
+    # same future. Nothing is remembered afterwards: a success is the caller's to
+    # cache, and a failure reaches every waiter and the next request retries.
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.led = self.joined = 0
+        _flights.append(self)
+
+    def pending(self, key: Hashable) -> Optional[asyncio.Future]:
+        return self._inflight.get(key)
+
+    async def wait(self, fut: asyncio.Future) -> Any:
+        # shield: a follower giving up must not cancel the leader's work
+        self.joined += 1
+        return await asyncio.shield(fut)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return await self.wait(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        self.led += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()   # Retrieved here so a follower-less failure isn't logged as unhandled
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._inflight), "led": self.led, "joined": self.joined}
+
+
+@registry.collector
+def _collect_flights():
+    stats = {f.name: f.stats() for f in list(_flights)}
+    yield "singleflight_inflight", "gauge", "Keys currently being fetched", [({"name": n}, s["inflight"]) for n, s in stats.items()]
+    yield "singleflight_calls_total", "counter", "Callers that ran the work (led) or shared another's (joined)", [
+        ({"name": n, "role": r}, s[r]) for n, s in stats.items() for r in ("led", "joined")]
@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from playwright.async_api import Page, Request, Response, Route
+
+# ================= Configuration =================
+SNIFF_TIMEOUT = float(os.getenv("SNIFF_TIMEOUT", "20"))   # Give up if nothing qualifies by then
+SNIFF_GRACE = float(os.getenv("SNIFF_GRACE", "1.5"))      # Keep listening this long after the first hit for alternatives
+SNIFF_MIN_BYTES = 256 * 1024                              # Smaller progressive files are thumbnails/teasers, not the stream
+BLOCKED_RESOURCES = {"image", "font"}
+
+HLS_MIMES = {"application/vnd.apple.mpegurl", "application/x-mpegurl", "audio/mpegurl", "audio/x-mpegurl"}
+DASH_MIMES = {"application/dash+xml"}
+SEGMENT_MIMES = {"video/mp2t", "video/iso.segment"}       # Pieces of a playlist, never a target on their own
+AD_PATTERN = re.compile(
+    r"doubleclick\.net|googlesyndication|googleadservices|adservice\.|imasdk\.googleapis|adnxs\.com|"
+    r"popads|propellerads|exoclick|juicyads|trafficjunky|adsterra|/vast[/?.]|/vmap[/?.]|[/_.-]pre-?roll|"
+    r"[/?&_.-]ads?[/?&_.-]|/advert",
+    re.IGNORECASE,
+)
+
+log = logging.getLogger("sniffer")
+
+
+@dataclass
+class Candidate:
+    url: str
+    kind: str                  # "hls", "dash" or "progressive"
+    mime: str = ""
+    size: Optional[int] = None
+    seen_at: float = 0.0       # Seconds after navigation started
+
+
+def is_ad(url: str) -> bool:
+    return bool(AD_PATTERN.search(url))
+
+
+def _kind_from_url(url: str) -> Optional[str]:
+    path = url.split("?", 1)[0].lower()
+    if path.endswith(".m3u8"): return "hls"
+    if path.endswith(".mpd"): return "dash"
+    if path.endswith((".mp4", ".m4v", ".webm", ".mkv", ".mov")): return "progressive"
+    # Signed CDN URLs often carry the extension only in the query string
+    if ".m3u8" in url: return "hls"
+    if ".mp4" in url: return "progressive"
+    return None
+
+
+def _kind_from_mime(mime: str) -> Optional[str]:
+    if mime in HLS_MIMES: return "hls"
+    if mime in DASH_MIMES: return "dash"
+    if mime in SEGMENT_MIMES: return None
+    if mime.startswith("video/"): return "progressive"
+    return None
+
+
+def _size_from_headers(headers: Dict[str, str]) -> Optional[int]:
+    m = re.search(r"/(\d+)$", headers.get("content-range", ""))
+    if m: return int(m.group(1))
+    try: return int(headers["content-length"])
+    except (KeyError, ValueError): return None
+
+
+# ================= Network Sniffer =================
+class StreamSniffer:
+    # Watches one page's traffic. Requests are matched by URL shape as soon as
+    # they are issued; responses refine (or add) candidates from Content-Type and
+    # Content-Length. The first qualifying candidate arms a short grace window,
+    # so a 200 ms player resolves in ~SNIFF_GRACE instead of a fixed sleep and a
+    # slow player still gets up to SNIFF_TIMEOUT.
+
+    def __init__(self, page: Page, grace: float = SNIFF_GRACE, timeout: float = SNIFF_TIMEOUT):
+        self.page = page
+        self.grace = grace
+        self.timeout = timeout
+        self.candidates: Dict[str, Candidate] = {}
+        self.blocked = 0
+        self._found = asyncio.Event()
+        self._started = time.monotonic()
+
+    async def _route(self, route: Route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCES or is_ad(request.url):
+            self.blocked += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _add(self, url: str, kind: str, mime: str = "", size: Optional[int] = None, answered: bool = False):
+        cand = self.candidates.get(url)
+        if cand is None:
+            cand = self.candidates[url] = Candidate(url, kind, seen_at=time.monotonic() - self._started)
+        if mime:
+            cand.kind, cand.mime = kind, mime
+        if size is not None:
+            cand.size = size
+        # Playlists qualify on sight; a progressive file only once its response says it isn't a teaser
+        if self._qualifies(cand) and (cand.kind != "progressive" or answered):
+            self._found.set()
+
+    def _qualifies(self, cand: Candidate) -> bool:
+        return not (cand.kind == "progressive" and cand.size is not None and cand.size < SNIFF_MIN_BYTES)
+
+    def _on_request(self, request: Request):
+        if is_ad(request.url): return
+        kind = _kind_from_url(request.url)
+        if kind or request.resource_type == "media":
+            self._add(request.url, kind or "progressive")
+
+    def _on_response(self, response: Response):
+        url = response.url
+        if is_ad(url) or response.status >= 400: return
+        headers = response.headers
+        mime = headers.get("content-type", "").split(";", 1)[0].strip().lower()
+        kind = _kind_from_mime(mime)
+        if kind is None and mime in SEGMENT_MIMES:
+            self.candidates.pop(url, None)   # URL looked like media but is a playlist segment
+            return
+        if kind is None and url not in self.candidates:
+            return
+        self._add(url, kind or self.candidates[url].kind, mime, _size_from_headers(headers), answered=True)
+
+    async def _nudge_players(self):
+        # Muted autoplay is allowed everywhere; many players only fetch the source on play()
+        try:
+            await self.page.evaluate(
+                "() => document.querySelectorAll('video').forEach(v => { v.muted = true; v.play().catch(() => {}); })"
+            )
+        except Exception:
+            pass
+
+    async def run(self, url: str) -> List[Candidate]:
+        await self.page.route("**/*", self._route)
+        self.page.on("request", self._on_request)
+        self.page.on("response", self._on_response)
+        self._started = time.monotonic()
+
+        await self.page.goto(url, wait_until="domcontentloaded", timeout=60000)
+        if not self._found.is_set():
+            await self._nudge_players()
+        remaining = self.timeout - (time.monotonic() - self._started)
+        try:
+            await asyncio.wait_for(self._found.wait(), max(remaining, 0))
+            await asyncio.sleep(self.grace)
+        except asyncio.TimeoutError:
+            pass
+
+        found = [c for c in self.candidates.values() if self._qualifies(c)]
+        log.info(f"Sniffed {len(found)} candidate(s) in {time.monotonic() - self._started:.2f}s, blocked {self.blocked} request(s)")
+        return sorted(found, key=lambda c: c.seen_at)
+
+
+async def sniff(page: Page, url: str, grace: float = SNIFF_GRACE, timeout: float = SNIFF_TIMEOUT) -> List[Candidate]:
+    return await StreamSniffer(page, grace, timeout).run(url)
@@ -0,0 +1,154 @@
+import sys
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+from storage import db
+from backends import backend
+from metrics import registry
+
+log = logging.getLogger("state")
+
+_MISSING = object()
+_stores: List["StateStore"] = []   # Every instance, for the metrics collector
+
+
+# ================= Bounded State Store =================
+class StateStore:
+    # A dict replacement with per-entry TTL and an LRU size cap, so per-user and
+    # per-album bookkeeping can never grow without bound. persist=True mirrors
+    # every write into the state_entries table (write-behind through the storage
+    # writer thread) and load() restores it after a restart. Persisted keys and
+    # values must be JSON-serialisable.
+    #
+    # shared=True stores, whose state every replica must see, are used through
+    # aget/aset/apop: with a networked backend (backends.py) those go to the
+    # shared store, otherwise they are the local dict calls.
+
+    def __init__(self, name: str, ttl: Optional[float], max_entries: int, persist: bool = False, shared: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared and backend.networked
+        self.persist = persist and not self.shared   # The shared store already outlives restarts
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        _stores.append(self)
+
+    # --- Dict-like API ---
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = _MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if self.persist:
+            db.put_state(self.name, json.dumps(key), json.dumps(value), expires_at)
+        if len(self._data) > self.max_entries:
+            self._shrink()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING: return default
+        self._drop(key)
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # --- Shared (replica-safe) API ---
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        if not self.shared: return self.get(key, default)
+        value = await backend.get(self.name, key)
+        return default if value is None else value
+
+    async def aset(self, key: Hashable, value: Any, ttl: Optional[float] = _MISSING):
+        if not self.shared: return self.set(key, value, ttl)
+        await backend.set(self.name, key, value, self.ttl if ttl is _MISSING else ttl)
+
+    async def asetdefault(self, key: Hashable, value: Any, ttl: Optional[float] = _MISSING) -> Any:
+        # Get-or-set in one step: every concurrent caller, on any replica, gets the first value stored
+        if not self.shared:
+            existing = self.get(key, _MISSING)
+            if existing is not _MISSING: return existing
+            self.set(key, value, ttl)
+            return value
+        return await backend.setdefault(self.name, key, value, self.ttl if ttl is _MISSING else ttl)
+
+    async def apop(self, key: Hashable, default: Any = None) -> Any:
+        if not self.shared: return self.pop(key, default)
+        value = await backend.pop(self.name, key)
+        return default if value is None else value
+
+    # --- Eviction ---
+    def _drop(self, key: Hashable):
+        self._data.pop(key, None)
+        if self.persist:
+            db.drop_state(self.name, json.dumps(key))
+
+    def sweep(self):
+        now = time.time()
+        for key in [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]:
+            self._drop(key)
+            self.expirations += 1
+
+    def _shrink(self):
+        self.sweep()
+        while len(self._data) > self.max_entries:
+            key = next(iter(self._data))  # least recently used
+            self._drop(key)
+            self.evictions += 1
+
+    # --- Persistence ---
+    async def load(self):
+        if not self.persist: return
+        rows = await db.load_state(self.name)
+        for key, value, expires_at in rows:
+            k = json.loads(key)
+            self._data[k] = (json.loads(value), expires_at)
+        if len(self._data) > self.max_entries:
+            self._shrink()
+        log.info(f"Restored {len(rows)} '{self.name}' entries")
+
+    # --- Metrics ---
+    def stats(self) -> Dict[str, int]:
+        approx_bytes = sys.getsizeof(self._data) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, (v, _) in self._data.items()
+        )
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "approx_bytes": approx_bytes,
+        }
+
+
+@registry.collector
+def _collect_stores():
+    stats = {s.name: s.stats() for s in list(_stores)}
+    yield "state_store_entries", "gauge", "Entries held in memory", [({"store": n}, s["entries"]) for n, s in stats.items()]
+    yield "state_store_lookups_total", "counter", "Local get() calls by result", [
+        ({"store": n, "result": r}, s[k]) for n, s in stats.items() for r, k in (("hit", "hits"), ("miss", "misses"))]
+    yield "state_store_removals_total", "counter", "Entries dropped by the size cap or their TTL", [
+        ({"store": n, "reason": r}, s[k]) for n, s in stats.items() for r, k in (("evicted", "evictions"), ("expired", "expirations"))]
@@ -0,0 +1,506 @@
+import os
+import re
+import time
+import queue
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+from metrics import registry
+
+# ================= Configuration =================
+DB_PATH = os.getenv("DB_PATH", "bot_database.db")
+DB_BUSY_TIMEOUT_MS = 30000     # How long a writer waits for the other bot's lock
+DB_BATCH_SIZE = 64             # Max write jobs folded into one transaction
+DB_BATCH_WINDOW = 0.005        # Seconds the writer waits to gather a group commit
+DB_READERS = 4                 # Reader threads (WAL lets them run beside the writer)
+
+log = logging.getLogger("storage")
+query_seconds = registry.histogram("sqlite_query_seconds", "SQLite call latency as seen by the caller (writes include group-commit wait)", ("op",))
+
+
+# ================= Schema Migrations =================
+# Each step runs once, inside its own transaction, and bumps PRAGMA user_version.
+# Append new steps at the end; never edit one that has already shipped.
+
+def _v1_legacy_tables(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS shared_files (link_id TEXT, message_id INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS terabox_cache (terabox_url TEXT PRIMARY KEY, message_id INTEGER)")
+
+def _v2_links_and_items(conn):
+    # Clustered on (link_id, position): a link lookup is one B-tree range scan, in file order
+    conn.execute("""
+        CREATE TABLE links (
+            link_id TEXT PRIMARY KEY,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE link_items (
+            link_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (link_id, position)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_link_items_message ON link_items (message_id)")
+
+    now = int(time.time())
+    conn.execute("INSERT INTO links (link_id, created_at) SELECT DISTINCT link_id, ? FROM shared_files WHERE link_id IS NOT NULL", (now,))
+    conn.execute("""
+        INSERT INTO link_items (link_id, position, message_id, created_at)
+        SELECT link_id, ROW_NUMBER() OVER (PARTITION BY link_id ORDER BY rowid) - 1, message_id, ?
+        FROM shared_files WHERE link_id IS NOT NULL AND message_id IS NOT NULL
+    """, (now,))
+    conn.execute("DROP TABLE shared_files")
+
+def _v3_pending_deletions(conn):
+    conn.execute("""
+        CREATE TABLE pending_deletions (
+            bot TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            due_at REAL NOT NULL,
+            PRIMARY KEY (bot, chat_id, message_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_pending_deletions_due ON pending_deletions (due_at)")
+
+def _v4_meta(conn):
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at INTEGER NOT NULL) WITHOUT ROWID")
+
+def _v5_state_entries(conn):
+    conn.execute("""
+        CREATE TABLE state_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """)
+
+def _v6_terabox_share_keys(conn):
+    # Re-key the Terabox cache from "whatever URL resolve_redirect returned" to the
+    # share's surl, so every mirror/short link of one file hits the same row. The
+    # URL parsing is a frozen copy of terabox_links.share_key as of v6: a shipped
+    # migration must not change with the live helper.
+    import urllib.parse
+    surl_param = re.compile(r"[?&]surl=([A-Za-z0-9_-]+)")
+    share_path = re.compile(r"/s/1([A-Za-z0-9_-]+)")
+
+    def share_key(url):
+        m = surl_param.search(url.replace("&amp;", "&")) or share_path.search(urllib.parse.urlparse(url).path)
+        return m.group(1) if m else None
+
+    conn.execute("CREATE TABLE terabox_files (share_key TEXT PRIMARY KEY, message_id INTEGER NOT NULL) WITHOUT ROWID")
+    rows = conn.execute("SELECT terabox_url, message_id FROM terabox_cache ORDER BY rowid").fetchall()
+    conn.executemany(
+        "INSERT OR REPLACE INTO terabox_files (share_key, message_id) VALUES (?, ?)",
+        [(share_key(url) or url, message_id) for url, message_id in rows if message_id is not None],
+    )
+    conn.execute("DROP TABLE terabox_cache")
+
+def _v7_content_index(conn):
+    # Content hash (or Telegram file_unique_id) -> vault message, so identical files are uploaded once
+    conn.execute("""
+        CREATE TABLE content_index (
+            content_key TEXT PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            size INTEGER,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_content_index_message ON content_index (message_id)")
+    conn.execute("CREATE INDEX idx_terabox_files_message ON terabox_files (message_id)")
+
+def _v8_vault_verification(conn):
+    # One row per vault message any table points at, with when it was last seen alive.
+    # The background verifier walks it oldest-first (verifier.py).
+    conn.execute("""
+        CREATE TABLE vault_messages (
+            message_id INTEGER PRIMARY KEY,
+            verified_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_vault_messages_verified ON vault_messages (verified_at)")
+    conn.execute("""
+        INSERT OR IGNORE INTO vault_messages (message_id, verified_at)
+        SELECT message_id, 0 FROM link_items
+        UNION SELECT message_id, 0 FROM terabox_files
+        UNION SELECT message_id, 0 FROM content_index
+    """)
+    # What the Terabox cache hit used to fetch from the channel message on every hit
+    for column in ("file_name TEXT", "duration TEXT", "size TEXT", "is_video INTEGER"):
+        conn.execute(f"ALTER TABLE terabox_files ADD COLUMN {column}")
+
+MIGRATIONS = [
+    (1, _v1_legacy_tables),
+    (2, _v2_links_and_items),
+    (3, _v3_pending_deletions),
+    (4, _v4_meta),
+    (5, _v5_state_entries),
+    (6, _v6_terabox_share_keys),
+    (7, _v7_content_index),
+    (8, _v8_vault_verification),
+]
+
+
+# ================= Async SQLite Storage =================
+class Storage:
+    # All writes go through ONE dedicated writer thread which folds every job queued
+    # within DB_BATCH_WINDOW into a single BEGIN IMMEDIATE ... COMMIT (group commit),
+    # so N concurrent handlers pay for one fsync instead of N. Reads run on a small
+    # thread pool, each thread holding its own connection. Nothing touches the loop.
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._readers: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # --- Lifecycle ---
+    def start(self):
+        with self._lock:
+            if self._writer: return
+            conn = self._connect()
+            self._migrate(conn)
+            self._writer = threading.Thread(target=self._writer_loop, args=(conn,), name="db-writer", daemon=True)
+            self._writer.start()
+            self._readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+
+    def close(self):
+        with self._lock:
+            if not self._writer: return
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+            self._readers.shutdown(wait=True)
+            self._readers = None
+
+    async def ping(self) -> int:
+        # Readiness probe: the writer thread is alive and a reader answers; returns the write backlog
+        if not (self._writer and self._writer.is_alive()):
+            raise RuntimeError("writer thread is not running")
+        await self.read(lambda conn: conn.execute("SELECT 1").fetchone())
+        return self._queue.qsize()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None -> we issue BEGIN/COMMIT ourselves
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL + NORMAL: durable across app crashes, one fsync per checkpoint
+        return conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        # BEGIN IMMEDIATE serialises the two bots so only one of them runs each step
+        for version, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if current >= version:
+                    conn.execute("COMMIT")
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version={version}")
+                conn.execute("COMMIT")
+                log.info(f"Database migrated to v{version}")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # --- Writer thread (group commit) ---
+    def _writer_loop(self, conn: sqlite3.Connection):
+        while True:
+            job = self._queue.get()
+            if job is None: break
+            batch = [job]
+            deadline = time.monotonic() + DB_BATCH_WINDOW
+            stop = False
+            while len(batch) < DB_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            try:
+                self._commit_batch(conn, batch)
+            except Exception as e:
+                # e.g. SQLITE_FULL/IOERR rolled the transaction back under us and the
+                # savepoint is gone: fail this batch, reset the connection, keep serving
+                log.error(f"Write batch aborted: {e!r}")
+                try: conn.execute("ROLLBACK")
+                except Exception: pass
+                for _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+            if stop: break
+        conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            for _, fut in batch: fut.set_exception(e)
+            return
+
+        outcomes = []
+        for fn, fut in batch:
+            # A SAVEPOINT per job keeps one bad statement from poisoning the whole group
+            conn.execute("SAVEPOINT job")
+            try:
+                result = fn(conn)
+                conn.execute("RELEASE job")
+                outcomes.append((fut, result, None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                outcomes.append((fut, None, e))
+
+        try:
+            conn.execute("COMMIT")
+        except Exception as e:
+            log.error(f"Group commit failed: {e}")
+            try: conn.execute("ROLLBACK")
+            except Exception: pass
+            for fut, _, _ in outcomes: fut.set_exception(e)
+            return
+
+        for fut, result, err in outcomes:
+            if err is not None: fut.set_exception(err)
+            else: fut.set_result(result)
+
+    def submit(self, fn: Callable[[sqlite3.Connection], object]) -> Future:
+        # Thread-safe and non-blocking: usable from sync code as fire-and-forget
+        self.start()
+        fut: Future = Future()
+        self._queue.put((fn, fut))
+        return fut
+
+    async def write(self, fn: Callable[[sqlite3.Connection], object]):
+        with query_seconds.time(op="write"):
+            return await asyncio.wrap_future(self.submit(fn))
+
+    # --- Readers ---
+    def _reader_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    async def read(self, fn: Callable[[sqlite3.Connection], object]):
+        self.start()
+        loop = asyncio.get_running_loop()
+        with query_seconds.time(op="read"):
+            return await loop.run_in_executor(self._readers, lambda: fn(self._reader_conn()))
+
+    # ================= Shared Links =================
+    async def add_link(self, link_id: str, message_ids: List[int]):
+        # Appends after any items the link already has (media groups arrive one by one)
+        def op(conn):
+            now = int(time.time())
+            conn.execute("INSERT OR IGNORE INTO links (link_id, created_at) VALUES (?, ?)", (link_id, now))
+            start = conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM link_items WHERE link_id = ?", (link_id,)).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO link_items (link_id, position, message_id, created_at) VALUES (?, ?, ?, ?)",
+                [(link_id, start + i, m, now) for i, m in enumerate(message_ids)]
+            )
+            self._track_messages(conn, message_ids)
+        await self.write(op)
+
+    async def add_file(self, link_id: str, message_id: int):
+        await self.add_link(link_id, [message_id])
+
+    async def get_messages_for_link(self, link_id: str) -> List[int]:
+        def op(conn):
+            return [r[0] for r in conn.execute("SELECT message_id FROM link_items WHERE link_id = ? ORDER BY position", (link_id,))]
+        return await self.read(op)
+
+    async def delete_link(self, link_id: str) -> Tuple[List[int], List[int]]:
+        # Returns (the link's message ids, those no other link still points at). Only the
+        # second list may be deleted from the channel: deduplicated files are shared.
+        def op(conn):
+            ids = [r[0] for r in conn.execute("SELECT message_id FROM link_items WHERE link_id = ? ORDER BY position", (link_id,))]
+            conn.execute("DELETE FROM link_items WHERE link_id = ?", (link_id,))
+            conn.execute("DELETE FROM links WHERE link_id = ?", (link_id,))
+            orphaned = [m for m in dict.fromkeys(ids)
+                        if not conn.execute("SELECT 1 FROM link_items WHERE message_id = ? LIMIT 1", (m,)).fetchone()]
+            self._forget_messages(conn, orphaned)
+            return ids, orphaned
+        return await self.write(op)
+
+    async def purge_links(self):
+        def op(conn):
+            conn.execute("DELETE FROM link_items")
+            conn.execute("DELETE FROM links")
+            conn.execute("""
+                DELETE FROM vault_messages WHERE message_id NOT IN
+                (SELECT message_id FROM terabox_files UNION SELECT message_id FROM content_index)
+            """)
+        await self.write(op)
+
+    # ================= Terabox Cache =================
+    async def get_terabox_file(self, share_key: str) -> Optional[tuple]:
+        # (message_id, file_name, duration, size, is_video, verified_at); metadata is NULL on pre-v8 rows
+        def op(conn):
+            return conn.execute("""
+                SELECT t.message_id, t.file_name, t.duration, t.size, t.is_video, COALESCE(v.verified_at, 0)
+                FROM terabox_files t LEFT JOIN vault_messages v ON v.message_id = t.message_id
+                WHERE t.share_key = ?
+            """, (share_key,)).fetchone()
+        return await self.read(op)
+
+    async def cache_terabox(self, share_key: str, message_id: int, file_name: Optional[str] = None,
+                            duration: Optional[str] = None, size: Optional[str] = None, is_video: Optional[bool] = None):
+        def op(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO terabox_files (share_key, message_id, file_name, duration, size, is_video) VALUES (?, ?, ?, ?, ?, ?)",
+                (share_key, message_id, file_name, duration, size, None if is_video is None else int(is_video))
+            )
+            self._track_messages(conn, [message_id])
+        await self.write(op)
+
+    # ================= Content Index =================
+    async def find_content(self, content_key: str) -> Optional[Tuple[int, int]]:
+        # (message_id, verified_at)
+        def op(conn):
+            return conn.execute("""
+                SELECT c.message_id, COALESCE(v.verified_at, 0)
+                FROM content_index c LEFT JOIN vault_messages v ON v.message_id = c.message_id
+                WHERE c.content_key = ?
+            """, (content_key,)).fetchone()
+        return await self.read(op)
+
+    async def index_content(self, rows: List[Tuple[str, int, Optional[int]]]):
+        # rows: (content_key, message_id, size); the newest upload wins
+        def op(conn):
+            now = int(time.time())
+            conn.executemany(
+                "INSERT OR REPLACE INTO content_index (content_key, message_id, size, created_at) VALUES (?, ?, ?, ?)",
+                [(key, message_id, size, now) for key, message_id, size in rows]
+            )
+            self._track_messages(conn, [message_id for _, message_id, _ in rows])
+        await self.write(op)
+
+    # ================= Vault Verification =================
+    def _track_messages(self, conn: sqlite3.Connection, message_ids: List[int]):
+        # A message we just sent or linked counts as verified now; known ones keep their timestamp
+        now = int(time.time())
+        conn.executemany("INSERT OR IGNORE INTO vault_messages (message_id, verified_at) VALUES (?, ?)",
+                         [(m, now) for m in message_ids])
+
+    def _forget_messages(self, conn: sqlite3.Connection, message_ids: List[int]):
+        # Vault messages that are gone can't be reused by the dedup or Terabox caches
+        rows = [(m,) for m in message_ids]
+        conn.executemany("DELETE FROM content_index WHERE message_id = ?", rows)
+        conn.executemany("DELETE FROM terabox_files WHERE message_id = ?", rows)
+        conn.executemany("DELETE FROM vault_messages WHERE message_id = ?", rows)
+
+    async def track_messages(self, message_ids: List[int]):
+        await self.write(lambda conn: self._track_messages(conn, message_ids))
+
+    async def forget_messages(self, message_ids: List[int]):
+        if message_ids: await self.write(lambda conn: self._forget_messages(conn, message_ids))
+
+    async def stale_vault_messages(self, checked_before: float, limit: int) -> List[int]:
+        def op(conn):
+            return [r[0] for r in conn.execute(
+                "SELECT message_id FROM vault_messages WHERE verified_at < ? ORDER BY verified_at LIMIT ?",
+                (checked_before, limit)
+            )]
+        return await self.read(op)
+
+    async def mark_verified(self, message_ids: List[int]):
+        now = int(time.time())
+        await self.write(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO vault_messages (message_id, verified_at) VALUES (?, ?)", [(m, now) for m in message_ids]
+        ))
+
+    async def evict_messages(self, message_ids: List[int]) -> List[str]:
+        # Drops every reference to vault messages that no longer exist. Links left with
+        # no items are removed too, so /start answers "invalid" instead of sending nothing.
+        # Returns the ids of the links that were removed.
+        def op(conn):
+            rows = [(m,) for m in message_ids]
+            affected = {r[0] for m in message_ids for r in conn.execute("SELECT link_id FROM link_items WHERE message_id = ?", (m,))}
+            conn.executemany("DELETE FROM link_items WHERE message_id = ?", rows)
+            dead_links = [l for l in affected if not conn.execute("SELECT 1 FROM link_items WHERE link_id = ? LIMIT 1", (l,)).fetchone()]
+            conn.executemany("DELETE FROM links WHERE link_id = ?", [(l,) for l in dead_links])
+            self._forget_messages(conn, message_ids)
+            return dead_links
+        if not message_ids: return []
+        return await self.write(op)
+
+    # ================= Pending Deletions =================
+    async def schedule_deletions(self, bot: str, chat_id: int, message_ids: List[int], due_at: float):
+        await self.write(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO pending_deletions (bot, chat_id, message_id, due_at) VALUES (?, ?, ?, ?)",
+            [(bot, chat_id, m, due_at) for m in message_ids]
+        ))
+
+    async def due_deletions(self, bots: Sequence[str], until: float, limit: int) -> List[Tuple[float, str, int, int]]:
+        def op(conn):
+            marks = ",".join("?" * len(bots))
+            return conn.execute(
+                f"SELECT due_at, bot, chat_id, message_id FROM pending_deletions "
+                f"WHERE due_at <= ? AND bot IN ({marks}) ORDER BY due_at LIMIT ?",
+                (until, *bots, limit)
+            ).fetchall()
+        if not bots: return []
+        return await self.read(op)
+
+    async def remove_deletions(self, rows: List[Tuple[str, int, int]]):
+        await self.write(lambda conn: conn.executemany(
+            "DELETE FROM pending_deletions WHERE bot = ? AND chat_id = ? AND message_id = ?", rows
+        ))
+
+    async def count_deletions(self) -> int:
+        return await self.read(lambda conn: conn.execute("SELECT COUNT(*) FROM pending_deletions").fetchone()[0])
+
+    # ================= Meta =================
+    async def get_meta(self, key: str) -> Optional[str]:
+        def op(conn):
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        return await self.read(op)
+
+    async def set_meta(self, key: str, value: str):
+        await self.write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value, updated_at) VALUES (?, ?, ?)", (key, value, int(time.time()))
+        ))
+
+    # ================= Persisted State =================
+    async def load_state(self, namespace: str) -> List[Tuple[str, str, Optional[float]]]:
+        self.submit(lambda conn: conn.execute(
+            "DELETE FROM state_entries WHERE namespace = ? AND expires_at <= ?", (namespace, time.time())
+        ))
+        def op(conn):
+            return conn.execute(
+                "SELECT key, value, expires_at FROM state_entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time())
+            ).fetchall()
+        return await self.read(op)
+
+    def put_state(self, namespace: str, key: str, value: str, expires_at: Optional[float]) -> Future:
+        return self.submit(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO state_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, expires_at)
+        ))
+
+    def drop_state(self, namespace: str, key: str) -> Future:
+        return self.submit(lambda conn: conn.execute(
+            "DELETE FROM state_entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ))
+
+
+db = Storage()
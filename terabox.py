@@ -1,21 +1,36 @@
 import os
 import asyncio
 import logging
-import sqlite3
 import secrets
-import aiohttp
+import hashlib
 import aiofiles
 import re
-from pyrogram import Client, filters, enums
+from typing import NamedTuple
+from pyrogram import Client, filters, enums, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from storage import db
+from progress import ProgressReporter
+from scheduler import scheduler
+from links import share_links, make_share_link
+from state import StateStore
+from downloader import probe, download, has_partial, prune_partials
+from hls import download_hls
+from pipeline import can_pipeline, send_streamed
+from jobs import jobs, QueueFull, spawn
+from singleflight import SingleFlight
+from dedup import dedup, new_hasher, content_key, hash_file
+from verifier import verifier, trusted
+from backends import backend, leader, claim_update
+from terabox_links import TERABOX_DOMAINS, resolutions, resolve_share_key, canonical_url
+from http_client import http
+from xapi import xapi, XapiError
+from metrics import registry, cache_lookups, timed, upload_seconds
 
 # ================= Configuration =================
 API_ID = int(os.getenv("API_ID", "1234567")) 
 API_HASH = os.getenv("API_HASH", "YOUR_API_HASH") 
 TERABOX_BOT_TOKEN = os.getenv("TERABOX_BOT_TOKEN", "YOUR_TERABOX_TOKEN")
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "-100YOUR_CHANNEL_ID_HERE")) 
-XAPI_KEY = os.getenv("XAPI_KEY", "YOUR_XAPIVERSE_KEY")
-FILESHARE_BOT_USERNAME = os.getenv("FILESHARE_BOT_USERNAME", "FSB69_BOT") 
 
 TEMP_MSG_DELETE_TIME = 120    
 FILE_DELETE_TIME = 3600       
@@ -30,76 +45,73 @@ app = Client(
     parse_mode=enums.ParseMode.HTML
 )
 
-active_welcome_msgs = {}
+active_welcome_msgs = StateStore("active_welcome_msgs", ttl=FILE_DELETE_TIME, max_entries=10000, shared=True)
+
+# One fetch per Terabox URL at a time; concurrent requesters share its result (see singleflight.py)
+terabox_inflight = SingleFlight("terabox")
+
+class VaultFile(NamedTuple):
+    message_id: int
+    file_name: str
+    duration: str
+    size: str
+    is_video: bool
+
+class TeraboxError(Exception):
+    # Message text shown to every requester of the failed fetch
+    pass
 
 # ================= Database Setup =================
-conn = sqlite3.connect('bot_database.db', check_same_thread=False)
-cursor = conn.cursor()
-cursor.execute('CREATE TABLE IF NOT EXISTS shared_files (link_id TEXT, message_id INTEGER)')
-cursor.execute('CREATE TABLE IF NOT EXISTS terabox_cache (terabox_url TEXT PRIMARY KEY, message_id INTEGER)')
-conn.commit()
+db.start()  # WAL + dedicated writer thread, shared with main.py
 
 # ================= Utility Functions =================
 async def safe_delete(message):
     try: await message.delete()
     except Exception: pass
 
+# Deletions are persisted and survive restarts (see scheduler.py)
 async def delete_after(client, chat_id, message_id, delay):
-    await asyncio.sleep(delay)
-    try: await client.delete_messages(chat_id, message_id)
-    except Exception: pass
+    await scheduler.schedule(client, chat_id, message_id, delay)
+
+# Heavy work runs on the bounded job queue (see jobs.py); the handler returns right away
+async def enqueue_job(client, message, status, run):
+    async def on_position(pos):
+        await status.phase(f"<blockquote><code>[⏳] Queued — position {pos}. Waiting for a free worker...</code></blockquote>")
 
-# 🥷 TRUE HTML DOM UNSHORTENER (Bypasses Cloudflare & JS Redirects)
-async def resolve_redirect(url):
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-        }
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url, allow_redirects=True, timeout=15) as resp:
-                # 1. Native HTTP Redirect
-                if "surl=" in str(resp.url):
-                    return str(resp.url)
-                
-                html_content = await resp.text()
-                
-                # 2. Extract from og:url meta tag
-                match_og = re.search(r'property="og:url"\s+content="([^"]+surl=[^"]+)"', html_content)
-                if match_og:
-                    return match_og.group(1).replace("&amp;", "&")
-                    
-                # 3. Extract from JS window.location
-                match_js = re.search(r'window\.location\.href\s*=\s*["\']([^"\']+surl=[^"\']+)["\']', html_content)
-                if match_js:
-                    return match_js.group(1).replace("&amp;", "&")
-                    
-                # 4. Extract raw surl string anywhere in DOM
-                match_raw = re.search(r'surl=([A-Za-z0-9_-]+)', html_content)
-                if match_raw:
-                    return f"https://www.1024tera.com/wap/share/filelist?surl={match_raw.group(1)}"
-                    
-    except Exception as e:
-        print(f"Redirect Error: {e}")
-        
-    # 5. Mathematical Fallback (Always works for /s/1xxxx formats if network fails)
-    math_match = re.search(r'/s/1([A-Za-z0-9_-]+)', url)
-    if math_match:
-        return f"https://www.1024tera.com/wap/share/filelist?surl={math_match.group(1)}"
-        
-    return url
+        pos = await jobs.submit(message.from_user.id, "terabox", run, on_position=on_position)
+    except QueueFull:
+        await status.finish("<blockquote>⚠️ <b>Server Busy.</b> Too many requests right now, try again in a minute.</blockquote>")
+        await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
+        return
+    if jobs.running + pos > jobs.workers:
+        await on_position(pos)
+
+# ================= Replica Dispatch =================
+# With REDIS_URL set every replica receives each update; only the node that claims
+# it runs the handlers below (see backends.claim_update)
+@app.on_message(group=-1)
+async def claim_message(client, message):
+    if not await claim_update(f"{client.name}:{message.chat.id}:{message.id}"):
+        message.stop_propagation()
+
+@app.on_callback_query(group=-1)
+async def claim_callback(client, callback_query):
+    if not await claim_update(f"{client.name}:cb:{callback_query.id}"):
+        callback_query.stop_propagation()
 
 # ================= Bot Logic =================
 @app.on_message(filters.command("start") & filters.private)
 async def cmd_start(client, message):
     await safe_delete(message)
     msg = await message.reply_text("<blockquote>✨ <b>Transmit a Terabox Link</b> 🙌\n<i>Our servers will handle the rest.</i></blockquote>")
-    active_welcome_msgs[message.chat.id] = msg.id 
-    asyncio.create_task(delete_after(client, msg.chat.id, msg.id, TEMP_MSG_DELETE_TIME))
+    await active_welcome_msgs.aset(message.chat.id, msg.id)
+    await delete_after(client, msg.chat.id, msg.id, TEMP_MSG_DELETE_TIME)
 
 @app.on_callback_query(filters.regex("terabox_start"))
 async def callback_download_more(client, callback_query):
     msg = await callback_query.message.reply_text("<blockquote>✨ <b>Transmit a Terabox Link</b> 🙌\n<i>Ready for the next payload.</i></blockquote>")
-    active_welcome_msgs[callback_query.message.chat.id] = msg.id 
+    await active_welcome_msgs.aset(callback_query.message.chat.id, msg.id)
     await callback_query.answer()
 
 @app.on_message(filters.text & filters.private & ~filters.command(["start"]))
@@ -108,22 +120,17 @@ async def process_terabox_link(client, message):
     raw_text = message.text
     text = raw_text.lower()
     
-    if chat_id in active_welcome_msgs:
+    welcome_id = await active_welcome_msgs.apop(chat_id)
+    if welcome_id:
         try:
-            await client.delete_messages(chat_id, active_welcome_msgs[chat_id])
-            del active_welcome_msgs[chat_id]
+            await client.delete_messages(chat_id, welcome_id)
         except Exception:
             pass
             
-    valid_domains = [
-        "terabox", "1024tera", "1024terabox", "terashare", "4funbox", 
-        "mirrobox", "nephobox", "freeterabox", "momerybox", "teraboxapp"
-    ]
-    
-    if not any(domain in text for domain in valid_domains):
+    if not any(domain in text for domain in TERABOX_DOMAINS):
         await safe_delete(message)
         err = await message.reply_text("<blockquote>⚠️ <b>Invalid protocol.</b>\nRequires a valid Terabox family URL.</blockquote>")
-        asyncio.create_task(delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME))
+        await delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME)
         return
 
     await safe_delete(message)
@@ -131,42 +138,104 @@ async def process_terabox_link(client, message):
     url_match = re.search(r"https?://[^\s]+", raw_text, re.IGNORECASE)
     if not url_match:
         err = await message.reply_text("<blockquote>❌ <b>Extraction Failed.</b> No valid URL detected.</blockquote>")
-        asyncio.create_task(delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME))
+        await delete_after(client, err.chat.id, err.id, TEMP_MSG_DELETE_TIME)
         return
         
     short_url = url_match.group(0)
     
+    status = await ProgressReporter.reply(message, "<blockquote><code>[🔍] Fetching...</code></blockquote>")
+    await enqueue_job(client, message, status, lambda: terabox_job(client, message, short_url, status))
+
+async def terabox_job(client, message, short_url, status):
     await client.send_chat_action(message.chat.id, enums.ChatAction.TYPING)
-    anim_msg = await message.reply_text("<blockquote><code>[🔍] Fetching...</code></blockquote>")
 
-    # 🥷 1. UNSHORTEN DOMAIN
-    clean_url = await resolve_redirect(short_url)
+    # 🥷 1. CANONICAL SHARE KEY (same file on any mirror/short link -> same surl; memoized)
+    share_key = await resolve_share_key(short_url)
+    clean_url = canonical_url(share_key) if share_key else short_url
+    cache_key = share_key or short_url
     print(f"Processed Link: {clean_url}")
     
     # ================= CACHE CHECK =================
-    cursor.execute('SELECT message_id FROM terabox_cache WHERE terabox_url = ?', (clean_url,))
-    cached_result = cursor.fetchone()
+    cached = await db.get_terabox_file(cache_key)
+    vault_file = await cached_vault_file(client, cache_key, cached) if cached else None
+    cache_lookups.inc(cache="terabox", result="hit" if vault_file else "miss")
     
-    if cached_result:
-        msg_id = cached_result[0]
-        link_id = secrets.token_urlsafe(8)
-        cursor.execute('INSERT INTO shared_files (link_id, message_id) VALUES (?, ?)', (link_id, msg_id))
-        conn.commit()
-        
-        orig_msg = await client.get_messages(CHANNEL_ID, msg_id)
-        vid = orig_msg.video or orig_msg.document
-        
-        file_name = getattr(vid, "file_name", "terabox_video.mp4")
-        dur_secs = getattr(vid, "duration", 0)
-        dur_str = f"{dur_secs // 60:02d}:{dur_secs % 60:02d}" if dur_secs else "Unknown"
-        file_size = getattr(vid, "file_size", 0)
-        size_mb = f"{file_size / (1024 * 1024):.2f} MB" if file_size else "Unknown"
+    if vault_file:
+        await deliver_vault_file(client, message, status, vault_file)
+        return 
+    # ==================================================================
 
-        icon = "🎬" if orig_msg.video else "📄"
+    # ================= IN-FLIGHT DEDUP =================
+    # Same link already being fetched for someone else: wait for that upload instead
+    # of paying for a second API call, download and upload. The wait runs outside the
+    # job queue so it doesn't hold a worker.
+    shared = terabox_inflight.pending(cache_key)
+    if shared:
+        await status.phase("<blockquote><code>[🔗] Same file is already being fetched, joining it...</code></blockquote>")
+        spawn(follow_inflight(client, message, status, shared))
+        return
+
+    try:
+        vault_file = await terabox_inflight.do(cache_key, lambda: ingest_terabox(client, message, clean_url, cache_key, status))
+    except Exception as e:
+        await fail_status(client, status, e)
+        return
+    await deliver_vault_file(client, message, status, vault_file)
+
+async def cached_vault_file(client, cache_key, cached):
+    # Metadata is stored with the row and the verifier vouches for the message, so a
+    # hit normally costs no Telegram call before the copy. Rows from before that
+    # (or not checked lately) are looked up once and filled in.
+    msg_id, file_name, dur_str, size_mb, is_video, verified_at = cached
+    if file_name is not None and trusted(verified_at):
+        return VaultFile(msg_id, file_name, dur_str, size_mb, bool(is_video))
+
+    orig_msg = await client.get_messages(CHANNEL_ID, msg_id)
+    if orig_msg.empty:
+        await backend.evict_messages([msg_id])   # Deleted from the vault by hand: fetch it again
+        return None
+    vid = orig_msg.video or orig_msg.document
+    
+    file_name = getattr(vid, "file_name", None) or "terabox_video.mp4"
+    dur_secs = getattr(vid, "duration", 0)
+    dur_str = f"{dur_secs // 60:02d}:{dur_secs % 60:02d}" if dur_secs else "Unknown"
+    file_size = getattr(vid, "file_size", 0)
+    size_mb = f"{file_size / (1024 * 1024):.2f} MB" if file_size else "Unknown"
+
+    vault_file = VaultFile(msg_id, file_name, dur_str, size_mb, bool(orig_msg.video))
+    await asyncio.gather(db.cache_terabox(cache_key, *vault_file), db.mark_verified([msg_id]))
+    return vault_file
+
+async def follow_inflight(client, message, status, shared):
+    try:
+        vault_file = await terabox_inflight.wait(shared)
+    except asyncio.CancelledError as e:
+        if not shared.cancelled(): raise   # This follower was cancelled, not the fetch it joined
+        await fail_status(client, status, e)
+        return
+    except Exception as e:
+        await fail_status(client, status, e)
+        return
+    await deliver_vault_file(client, message, status, vault_file)
+
+async def fail_status(client, status, error):
+    # TeraboxError carries the text for the user; anything else gets the generic one
+    if isinstance(error, TeraboxError):
+        text = str(error)
+    else:
+        print(f"Terabox Exception: {error!r}")
+        text = "<blockquote>❌ <b>Upload Error.</b> Please try again later.</blockquote>"
+    await status.finish(text)
+    await delete_after(client, status.chat_id, status.id, TEMP_MSG_DELETE_TIME)
+
+async def deliver_vault_file(client, message, status, vault_file):
+    # Every requester gets their own copy of the vault message
+    try:
+        icon = "🎬" if vault_file.is_video else "📄"
         user_caption = (
-            f"{icon} <b>{file_name}</b>\n\n"
-            f"⏱ <b>Duration:</b> {dur_str}\n"
-            f"📦 <b>Size:</b> {size_mb}\n\n"
+            f"{icon} <b>{vault_file.file_name}</b>\n\n"
+            f"⏱ <b>Duration:</b> {vault_file.duration}\n"
+            f"📦 <b>Size:</b> {vault_file.size}\n\n"
             f"⚠️ <b>Note:</b> File will be auto-deleted after {FILE_DELETE_TIME // 3600} hour(s)"
         )
 
@@ -174,196 +243,202 @@ async def process_terabox_link(client, message):
         sent_vid = await client.copy_message(
             chat_id=message.chat.id, 
             from_chat_id=CHANNEL_ID, 
-            message_id=msg_id, 
+            message_id=vault_file.message_id, 
             caption=user_caption, 
             reply_markup=keyboard
         )
-        active_welcome_msgs[message.chat.id] = sent_vid.id
-        await safe_delete(anim_msg)
-        asyncio.create_task(delete_after(client, message.chat.id, sent_vid.id, FILE_DELETE_TIME))
-        return 
-    # ==================================================================
+        await active_welcome_msgs.aset(message.chat.id, sent_vid.id)
+        await status.delete()
+        await delete_after(client, message.chat.id, sent_vid.id, FILE_DELETE_TIME)
+    except Exception as e:
+        verifier.recheck([vault_file.message_id])   # Evicted if the vault post is gone; next request re-fetches
+        await fail_status(client, status, e)
 
-    api_url = 'https://xapiverse.com/api/terabox-pro'
-    headers = {'Content-Type': 'application/json', 'xAPIverse-Key': XAPI_KEY}
-    payload = {"url": clean_url} 
-    timeout = aiohttp.ClientTimeout(total=3600) 
-    
-    m3u8_url = None
-    raw_mp4_url = None
-    thumb_url = None
-    file_name = "terabox_video.mp4"
-    duration_str = "Unknown"
-    size_fmt = "Unknown"
-    
-    api_success = False
+async def ingest_terabox(client, message, clean_url, cache_key, status) -> VaultFile:
+    # API resolve -> download -> upload to the vault channel. Runs once per URL even
+    # when several users ask at the same time (see terabox_inflight).
+    # The vault caption needs a share link: fail now, not after the download and upload
+    if not await share_links.ensure():
+        raise TeraboxError("<blockquote>⏳ <b>Bot is still starting up.</b> Please resend the link in a minute.</blockquote>")
 
-    # 🥷 2. CREDIT SAVER API LOOP
-    for attempt in range(3):
-        try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(api_url, json=payload, headers=headers) as resp:
-                    data = await resp.json()
-                    
-                    if data.get("status") == "success" and data.get("list"):
-                        file_data = data["list"][0]
-                        
-                        streams = file_data.get("fast_stream_url")
-                        if isinstance(streams, dict):
-                            m3u8_url = streams.get("1080p") or streams.get("720p") or streams.get("480p") or streams.get("360p")
-                        
-                        raw_mp4_url = file_data.get("stream_url") or file_data.get("fast_download_link") or file_data.get("download_link")
-                        
-                        thumb_url = file_data.get("thumbnail")
-                        file_name = file_data.get("name", "terabox_video.mp4")
-                        duration_str = file_data.get("duration", "00:00")
-                        size_fmt = file_data.get("size_formatted", "Unknown")
-                        
-                        api_success = True
-                        break 
-                    elif data.get("status") == "failed":
-                        # CRITICAL: If API actively rejects, abort to save credits!
-                        print(f"API Reject: {data}")
-                        break
-                        
-        except Exception as e:
-            print(f"API Error: {e}")
-        
-        if not api_success:
-            await asyncio.sleep(2)
+    # 🥷 2. CREDIT SAVER: cached answers, remembered dead shares, breaker (see xapi.py)
+    try:
+        api_file = await xapi.resolve(cache_key, clean_url)
+    except XapiError as e:
+        print(f"API Error: {e!r}")
+        raise TeraboxError("<blockquote>❌ <b>Extraction Failed.</b> The file is unavailable.</blockquote>")
 
-    if not api_success or (not m3u8_url and not raw_mp4_url):
-        await anim_msg.edit_text("<blockquote>❌ <b>Extraction Failed.</b> The file is unavailable.</blockquote>")
-        asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
-        return
+    m3u8_url, raw_mp4_url, thumb_url = api_file.m3u8_url, api_file.mp4_url, api_file.thumbnail
+    file_name, duration_str, size_fmt = api_file.name, api_file.duration, api_file.size_formatted
+
+    if not m3u8_url and not raw_mp4_url:
+        raise TeraboxError("<blockquote>❌ <b>Extraction Failed.</b> The file is unavailable.</blockquote>")
 
     dur_parts = duration_str.split(":")
     dur_secs = 0
     if len(dur_parts) == 2: dur_secs = int(dur_parts[0]) * 60 + int(dur_parts[1])
     elif len(dur_parts) == 3: dur_secs = int(dur_parts[0]) * 3600 + int(dur_parts[1]) * 60 + int(dur_parts[2])
 
-    await anim_msg.edit_text("<blockquote><code>[📥] Downloading...</code></blockquote>")
+    await status.phase("<blockquote><code>[📥] Downloading...</code></blockquote>")
     await client.send_chat_action(message.chat.id, enums.ChatAction.RECORD_VIDEO)
     
     os.makedirs("downloads", exist_ok=True)
-    local_filename = f"downloads/{secrets.token_hex(4)}_{file_name}"
+    prune_partials("downloads")
+    # Stable name per share: resending the same link resumes an interrupted ranged download
+    local_filename = f"downloads/tb_{hashlib.sha1(cache_key.encode()).hexdigest()[:8]}_{file_name}"
     thumb_path = f"downloads/thumb_{secrets.token_hex(4)}.jpg" if thumb_url else None
     
     try:
-        dl_headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-        }
-        
-        async with aiohttp.ClientSession(timeout=timeout, headers=dl_headers) as session:
+        try:
+            session = http.session
             if thumb_url:
                 async with session.get(thumb_url) as t_resp:
                     if t_resp.status == 200:
                         async with aiofiles.open(thumb_path, mode='wb') as f:
                             await f.write(await t_resp.read())
-            
+
             stream_downloaded = False
-            
-            # 🥷 3. RENDER FFmpeg BYPASS
+            pipelined = False
+            hasher = new_hasher()
+            content, size = None, None
+
+            # 🥷 3. CONCURRENT HLS FETCH (segments in parallel, single ffmpeg remux)
             if m3u8_url:
                 try:
-                    process = await asyncio.create_subprocess_exec(
-                        'ffmpeg', '-i', m3u8_url, '-c', 'copy', local_filename,
-                        stdout=asyncio.subprocess.DEVNULL,
-                        stderr=asyncio.subprocess.DEVNULL
-                    )
-                    await process.communicate()
+                    async with jobs.resource("download"):
+                        await download_hls(m3u8_url, local_filename, progress=status.transfer("[📥] Downloading..."))
                     # Verify successful download > 1MB
                     if os.path.exists(local_filename) and os.path.getsize(local_filename) > 1024 * 1024:
                         stream_downloaded = True
-                except Exception:
-                    pass # FFmpeg not installed on Render, fallback below!
-            
+                        size = os.path.getsize(local_filename)
+                        content = await hash_file(local_filename)
+                except Exception as e:
+                    print(f"HLS fetch failed, falling back to MP4: {e}")
+
             # If ffmpeg failed/missing OR no m3u8 stream was found, use the raw MP4
             if not stream_downloaded and raw_mp4_url:
-                async with session.get(raw_mp4_url) as resp:
-                    if resp.status == 200:
-                        async with aiofiles.open(local_filename, mode='wb') as f:
-                            while True:
-                                chunk = await resp.content.read(2 * 1024 * 1024) 
-                                if not chunk: break
-                                await f.write(chunk)
-                        
-                        # 1MB Trap Check
-                        if os.path.getsize(local_filename) > 1024 * 1024:
-                            stream_downloaded = True
-                            
+                info = await probe(session, raw_mp4_url)
+                if can_pipeline(info):
+                    # Streamed into the upload below instead of landing on disk first
+                    pipelined = stream_downloaded = True
+                else:
+                    # Parallel ranged fetch when the CDN allows it, single stream otherwise
+                    async with jobs.resource("download"):
+                        size = await download(session, raw_mp4_url, local_filename, info=info, progress=status.transfer("[📥] Downloading..."), hasher=hasher)
+
+                    # 1MB Trap Check
+                    if os.path.getsize(local_filename) > 1024 * 1024:
+                        stream_downloaded = True
+                        content = content_key(hasher, size)
+
             if not stream_downloaded:
                 raise Exception("Download blocked or file too small.")
 
-    except Exception as e:
-        print(f"Download Exception: {e}")
-        await anim_msg.edit_text("<blockquote>❌ <b>Download Failed.</b> Please try again later.</blockquote>")
-        asyncio.create_task(delete_after(client, anim_msg.chat.id, anim_msg.id, TEMP_MSG_DELETE_TIME))
-        return
+        except Exception as e:
+            print(f"Download Exception: {e}")
+            xapi.invalidate(cache_key)   # Signed URLs may have died early; the next try asks the API again
+            raise TeraboxError("<blockquote>❌ <b>Download Failed.</b> Please try again later.</blockquote>")
 
-    await anim_msg.edit_text("<blockquote><code>[📤] Uploading...</code></blockquote>")
-    await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO)
+        file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'mp4'
+        video_extensions = ['mp4', 'mkv', 'webm', 'avi', 'mov', 'flv']
 
-    link_id = secrets.token_urlsafe(8)
-    fsb_link = f"https://t.me/{FILESHARE_BOT_USERNAME}?start={link_id}"
-    channel_caption = f"🔗 **Access Link:**\n<code>{fsb_link}</code>"
+        # Same bytes already in the vault (another share, a /download...): reuse that message
+        existing = await dedup.lookup(content)
+        if existing:
+            vault_file = VaultFile(existing, file_name, duration_str, size_fmt, file_ext in video_extensions)
+            await db.cache_terabox(cache_key, *vault_file)
+            return vault_file
 
-    file_ext = file_name.split('.')[-1].lower() if '.' in file_name else 'mp4'
-    video_extensions = ['mp4', 'mkv', 'webm', 'avi', 'mov', 'flv']
+        await status.phase("<blockquote><code>[📤] Uploading...</code></blockquote>")
+        await client.send_chat_action(message.chat.id, enums.ChatAction.UPLOAD_VIDEO)
 
-    try:
-        if file_ext in video_extensions:
-            saved_msg = await client.send_video(
-                chat_id=CHANNEL_ID, 
-                video=local_filename, 
-                caption=channel_caption, 
-                has_spoiler=True,
-                duration=dur_secs,
-                thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
-                file_name=file_name,
-                supports_streaming=True
-            )
-        else:
-            saved_msg = await client.send_document(
-                chat_id=CHANNEL_ID, 
-                document=local_filename, 
-                caption=channel_caption, 
-                file_name=file_name
-            )
-        
-        cursor.execute('INSERT INTO shared_files (link_id, message_id) VALUES (?, ?)', (link_id, saved_msg.id))
-        cursor.execute('INSERT INTO terabox_cache (terabox_url, message_id) VALUES (?, ?)', (clean_url, saved_msg.id))
-        conn.commit()
+        link_id = secrets.token_urlsafe(8)
+        fsb_link = make_share_link(link_id)
+        channel_caption = f"🔗 **Access Link:**\n<code>{fsb_link}</code>"
 
-        icon = "🎬" if file_ext in video_extensions else "📄"
-        user_caption = (
-            f"{icon} <b>{file_name}</b>\n\n"
-            f"⏱ <b>Duration:</b> {duration_str}\n"
-            f"📦 <b>Size:</b> {size_fmt}\n\n"
-            f"⚠️ <b>Note:</b> File will be auto-deleted after {FILE_DELETE_TIME // 3600} hour(s)"
-        )
-        
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("⬇️ Download More", callback_data="terabox_start")]])
-        sent_vid = await client.copy_message(
-            chat_id=message.chat.id, 
-            from_chat_id=CHANNEL_ID, 
-            message_id=saved_msg.id, 
-            caption=user_caption, 
-            reply_markup=keyboard
-        )
-        active_welcome_msgs[message.chat.id] = sent_vid.id
+        async with jobs.resource("upload"):
+            if pipelined:
+                async with jobs.resource("download"):
+                    with timed(upload_seconds, source="terabox", mode="pipelined"):
+                        saved_msg = await send_streamed(
+                            client, CHANNEL_ID, session, info, file_name,
+                            caption=channel_caption,
+                            video=file_ext in video_extensions,
+                            has_spoiler=file_ext in video_extensions,   # send_document never blurs either
+                            thumb=thumb_path,
+                            duration=dur_secs,
+                            progress=status.transfer("[📤] Uploading..."),
+                            hasher=hasher
+                        )
+                size = info.size
+                content = content_key(hasher, size)
+            elif file_ext in video_extensions:
+                with timed(upload_seconds, source="terabox", mode="file"):
+                    saved_msg = await client.send_video(
+                        chat_id=CHANNEL_ID, 
+                        video=local_filename, 
+                        caption=channel_caption, 
+                        has_spoiler=True,
+                        duration=dur_secs,
+                        thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
+                        file_name=file_name,
+                        supports_streaming=True,
+                        progress=status.transfer("[📤] Uploading...")
+                    )
+            else:
+                with timed(upload_seconds, source="terabox", mode="file"):
+                    saved_msg = await client.send_document(
+                        chat_id=CHANNEL_ID, 
+                        document=local_filename, 
+                        caption=channel_caption, 
+                        file_name=file_name,
+                        progress=status.transfer("[📤] Uploading...")
+                    )
         
-        asyncio.create_task(delete_after(client, message.chat.id, sent_vid.id, FILE_DELETE_TIME))
+        # The channel caption's link keeps working for whoever opens the vault post
+        vault_file = VaultFile(saved_msg.id, file_name, duration_str, size_fmt, file_ext in video_extensions)
+        await asyncio.gather(backend.add_link(link_id, [saved_msg.id]), db.cache_terabox(cache_key, *vault_file),
+                             dedup.remember(saved_msg, content, size))
+        return vault_file
 
-    except Exception as e:
-        print(f"Upload Exception: {e}")
-        await anim_msg.edit_text("<blockquote>❌ <b>Upload Error.</b> Please try again later.</blockquote>")
     finally:
-        if os.path.exists(local_filename): os.remove(local_filename)
+        # A partial with a .state.json sidecar is kept for the retry; prune_partials drops abandoned ones
+        if os.path.exists(local_filename) and not has_partial(local_filename): os.remove(local_filename)
         if thumb_path and os.path.exists(thumb_path): os.remove(thumb_path)
-        await safe_delete(anim_msg)
+
+# ================= Lifecycle =================
+# startup()/shutdown() cover this bot only; shared services (HTTP pool, deletion
+# scheduler, job queue) are started and stopped by whoever runs the loop: main()
+# below when started on its own, launcher.py when both bots share one process.
+async def startup():
+    await resolutions.load()
+    await xapi.load()
+    await http.start()
+    await app.start()
+    await share_links.start()  # Follows the username FileShareBot publishes (in process when launched together)
+    scheduler.register(app)
+    if verifier.client is None:
+        verifier.attach(app, CHANNEL_ID)  # For rechecks on failed copies; FileShareBot runs the sweep
+
+async def shutdown():
+    await app.stop()
+
+async def main():
+    await startup()
+    await leader.start()  # Always this node unless REDIS_URL is set (see backends.py)
+    await scheduler.start()  # Picks up deletions that came due while we were down
+    await jobs.start()
+    await registry.start()  # Event-loop lag probe and /metrics samplers
+    await idle()
+    await registry.stop()
+    await jobs.stop()
+    await scheduler.stop()
+    await leader.stop()
+    await share_links.stop()
+    await shutdown()
+    await http.close()
+    await backend.close()
 
 if __name__ == "__main__":
     print("Starting Terabox Bot...")
-    app.run()
-    
+    app.run(main())
@@ -0,0 +1,88 @@
+import re
+import logging
+import urllib.parse
+from typing import Optional
+from http_client import http, timeout
+from state import StateStore
+from metrics import timed
+
+# ================= Configuration =================
+TERABOX_DOMAINS = [
+    "terabox", "1024tera", "1024terabox", "terashare", "4funbox",
+    "mirrobox", "nephobox", "freeterabox", "momerybox", "teraboxapp"
+]
+RESOLVE_TTL = 7 * 24 * 3600      # A short link keeps pointing at the same share
+RESOLVE_MAX_HTML = 512 * 1024    # Stop reading a landing page after this much without a surl
+RESOLVE_TIMEOUT = timeout(total=15)
+
+log = logging.getLogger("terabox_links")
+
+# short/unknown URL -> surl, persisted so restarts don't re-resolve (see state.py)
+resolutions = StateStore("terabox_resolutions", ttl=RESOLVE_TTL, max_entries=50000, persist=True)
+
+_SURL_PARAM = re.compile(r"[?&]surl=([A-Za-z0-9_-]+)")
+_SHARE_PATH = re.compile(r"/s/1([A-Za-z0-9_-]+)")
+# Only the page's own identity counts (og:url, a JS redirect): a bare surl= in a
+# partially streamed page can just as well belong to an ad or a related share
+_HTML_PATTERNS = [
+    re.compile(r'<meta[^>]+property="og:url"[^>]+content="([^"]+)"'),
+    re.compile(r'<meta[^>]+content="([^"]+)"[^>]+property="og:url"'),
+    re.compile(r'window\.location\.href\s*=\s*["\']([^"\']+)["\']'),
+]
+
+
+# ================= Canonical Share Key =================
+def is_terabox_url(url: str) -> bool:
+    host = urllib.parse.urlparse(url).netloc.lower()
+    return any(domain in host for domain in TERABOX_DOMAINS)
+
+
+def share_key(url: str) -> Optional[str]:
+    # The surl is the share's identity on every Terabox mirror:
+    #   https://terabox.com/s/1AbC...                -> AbC...
+    #   https://www.1024tera.com/sharing/link?surl=AbC...  -> AbC...
+    # Short links (e.g. teraboxlink / custom domains) carry no surl and need resolving.
+    m = _SURL_PARAM.search(url.replace("&amp;", "&"))
+    if m: return m.group(1)
+    m = _SHARE_PATH.search(urllib.parse.urlparse(url).path)
+    if m: return m.group(1)
+    return None
+
+
+def canonical_url(key: str) -> str:
+    return f"https://www.1024tera.com/wap/share/filelist?surl={key}"
+
+
+# ================= Resolution =================
+@timed("terabox_resolve_seconds")
+async def _resolve_remote(url: str) -> Optional[str]:
+    # Redirect target first; otherwise scan the landing page as it streams in and
+    # stop at its canonical URL instead of downloading and regex-scanning all of it.
+    async with http.session.get(url, allow_redirects=True, timeout=RESOLVE_TIMEOUT) as resp:
+        for hop in list(resp.history) + [resp]:
+            key = share_key(str(hop.url))
+            if key: return key
+        html = ""
+        async for chunk in resp.content.iter_chunked(16 * 1024):
+            html += chunk.decode("utf-8", "replace")
+            for pattern in _HTML_PATTERNS:
+                m = pattern.search(html)
+                key = m and share_key(m.group(1))
+                if key: return key
+            if len(html) >= RESOLVE_MAX_HTML: break
+    return None
+
+
+async def resolve_share_key(url: str) -> Optional[str]:
+    # URL -> surl with no network when the URL already carries it or was seen recently
+    key = share_key(url)
+    if key: return key
+    key = resolutions.get(url)
+    if key: return key
+    try:
+        key = await _resolve_remote(url)
+    except Exception as e:
+        log.warning(f"Redirect Error: {e}")
+    if key:
+        resolutions.set(url, key)
+    return key
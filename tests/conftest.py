@@ -0,0 +1,35 @@
+import os
+import sys
+import asyncio
+import tempfile
+import pytest
+from aiohttp import web
+
+# Modules open their SQLite file and read config at import time
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="fsb_tests_"), "test.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def stub_server():
+    # run(routes, scenario): serves {(method, path): handler} on a free local port,
+    # opens the shared HTTP session and returns asyncio.run(scenario(base_url)),
+    # base_url ending in "/"
+    from http_client import http
+
+    def run(routes, scenario):
+        async def main():
+            app = web.Application()
+            for (method, path), handler in routes.items():
+                app.router.add_route(method, path, handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            await http.start()
+            try:
+                return await scenario(f"http://127.0.0.1:{runner.addresses[0][1]}/")
+            finally:
+                await http.close()
+                await runner.cleanup()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,116 @@
+# The ranged multi-connection downloader against a local stub that honours Range:
+# segment reassembly, resume from the .state.json sidecar, refusal of a stale
+# sidecar when the file changed, and the single-connection fallback.
+import os
+import json
+import hashlib
+import pytest
+from aiohttp import web
+
+import downloader
+from http_client import http
+from downloader import download, has_partial, probe
+
+SEGMENT = 64 * 1024
+
+
+class StubFile:
+    # Serves one blob; fail_segments answer 500 to ranged requests starting there
+    def __init__(self, data: bytes, etag='"v1"', ranges: bool = True):
+        self.data, self.etag, self.ranges = data, etag, ranges
+        self.fail_segments = set()
+        self.requested = []   # Start offsets of every ranged GET after the probe
+
+    async def handler(self, request):
+        headers = {"ETag": self.etag} if self.etag else {}
+        rng = request.headers.get("Range")
+        if not rng or not self.ranges:
+            return web.Response(body=self.data, headers=headers)
+        start, end = map(int, rng.split("=", 1)[1].split("-"))
+        if rng != "bytes=0-0":
+            self.requested.append(start)
+            if start // SEGMENT in self.fail_segments:
+                return web.Response(status=500)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(self.data)}"
+        return web.Response(body=self.data[start:end + 1], status=206, headers=headers)
+
+
+@pytest.fixture
+def run_download(stub_server, monkeypatch):
+    monkeypatch.setattr(downloader, "SEGMENT_SIZE", SEGMENT)
+    monkeypatch.setattr(downloader, "SEGMENT_RETRIES", 0)
+
+    def run(stub: StubFile, dest: str, hasher=None):
+        async def scenario(base):
+            info = await probe(http.session, base + "file.bin")
+            return info, await download(http.session, base + "file.bin", dest, info=info, connections=4, hasher=hasher)
+        return stub_server({("GET", "/file.bin"): stub.handler}, scenario)
+    return run
+
+
+def test_segments_are_reassembled_in_place(tmp_path, run_download):
+    data = os.urandom(10 * SEGMENT + 123)
+    stub, dest = StubFile(data), str(tmp_path / "f.bin")
+    hasher = hashlib.sha256()
+    info, size = run_download(stub, dest, hasher)
+    assert info.accept_ranges and info.etag == '"v1"'
+    assert size == len(data) and open(dest, "rb").read() == data
+    assert hasher.digest() == hashlib.sha256(data).digest()
+    assert sorted(stub.requested) == [i * SEGMENT for i in range(11)]
+    assert not has_partial(dest)   # Sidecar removed once complete
+
+
+def test_interrupted_download_resumes_missing_segments(tmp_path, run_download):
+    data = os.urandom(8 * SEGMENT)
+    stub, dest = StubFile(data), str(tmp_path / "f.bin")
+    stub.fail_segments = {5}
+    with pytest.raises(Exception, match="HTTP 500"):
+        run_download(stub, dest)
+    assert has_partial(dest)
+    done = set(json.load(open(dest + ".state.json"))["done"])
+    assert 5 not in done and done
+
+    stub.fail_segments, stub.requested = set(), []
+    hasher = hashlib.sha256()
+    _, size = run_download(stub, dest, hasher)
+    assert open(dest, "rb").read() == data
+    assert hasher.digest() == hashlib.sha256(data).digest()   # Resumed segments are hashed from disk
+    assert sorted(s // SEGMENT for s in stub.requested) == sorted(set(range(8)) - done)
+
+
+def test_stale_state_is_not_resumed_when_file_changed(tmp_path, run_download):
+    stub, dest = StubFile(os.urandom(8 * SEGMENT)), str(tmp_path / "f.bin")
+    stub.fail_segments = {7}
+    with pytest.raises(Exception):
+        run_download(stub, dest)
+    assert has_partial(dest)
+
+    new = os.urandom(8 * SEGMENT)   # Same size, different content and ETag
+    stub.data, stub.etag, stub.fail_segments, stub.requested = new, '"v2"', set(), []
+    run_download(stub, dest)
+    assert open(dest, "rb").read() == new
+    assert sorted(stub.requested) == [i * SEGMENT for i in range(8)]
+
+
+def test_state_without_validators_is_not_resumed(tmp_path, run_download):
+    data = os.urandom(6 * SEGMENT)
+    stub, dest = StubFile(data, etag=None), str(tmp_path / "f.bin")
+    stub.fail_segments = {5}
+    with pytest.raises(Exception):
+        run_download(stub, dest)
+    stub.fail_segments, stub.requested = set(), []
+    run_download(stub, dest)
+    assert open(dest, "rb").read() == data
+    assert len(stub.requested) == 6
+
+
+def test_server_ignoring_range_falls_back_to_one_connection(tmp_path, run_download):
+    data = os.urandom(5 * SEGMENT)
+    stub, dest = StubFile(data, ranges=False), str(tmp_path / "f.bin")
+    open(dest + ".state.json", "w").write("{}")   # Left over from an earlier ranged attempt
+    hasher = hashlib.sha256()
+    info, size = run_download(stub, dest, hasher)
+    assert not info.accept_ranges
+    assert size == len(data) and open(dest, "rb").read() == data
+    assert hasher.digest() == hashlib.sha256(data).digest()
+    assert stub.requested == [] and not has_partial(dest)
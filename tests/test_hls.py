@@ -0,0 +1,202 @@
+# download_hls against a local stub CDN: variant choice, AES-128 decryption,
+# byte ranges, per-segment retry, bounded concurrency and in-order feeding of the
+# remuxer. The engine tests swap ffmpeg for `cat` so they check the exact bytes
+# piped in; the end-to-end remux needs a real ffmpeg and is skipped without one.
+import os
+import shutil
+import asyncio
+import subprocess
+import pytest
+from aiohttp import web
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+import hls
+from playlist import is_master, parse_master, parse_media
+from hls import HLSError, download_hls, pick_variant
+
+KEY = bytes(range(16))
+
+
+def encrypt(data: bytes, iv: bytes) -> bytes:
+    padder = padding.PKCS7(128).padder()
+    enc = Cipher(algorithms.AES(KEY), modes.CBC(iv)).encryptor()
+    return enc.update(padder.update(data) + padder.finalize()) + enc.finalize()
+
+
+class StubCdn:
+    # Serves files from a dict with a small latency; `flaky` paths answer 500 that
+    # many times first. Tracks per-path hits and peak concurrent segment requests.
+    def __init__(self, files: dict, flaky: dict = None, latency: float = 0.01):
+        self.files, self.flaky, self.latency = files, dict(flaky or {}), latency
+        self.hits, self.active, self.peak = {}, 0, 0
+
+    async def handler(self, request):
+        name = request.match_info["name"]
+        self.hits[name] = self.hits.get(name, 0) + 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.flaky.get(name, 0) > 0:
+                self.flaky[name] -= 1
+                return web.Response(status=500)
+            if name not in self.files: return web.Response(status=404)
+            data = self.files[name]
+            rng = request.headers.get("Range")
+            if rng:
+                start, end = map(int, rng.split("=", 1)[1].split("-"))
+                return web.Response(body=data[start:end + 1], status=206)
+            return web.Response(body=data)
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def run_against(stub_server):
+    return lambda cdn, scenario: stub_server({("GET", "/{name}"): cdn.handler}, scenario)
+
+
+@pytest.fixture
+def cat_remux(monkeypatch):
+    # ffmpeg stand-in: whatever download_hls pipes in lands verbatim in dest
+    real_exec = asyncio.create_subprocess_exec
+
+    async def fake_exec(*args, **kwargs):
+        assert args[0] == "ffmpeg"
+        return await real_exec("sh", "-c", 'exec cat > "$0"', args[-1], **kwargs)
+    monkeypatch.setattr(hls.asyncio, "create_subprocess_exec", fake_exec)
+    monkeypatch.setattr(hls.random, "random", lambda: 0.0)   # Shortest retry delays
+
+
+def media_playlist(names, key_line=None, endlist=True):
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:0"]
+    if key_line: lines.append(key_line)
+    for n in names: lines += ["#EXTINF:2.0,", n]
+    if endlist: lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines).encode()
+
+
+# ================= Playlist Parsing =================
+def test_parse_media_resolves_urls_keys_and_byteranges():
+    text = "\n".join([
+        "#EXTM3U", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:7",
+        '#EXT-X-KEY:METHOD=AES-128,URI="k.bin",IV=0x000102030405060708090a0b0c0d0e0f',
+        "#EXTINF:4.0,", "#EXT-X-BYTERANGE:100@0", "all.ts",
+        "#EXTINF:3.5,", "#EXT-X-BYTERANGE:50", "all.ts",
+        "#EXT-X-KEY:METHOD=NONE", "#EXTINF:1.0,", "/abs/c.ts",
+        "#EXT-X-ENDLIST",
+    ])
+    pl = parse_media(text, "https://cdn.example/v/index.m3u8")
+    assert pl.ended and pl.target_duration == 4 and pl.duration == 8.5
+    a, b, c = pl.segments
+    assert (a.sequence, b.sequence, c.sequence) == (7, 8, 9)
+    assert a.url == "https://cdn.example/v/all.ts" and c.url == "https://cdn.example/abs/c.ts"
+    assert a.byterange == (100, 0) and b.byterange == (50, 100)   # Offset continues from the previous range
+    assert a.key.uri == "https://cdn.example/v/k.bin" and a.key.iv == bytes(range(16))
+    assert c.key is None
+
+
+def test_pick_variant_respects_max_height():
+    master = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360", "360.m3u8",
+        '#EXT-X-STREAM-INF:BANDWIDTH=5000000,RESOLUTION=1920x1080,CODECS="avc1,mp4a"', "1080.m3u8",
+        "#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720", "720.m3u8",
+    ])
+    assert is_master(master) and len(parse_master(master, "https://c/m.m3u8")) == 3
+    assert pick_variant(master, "https://c/m.m3u8") == "https://c/1080.m3u8"
+    assert pick_variant(master, "https://c/m.m3u8", max_height=720) == "https://c/720.m3u8"
+    assert pick_variant(master, "https://c/m.m3u8", max_height=100) == "https://c/1080.m3u8"   # Nothing fits: best available
+
+
+# ================= Download Engine =================
+def test_segments_are_fed_in_order_with_bounded_concurrency(tmp_path, cat_remux, run_against):
+    segs = {f"s{i}.ts": os.urandom(1000 + i) for i in range(40)}
+    cdn = StubCdn({"index.m3u8": media_playlist(list(segs)), **segs}, latency=0.02)
+    dest = str(tmp_path / "out.mp4")
+    written = run_against(cdn, lambda base: download_hls(base + "index.m3u8", dest, concurrency=4))
+    expected = b"".join(segs.values())
+    assert written == len(expected)
+    assert open(dest, "rb").read() == expected
+    assert 1 < cdn.peak <= 4   # Segments overlap but never exceed the limit
+
+
+def test_master_playlist_and_aes128(tmp_path, cat_remux, run_against):
+    plain = [os.urandom(3000) for _ in range(5)]
+    files = {f"e{i}.ts": encrypt(p, i.to_bytes(16, "big")) for i, p in enumerate(plain)}   # IV = media sequence
+    files["key.bin"] = KEY
+    files["media.m3u8"] = media_playlist(list(files)[:5], '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"')
+    files["master.m3u8"] = b"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1000,RESOLUTION=640x360\nmedia.m3u8\n"
+    cdn = StubCdn(files)
+    dest = str(tmp_path / "out.mp4")
+    run_against(cdn, lambda base: download_hls(base + "master.m3u8", dest))
+    assert open(dest, "rb").read() == b"".join(plain)
+    assert cdn.hits["key.bin"] == 1   # Fetched once, shared by every segment
+
+
+def test_byterange_segments_of_one_file(tmp_path, cat_remux, run_against):
+    blob = os.urandom(3000)
+    playlist = b"#EXTM3U\n#EXT-X-TARGETDURATION:2\n" + b"".join(
+        b"#EXTINF:2.0,\n#EXT-X-BYTERANGE:1000@%d\nall.ts\n" % off for off in (0, 1000, 2000)) + b"#EXT-X-ENDLIST\n"
+    cdn = StubCdn({"index.m3u8": playlist, "all.ts": blob})
+    dest = str(tmp_path / "out.mp4")
+    run_against(cdn, lambda base: download_hls(base + "index.m3u8", dest))
+    assert open(dest, "rb").read() == blob
+    assert cdn.hits["all.ts"] == 3
+
+
+def test_failed_segment_is_retried(tmp_path, cat_remux, run_against):
+    segs = {f"s{i}.ts": os.urandom(500) for i in range(4)}
+    cdn = StubCdn({"index.m3u8": media_playlist(list(segs)), **segs}, flaky={"s2.ts": 2})
+    dest = str(tmp_path / "out.mp4")
+    run_against(cdn, lambda base: download_hls(base + "index.m3u8", dest))
+    assert open(dest, "rb").read() == b"".join(segs.values())
+    assert cdn.hits["s2.ts"] == 3 and cdn.hits["s0.ts"] == 1
+
+
+def test_segment_out_of_retries_fails_and_removes_output(tmp_path, cat_remux, monkeypatch, run_against):
+    monkeypatch.setattr(hls, "HLS_SEGMENT_RETRIES", 1)
+    segs = {f"s{i}.ts": os.urandom(500) for i in range(3)}
+    cdn = StubCdn({"index.m3u8": media_playlist(list(segs)), **segs}, flaky={"s1.ts": 5})
+    dest = str(tmp_path / "out.mp4")
+    with pytest.raises(HLSError, match="HTTP 500"):
+        run_against(cdn, lambda base: download_hls(base + "index.m3u8", dest))
+    assert cdn.hits["s1.ts"] == 2
+    assert not os.path.exists(dest)
+
+
+def test_live_and_unsupported_playlists_are_refused(tmp_path, cat_remux, run_against):
+    cdn = StubCdn({
+        "live.m3u8": media_playlist(["a.ts"], endlist=False),
+        "sample.m3u8": media_playlist(["a.ts"], '#EXT-X-KEY:METHOD=SAMPLE-AES,URI="k"'),
+    })
+    dest = str(tmp_path / "out.mp4")
+
+    async def scenario(base):
+        with pytest.raises(HLSError, match="Live"):
+            await download_hls(base + "live.m3u8", dest)
+        with pytest.raises(HLSError, match="AES-128"):
+            await download_hls(base + "sample.m3u8", dest)
+    run_against(cdn, scenario)
+
+
+# ================= End to End =================
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg not installed")
+def test_remux_real_segments_to_mp4(tmp_path, run_against):
+    folder = tmp_path / "src"
+    folder.mkdir()
+    subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=25:duration=6",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "50", "-f", "hls", "-hls_time", "2", "-hls_list_size", "0",
+        "-hls_segment_filename", str(folder / "seg%02d.ts"), str(folder / "index.m3u8"),
+    ], check=True)
+    files = {p.name: p.read_bytes() for p in folder.iterdir()}
+    files = {n: encrypt(d, int(n[3:5]).to_bytes(16, "big")) if n.endswith(".ts") else d for n, d in files.items()}
+    files["key.bin"] = KEY
+    files["index.m3u8"] = files["index.m3u8"].replace(b"#EXTINF", b'#EXT-X-KEY:METHOD=AES-128,URI="key.bin"\n#EXTINF', 1)
+    dest = str(tmp_path / "out.mp4")
+    run_against(StubCdn(files), lambda base: download_hls(base + "index.m3u8", dest))
+    probe = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", dest],
+                           capture_output=True, text=True, check=True)
+    assert float(probe.stdout) == pytest.approx(6, abs=0.5)
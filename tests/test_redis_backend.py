@@ -0,0 +1,114 @@
+# RedisBackend against fakeredis: leases, claims, the per-bot deletion queue and
+# link refcounting (a vault message is orphaned only when no link uses it).
+import asyncio
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import backends
+from backends import RedisBackend, Leadership
+
+
+def make_backend() -> RedisBackend:
+    b = RedisBackend.__new__(RedisBackend)
+    b.r = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return b
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_lease_is_exclusive_renewable_and_released():
+    async def scenario():
+        b = make_backend()
+        assert await b.acquire("duty", "a", 10)
+        assert not await b.acquire("duty", "b", 10)
+        assert await b.acquire("duty", "a", 10)       # Renewal by the holder
+        await b.release("duty", "b")                   # Not the holder: no effect
+        assert not await b.acquire("duty", "b", 10)
+        await b.release("duty", "a")
+        assert await b.acquire("duty", "b", 10)
+    run(scenario())
+
+
+def test_lease_expires_without_renewal():
+    async def scenario():
+        b = make_backend()
+        assert await b.acquire("duty", "a", 0.05)
+        await asyncio.sleep(0.1)
+        assert await b.acquire("duty", "b", 10)
+    run(scenario())
+
+
+def test_leadership_fails_over(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(backends, "backend", make_backend())
+        first, second = Leadership("duty", ttl=0.3, owner="a"), Leadership("duty", ttl=0.3, owner="b")
+        await first.start()
+        await second.start()
+        assert first.is_leader and not second.is_leader
+        await first.stop()                             # Releases the lease on the way out
+        await asyncio.sleep(0.25)
+        assert second.is_leader
+        await second.stop()
+    run(scenario())
+
+
+def test_claim_first_caller_wins():
+    async def scenario():
+        b = make_backend()
+        results = await asyncio.gather(*(b.claim("update:bot:1:2", f"w{i}", 60) for i in range(5)))
+        assert results.count(True) == 1
+        assert await b.claim("update:bot:1:3", "w1", 60)
+    run(scenario())
+
+
+def test_setdefault_keeps_first_value():
+    async def scenario():
+        b = make_backend()
+        values = await asyncio.gather(*(b.setdefault("media_group_cache", "g1", f"link{i}", 60) for i in range(5)))
+        assert len(set(values)) == 1
+        assert await b.get("media_group_cache", "g1") == values[0]
+    run(scenario())
+
+
+def test_deletions_are_paged_per_bot():
+    async def scenario():
+        b = make_backend()
+        await b.schedule_deletions("other_bot", 1, list(range(100)), due_at=10)
+        await b.schedule_deletions("me", 2, [5, 6], due_at=20)
+        await b.schedule_deletions("me", 2, [7], due_at=50)
+        # Another bot's backlog must not crowd this node's rows out of the page
+        rows = await b.due_deletions(["me"], until=30, limit=10)
+        assert rows == [(20.0, "me", 2, 5), (20.0, "me", 2, 6)]
+        assert len(await b.due_deletions(["me", "other_bot"], until=30, limit=10)) == 10
+        assert await b.count_deletions() == 103
+        await b.remove_deletions([("me", 2, 5), ("me", 2, 6)])
+        assert await b.due_deletions(["me"], until=30, limit=10) == []
+        assert await b.count_deletions() == 101
+    run(scenario())
+
+
+def test_link_refcounting():
+    async def scenario():
+        b = make_backend()
+        await b.add_link("l1", [1, 2])
+        await b.add_link("l2", [2, 3])
+        await b.add_file("l2", 4)
+        assert await b.get_messages_for_link("l2") == [2, 3, 4]
+
+        ids, orphaned = await b.delete_link("l1")
+        assert ids == [1, 2] and orphaned == [1]      # 2 is still used by l2
+        assert await b.get_messages_for_link("l1") == []
+
+        # Evicting every message of a link removes the link itself
+        assert await b.evict_messages([2, 3]) == []
+        assert await b.get_messages_for_link("l2") == [4]
+        assert await b.evict_messages([4]) == ["l2"]
+
+        await b.add_link("l3", [9])
+        await b.purge_links()
+        assert await b.get_messages_for_link("l3") == []
+        assert await b.r.keys("*msg*") == []
+    run(scenario())
@@ -0,0 +1,182 @@
+# XapiResolver against a local stub of the xapiverse API: retries with backoff,
+# the circuit breaker's open/half-open/closed cycle, and the positive/negative
+# caches (positive TTL capped by the signed URL's expiry).
+import time
+import asyncio
+import pytest
+from aiohttp import web
+
+import xapi
+from state import StateStore
+from xapi import CircuitBreaker, XapiError, XapiRejected, XapiResolver, XapiUnavailable, url_expiry
+
+
+def ok(url="https://cdn.example/v.mp4"):
+    return {"status": "success", "list": [{"name": "v.mp4", "stream_url": url}]}
+
+
+class StubApi:
+    # Answers each POST with the next scripted (status, json) pair; the last one repeats
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def handler(self, request):
+        status, body = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        return web.json_response(body, status=status)
+
+
+@pytest.fixture
+def run_against(stub_server, monkeypatch):
+    # Points XAPI_URL at the stub for the duration of scenario()
+    def run(stub: StubApi, scenario):
+        async def main(base):
+            monkeypatch.setattr(xapi, "XAPI_URL", base + "api")
+            return await scenario()
+        return stub_server({("POST", "/api"): stub.handler}, main)
+    return run
+
+
+@pytest.fixture
+def resolver():
+    r = XapiResolver()
+    r.positive = StateStore("test_xapi_positive", ttl=xapi.XAPI_POSITIVE_TTL, max_entries=100)
+    r.negative = StateStore("test_xapi_negative", ttl=xapi.XAPI_NEGATIVE_TTL, max_entries=100)
+    r.credits = StateStore("test_xapi_credits", ttl=None, max_entries=16)
+    return r
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    # Records each retry's jitter ceiling and skips the actual wait
+    ceilings = []
+    monkeypatch.setattr(xapi.random, "uniform", lambda lo, hi: ceilings.append(hi) or 0)
+    return ceilings
+
+
+# ================= Circuit Breaker =================
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown():
+    b = CircuitBreaker(threshold=3, cooldown=0.05)
+    for _ in range(2): b.failure()
+    assert b.state == "closed" and b.allow()
+    b.failure()
+    assert b.state == "open" and not b.allow()
+    time.sleep(0.06)
+    assert b.state == "half_open"
+    assert b.allow()            # One trial call...
+    assert not b.allow()        # ...and only one
+    b.success()
+    assert b.state == "closed" and b.failures == 0 and b.trips == 1
+
+
+def test_breaker_failed_trial_reopens_for_another_cooldown():
+    b = CircuitBreaker(threshold=1, cooldown=0.05)
+    b.failure()
+    time.sleep(0.06)
+    assert b.allow()
+    b.failure()
+    assert b.state == "open" and not b.allow()
+    assert b.trips == 2
+
+
+# ================= Retries and Backoff =================
+def test_transient_errors_are_retried_with_doubling_backoff(resolver, backoffs, run_against):
+    stub = StubApi((503, {}), (429, {}), (200, ok()))
+    file = run_against(stub, lambda: resolver.resolve("k1", "https://terabox.com/s/1k1"))
+    assert file.mp4_url == "https://cdn.example/v.mp4" and not file.cached
+    assert stub.calls == 3
+    assert backoffs == [xapi.XAPI_BACKOFF, xapi.XAPI_BACKOFF * 2]
+    assert resolver.breaker.state == "closed" and resolver.breaker.failures == 0
+
+
+def test_gives_up_after_attempts(resolver, backoffs, run_against):
+    stub = StubApi((500, {}))
+    with pytest.raises(XapiError):
+        run_against(stub, lambda: resolver.resolve("k2", "https://terabox.com/s/1k2"))
+    assert stub.calls == xapi.XAPI_ATTEMPTS
+    assert resolver.breaker.failures == xapi.XAPI_ATTEMPTS
+    assert resolver.positive.get("k2") is None and resolver.negative.get("k2") is None
+
+
+def test_open_breaker_fails_fast_without_calling(resolver, backoffs, run_against):
+    resolver.breaker = CircuitBreaker(threshold=2, cooldown=60)
+    stub = StubApi((500, {}))
+
+    async def scenario():
+        with pytest.raises(XapiUnavailable):
+            await resolver.resolve("k3", "https://terabox.com/s/1k3")
+        calls = stub.calls
+        with pytest.raises(XapiUnavailable):
+            await resolver.resolve("k4", "https://terabox.com/s/1k4")
+        return calls
+
+    assert run_against(stub, scenario) == 2
+    assert stub.calls == 2   # The second resolve never reached the API
+
+
+# ================= Caches =================
+def test_positive_cache_ttl_is_capped_by_url_expiry(resolver, backoffs, run_against):
+    issued = int(time.time())
+    url = f"https://d.terabox.com/file?time={issued}&expires=1h"
+    assert url_expiry(url) == issued + 3600
+    stub = StubApi((200, ok(url)))
+
+    async def scenario():
+        first = await resolver.resolve("k5", "https://terabox.com/s/1k5")
+        second = await resolver.resolve("k5", "https://terabox.com/s/1k5")
+        return first, second
+
+    first, second = run_against(stub, scenario)
+    assert stub.calls == 1 and not first.cached and second.cached
+    _, expires_at = resolver.positive._data["k5"]
+    ttl = expires_at - time.time()
+    assert 3600 - xapi.XAPI_EXPIRY_MARGIN - 5 < ttl <= 3600 - xapi.XAPI_EXPIRY_MARGIN
+
+
+def test_urls_too_close_to_expiry_are_not_cached(resolver, backoffs, run_against):
+    url = f"https://d.terabox.com/file?time={int(time.time())}&expires=60s"
+    stub = StubApi((200, ok(url)))
+    run_against(stub, lambda: resolver.resolve("k6", "https://terabox.com/s/1k6"))
+    assert resolver.positive.get("k6") is None
+
+
+def test_rejected_share_is_negative_cached(resolver, backoffs, run_against):
+    stub = StubApi((200, {"status": "failed", "message": "share deleted"}))
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(XapiRejected, match="share deleted"):
+                await resolver.resolve("k7", "https://terabox.com/s/1k7")
+
+    run_against(stub, scenario)
+    assert stub.calls == 1 and backoffs == []
+    assert resolver.breaker.failures == 0   # A rejection is not an API fault
+    assert resolver.credits.get(time.strftime("%Y-%m-%d", time.gmtime()))["negative_hits"] == 1
+
+
+def test_cancelled_trial_call_frees_the_half_open_slot(resolver, backoffs, run_against):
+    resolver.breaker = CircuitBreaker(threshold=1, cooldown=0)
+    resolver.breaker.failure()
+    assert resolver.breaker.state == "half_open"
+
+    class SlowApi(StubApi):
+        async def handler(self, request):
+            self.calls += 1
+            if self.calls == 1: await self.gate.wait()   # Hangs until the test is done with it
+            return web.json_response(ok())
+
+    stub = SlowApi()
+
+    async def scenario():
+        stub.gate = asyncio.Event()
+        trial = asyncio.create_task(resolver.resolve("k8", "https://terabox.com/s/1k8"))
+        while not stub.calls: await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        try: return await resolver.resolve("k8", "https://terabox.com/s/1k8")
+        finally: stub.gate.set()
+
+    assert run_against(stub, scenario).mp4_url
+    assert stub.calls == 2 and resolver.breaker.state == "closed"
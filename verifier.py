@@ -0,0 +1,104 @@
+import time
+import asyncio
+import logging
+from typing import List, Optional
+from pyrogram import Client
+from storage import db
+from delivery import call_with_flood_wait
+from backends import backend
+from metrics import registry
+from jobs import spawn
+
+# ================= Configuration =================
+VERIFY_INTERVAL = 300          # Seconds between sweeps
+VERIFY_PER_SWEEP = 1000        # Messages checked per sweep (5 get_messages calls)
+VERIFY_BATCH = 200             # Telegram's per-call limit for get_messages
+VERIFY_TRUST = 6 * 3600        # A message checked this recently is assumed to still exist
+
+log = logging.getLogger("verifier")
+
+
+def trusted(verified_at: Optional[float]) -> bool:
+    # Hot paths skip their own get_messages when the sweep vouched for the message recently
+    return bool(verified_at) and time.time() - verified_at < VERIFY_TRUST
+
+
+# ================= Vault Verifier =================
+class VaultVerifier:
+    # Messages deleted from the vault channel by hand leave dead rows behind: links
+    # that deliver nothing, Terabox/dedup hits that fail on copy. This walks
+    # vault_messages oldest-check-first, asks Telegram about VERIFY_BATCH ids per
+    # call and evicts every reference to the ones that are gone. Live ones get a
+    # fresh verified_at. Delivery failures are rechecked right away instead of
+    # waiting for their turn.
+
+    def __init__(self):
+        self.client: Optional[Client] = None
+        self.chat_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.checked = self.evicted = 0
+
+    def attach(self, client: Client, chat_id: int):
+        self.client, self.chat_id = client, chat_id
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def check(self, message_ids: List[int]) -> List[int]:
+        # Returns the ids that no longer exist (and have been evicted)
+        alive, dead = [], []
+        message_ids = list(dict.fromkeys(message_ids))
+        for i in range(0, len(message_ids), VERIFY_BATCH):
+            chunk = message_ids[i:i + VERIFY_BATCH]
+            msgs = await call_with_flood_wait(self.client.get_messages, self.chat_id, chunk)
+            for m in msgs:
+                (dead if m.empty else alive).append(m.id)
+        self.checked += len(message_ids)
+        if alive: await db.mark_verified(alive)
+        if dead:
+            dead_links = await backend.evict_messages(dead)
+            self.evicted += len(dead)
+            log.info(f"Evicted {len(dead)} deleted vault message(s); {len(dead_links)} link(s) left empty and removed")
+        return dead
+
+    def recheck(self, message_ids: List[int]):
+        # Fire-and-forget for a failed delivery: it may be a dead message or just a blocked user
+        if message_ids and self.client:
+            spawn(self._safe_check(message_ids))
+
+    async def _safe_check(self, message_ids: List[int]):
+        try: await self.check(message_ids)
+        except Exception as e: log.warning(f"Recheck of {message_ids[:5]} failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                # Per node: vault_messages lives in this node's SQLite next to the caches it guards
+                stale = await db.stale_vault_messages(time.time() - VERIFY_TRUST, VERIFY_PER_SWEEP)
+                if stale: await self.check(stale)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Verification sweep failed: {e}")
+            await asyncio.sleep(VERIFY_INTERVAL)
+
+    def stats(self) -> dict:
+        return {"checked": self.checked, "evicted": self.evicted}
+
+
+verifier = VaultVerifier()
+
+
+@registry.collector
+def _collect_verifier():
+    s = verifier.stats()
+    yield "vault_messages_checked_total", "counter", "Vault messages looked up by the verifier", [({}, s["checked"])]
+    yield "vault_messages_evicted_total", "counter", "Vault messages found deleted and evicted", [({}, s["evicted"])]
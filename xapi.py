@@ -0,0 +1,251 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import urllib.parse
+from dataclasses import dataclass
+from typing import Optional
+from http_client import http, timeout
+from state import StateStore
+from metrics import registry
+
+# ================= Configuration =================
+XAPI_URL = os.getenv("XAPI_URL", "https://xapiverse.com/api/terabox-pro")
+XAPI_KEY = os.getenv("XAPI_KEY", "YOUR_XAPIVERSE_KEY")
+XAPI_TIMEOUT = timeout(total=60)
+XAPI_ATTEMPTS = 3                      # Calls per resolve before giving up
+XAPI_BACKOFF = 1.0                     # First retry waits up to this long, doubling (full jitter)
+XAPI_BACKOFF_MAX = 10.0
+XAPI_POSITIVE_TTL = 3600               # Cap on a cached answer; signed URL expiry usually cuts it shorter
+XAPI_EXPIRY_MARGIN = 300               # Cached URLs must stay valid at least this long for a download
+XAPI_NEGATIVE_TTL = int(os.getenv("XAPI_NEGATIVE_TTL", str(6 * 3600)))   # Dead shares aren't re-asked for this long
+XAPI_BREAKER_THRESHOLD = 5             # Consecutive API errors that open the circuit
+XAPI_BREAKER_COOLDOWN = 120            # Seconds open before one trial call is let through
+
+log = logging.getLogger("xapi")
+call_seconds = registry.histogram("xapi_request_seconds", "xapiverse API round trips by outcome", ("outcome",))
+
+
+class XapiError(Exception):
+    # API unreachable or misbehaving; counts towards the circuit breaker
+    pass
+
+class XapiRejected(XapiError):
+    # The API looked at the share and said no (deleted, private...); negative-cached
+    pass
+
+class XapiUnavailable(XapiError):
+    # Circuit open: failed fast, no call made, no credit spent
+    pass
+
+
+@dataclass
+class XapiFile:
+    name: str
+    size_formatted: str
+    duration: str
+    thumbnail: Optional[str]
+    m3u8_url: Optional[str]
+    mp4_url: Optional[str]
+    cached: bool = False
+
+    @classmethod
+    def from_api(cls, file_data: dict, cached: bool = False) -> "XapiFile":
+        m3u8_url = None
+        streams = file_data.get("fast_stream_url")
+        if isinstance(streams, dict):
+            m3u8_url = streams.get("1080p") or streams.get("720p") or streams.get("480p") or streams.get("360p")
+        return cls(
+            name=file_data.get("name", "terabox_video.mp4"),
+            size_formatted=file_data.get("size_formatted", "Unknown"),
+            duration=file_data.get("duration", "00:00"),
+            thumbnail=file_data.get("thumbnail"),
+            m3u8_url=m3u8_url,
+            mp4_url=file_data.get("stream_url") or file_data.get("fast_download_link") or file_data.get("download_link"),
+            cached=cached,
+        )
+
+    def urls(self):
+        return [u for u in (self.m3u8_url, self.mp4_url) if u]
+
+
+# ================= Signed URL Expiry =================
+def _seconds(value: str) -> Optional[float]:
+    m = re.fullmatch(r"(\d+)([smhd]?)", value.strip().lower())
+    if not m: return None
+    return int(m.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}[m.group(2)]
+
+def url_expiry(url: str) -> Optional[float]:
+    # Terabox dlinks carry time=<issued>&expires=8h; other CDNs an absolute Expires=<epoch>
+    q = {k.lower(): v[0] for k, v in urllib.parse.parse_qs(urllib.parse.urlparse(url).query).items()}
+    issued, expires = q.get("time"), q.get("expires") or q.get("x-amz-expires")
+    if expires:
+        span = _seconds(expires)
+        if span is not None and span > 1e9: return span          # Already an epoch
+        if span is not None and issued and issued.isdigit(): return int(issued) + span
+    return None
+
+
+# ================= Circuit Breaker =================
+class CircuitBreaker:
+    # closed -> (threshold consecutive failures) -> open -> (cooldown) -> half-open:
+    # one trial call; success closes it, failure re-opens it for another cooldown.
+
+    def __init__(self, threshold: int = XAPI_BREAKER_THRESHOLD, cooldown: float = XAPI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed": return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures, self.opened_at, self._trial = 0, None, False
+
+    def release(self):
+        # The call was abandoned (cancelled) before it said anything about the API:
+        # give the trial slot back so the next caller can make it
+        self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            if self.opened_at is None or self._trial: self.trips += 1
+            self.opened_at, self._trial = time.monotonic(), False
+
+
+# ================= Resolver =================
+class XapiResolver:
+    # Share key -> stream URLs through the paid xapiverse API, spending as few
+    # credits as possible: answers are cached until their signed URLs are about to
+    # expire, dead shares are remembered for XAPI_NEGATIVE_TTL, transient errors
+    # are retried with jittered exponential backoff, and a sustained outage opens
+    # a circuit breaker so requests fail fast instead of queueing on timeouts.
+    # Calls are counted per UTC day (persisted) for the credit budget.
+
+    def __init__(self):
+        self.positive = StateStore("xapi_positive", ttl=XAPI_POSITIVE_TTL, max_entries=5000, persist=True)
+        self.negative = StateStore("xapi_negative", ttl=XAPI_NEGATIVE_TTL, max_entries=20000, persist=True)
+        self.credits = StateStore("xapi_credits", ttl=8 * 86400, max_entries=16, persist=True)
+        self.breaker = CircuitBreaker()
+
+    async def load(self):
+        for store in (self.positive, self.negative, self.credits):
+            await store.load()
+
+    def _count(self, field: str):
+        day = time.strftime("%Y-%m-%d", time.gmtime())
+        counts = dict(self.credits.get(day) or {})
+        counts[field] = counts.get(field, 0) + 1
+        self.credits.set(day, counts)
+
+    def invalidate(self, share_key: str):
+        # The cached URLs stopped working before their advertised expiry
+        self.positive.pop(share_key)
+
+    async def resolve(self, share_key: str, url: str) -> XapiFile:
+        cached = self.positive.get(share_key)
+        if cached:
+            self._count("cache_hits")
+            return XapiFile.from_api(cached, cached=True)
+        reason = self.negative.get(share_key)
+        if reason:
+            self._count("negative_hits")
+            raise XapiRejected(reason)
+
+        last_error: Optional[Exception] = None
+        for attempt in range(XAPI_ATTEMPTS):
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                raise XapiUnavailable(f"circuit open after {self.breaker.failures} consecutive API errors")
+            try:
+                if attempt:
+                    await asyncio.sleep(random.uniform(0, min(XAPI_BACKOFF * 2 ** (attempt - 1), XAPI_BACKOFF_MAX)))
+                file_data = await self._call(url)
+            except XapiRejected as e:
+                self.breaker.success()   # The API is healthy, the share isn't
+                self.negative.set(share_key, str(e)[:200])
+                raise
+            except Exception as e:
+                self.breaker.failure()
+                self._count("errors")
+                last_error = e
+                log.warning(f"xapiverse attempt {attempt + 1}/{XAPI_ATTEMPTS} failed: {e!r}")
+                continue
+            except BaseException:
+                self.breaker.release()   # Cancelled: a held half-open trial would block every later call
+                raise
+            self.breaker.success()
+            self._remember(share_key, file_data)
+            return XapiFile.from_api(file_data)
+        raise XapiError(f"xapiverse failed {XAPI_ATTEMPTS} times: {last_error!r}")
+
+    async def _call(self, url: str) -> dict:
+        self._count("calls")
+        headers = {'Content-Type': 'application/json', 'xAPIverse-Key': XAPI_KEY}
+        started = time.monotonic()
+        try:
+            async with http.session.post(XAPI_URL, json={"url": url}, headers=headers, timeout=XAPI_TIMEOUT) as resp:
+                if resp.status >= 500 or resp.status == 429:
+                    raise XapiError(f"HTTP {resp.status}")
+                data = await resp.json(content_type=None)
+        except BaseException:
+            call_seconds.observe(time.monotonic() - started, outcome="error")
+            raise
+        outcome = {"success": "success", "failed": "rejected"}.get(data.get("status"), "error")
+        call_seconds.observe(time.monotonic() - started, outcome=outcome)
+        if data.get("status") == "success" and data.get("list"):
+            self._count("successes")
+            return data["list"][0]
+        if data.get("status") == "failed":
+            self._count("rejections")
+            raise XapiRejected(data.get("message") or "failed")
+        raise XapiError(f"Unexpected response: {str(data)[:200]}")
+
+    def _remember(self, share_key: str, file_data: dict):
+        # Only as long as every signed URL in it stays usable for a download
+        file = XapiFile.from_api(file_data)
+        ttl = XAPI_POSITIVE_TTL
+        for u in file.urls():
+            expiry = url_expiry(u)
+            if expiry: ttl = min(ttl, expiry - time.time() - XAPI_EXPIRY_MARGIN)
+        if ttl > 0 and file.urls():
+            self.positive.set(share_key, file_data, ttl=ttl)
+
+    # --- Metrics ---
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "consecutive_errors": self.breaker.failures,
+            "positive_cached": len(self.positive),
+            "negative_cached": len(self.negative),
+            "today": self.credits.get(time.strftime("%Y-%m-%d", time.gmtime())) or {},
+        }
+
+
+xapi = XapiResolver()
+
+
+@registry.collector
+def _collect_xapi():
+    s = xapi.stats()
+    yield "xapi_breaker_state", "gauge", "1 for the circuit breaker's current state", [({"state": st}, int(s["breaker"] == st)) for st in ("closed", "half_open", "open")]
+    yield "xapi_breaker_trips_total", "counter", "Times the circuit breaker opened", [({}, s["breaker_trips"])]
+    yield "xapi_cached_entries", "gauge", "Resolver cache size", [({"kind": "positive"}, s["positive_cached"]), ({"kind": "negative"}, s["negative_cached"])]
+    yield "xapi_today", "gauge", "Today's (UTC) resolver counters; calls is the credits spent", [({"counter": k}, v) for k, v in s["today"].items()]